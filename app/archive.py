@@ -0,0 +1,380 @@
+import json
+import zlib
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from app.db import SessionLocal, utcnow
+from app.models import Transaction, TransactionArchive, TransactionChange
+from app.hashing import content_hash
+from app.change_feed import transaction_to_dict
+from app.buckets import BucketDeltas
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Cold tier: transactions older than HOT_RETENTION_DAYS live in one zlib-compressed
+# JSON segment per (account, month) instead of the hot transactions table.
+
+def hot_cutoff(max_age_days: int = None) -> datetime:
+    """Oldest posted_at that still belongs in the hot table (naive UTC)."""
+    max_age_days = settings.HOT_RETENTION_DAYS if max_age_days is None else max_age_days
+    return utcnow().replace(tzinfo=None) - timedelta(days=max_age_days)
+
+def month_key(posted_at: datetime) -> str:
+    return posted_at.strftime("%Y-%m")
+
+# Segment payload: zlib-compressed JSON lines, one [provider_txn_id, row] per
+# line. Readers and writers stream a segment through once, so they hold the
+# rows they touch (a page's worth) plus the compressed bytes, never the whole
+# decoded month. Segments written before this format are a single JSON object
+# {provider_txn_id: row}; they are still read, and rewritten as lines on
+# their next write.
+
+_CHUNK = 64 * 1024
+
+def _decompressed_chunks(payload: bytes):
+    decompressor = zlib.decompressobj()
+    data = payload
+    while data:
+        chunk = decompressor.decompress(data, _CHUNK)
+        data = decompressor.unconsumed_tail
+        if chunk:
+            yield chunk
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+def _iter_payload(payload: bytes):
+    """(provider_txn_id, row) for every row in a segment payload, decompressed incrementally."""
+    if not payload:
+        return
+    chunks = _decompressed_chunks(payload)
+    buffer = b""
+    for n, chunk in enumerate(chunks):
+        if n == 0 and chunk[:1] == b"{":
+            # Old single-object format
+            yield from json.loads(chunk + b"".join(chunks)).items()
+            return
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            if line:
+                yield tuple(json.loads(line))
+    if buffer:
+        yield tuple(json.loads(buffer))
+
+class _SegmentWriter:
+    def __init__(self):
+        self._compressor = zlib.compressobj(6)
+        self._parts = []
+        self.count = 0
+
+    def write(self, provider_txn_id: str, row: dict):
+        line = json.dumps([provider_txn_id, row], separators=(",", ":")).encode("utf-8") + b"\n"
+        self._parts.append(self._compressor.compress(line))
+        self.count += 1
+
+    def finish(self) -> bytes:
+        self._parts.append(self._compressor.flush())
+        return b"".join(self._parts)
+
+def _row_from_txn(txn: Transaction) -> dict:
+    return {
+        # The hot row's identity, so an archived row still answers with it
+        "id": txn.id,
+        "created_at": txn.created_at.isoformat() if txn.created_at else None,
+        "provider_txn_id": txn.provider_txn_id,
+        "amount": txn.amount,
+        "currency": txn.currency,
+        "description": txn.description,
+        "posted_at": txn.posted_at.isoformat(),
+        "raw_json": txn.raw_json,
+        "content_hash": txn.content_hash,
+    }
+
+def _row_from_item(item: dict, item_hash: str) -> dict:
+    return {
+        "provider_txn_id": item["id"],
+        "amount": item["amount"],
+        "currency": item["currency"],
+        "description": item["description"],
+        "posted_at": datetime.fromisoformat(item["posted_at"]).isoformat(),
+        "raw_json": str(item),
+        "content_hash": item_hash,
+    }
+
+class ArchiveConflictError(Exception):
+    """A segment changed between being read and written back"""
+    pass
+
+def _lock_segment(db: Session, account_id: str, month: str):
+    """
+    Write-lock a segment before reading it, for the rest of the transaction.
+    A segment is read, merged and written back whole, and a plain SELECT
+    doesn't start a transaction under pysqlite, so two writers could both
+    read it and the second write would drop the first one's rows. Starting
+    with a write takes SQLite's database write lock (a row lock elsewhere),
+    so the read that follows is current and stays current until commit.
+    """
+    db.query(TransactionArchive).filter(
+        TransactionArchive.account_id == account_id,
+        TransactionArchive.month == month
+    ).update({"version": TransactionArchive.version + 1}, synchronize_session=False)
+
+def _load_segment(db: Session, account_id: str, month: str):
+    """The locked segment row (payload still compressed), or None if the month has none yet."""
+    _lock_segment(db, account_id, month)
+    return db.query(TransactionArchive).filter(
+        TransactionArchive.account_id == account_id,
+        TransactionArchive.month == month
+    ).populate_existing().first()
+
+def _rewrite_segment(db: Session, segment, account_id: str, month: str, touched, merge) -> bool:
+    """
+    Stream a segment once: rows for which touched(provider_txn_id, row) is
+    false are copied as they are; the others are collected and passed to
+    merge(current), which returns (rows to write in their place, changed).
+    An id left out of the returned rows is deleted. The segment is only
+    written (or deleted, once empty) if something changed, and only if its
+    version is still the one read: never over a write we didn't see.
+    """
+    writer = _SegmentWriter()
+    current = {}
+    for provider_txn_id, row in _iter_payload(segment.payload if segment else None):
+        if touched(provider_txn_id, row):
+            current[provider_txn_id] = row
+        else:
+            writer.write(provider_txn_id, row)
+    final, changed = merge(current)
+    if not changed:
+        return False
+    for provider_txn_id, row in final.items():
+        writer.write(provider_txn_id, row)
+    payload = writer.finish()
+
+    if segment is None:
+        if writer.count:
+            db.add(TransactionArchive(account_id=account_id, month=month, payload=payload, row_count=writer.count, version=0))
+        return True
+    same_version = db.query(TransactionArchive).filter(
+        TransactionArchive.id == segment.id,
+        TransactionArchive.version == segment.version
+    )
+    if writer.count:
+        saved = same_version.update({
+            "payload": payload,
+            "row_count": writer.count,
+            "version": TransactionArchive.version + 1,
+        }, synchronize_session=False)
+    else:
+        saved = same_version.delete(synchronize_session=False)
+    if saved != 1:
+        raise ArchiveConflictError(f"Archive segment {account_id} {month} changed while being written")
+    db.expire(segment)
+    return True
+
+def upsert_cold_items(db: Session, account_id: str, items: list, stats: dict, deltas: BucketDeltas):
+    """
+    Idempotent upsert of provider items straight into the cold tier.
+    Used by run_sync for items older than the hot cutoff that aren't in the hot
+    table. Same semantics as the hot path: content-hash no-ops are skipped and
+    real changes go to the change log (with no transaction_id).
+    """
+    by_month = defaultdict(list)
+    for item in items:
+        by_month[month_key(datetime.fromisoformat(item["posted_at"]))].append(item)
+
+    # Sorted, so concurrent writers take segment locks in the same order
+    for month, month_items in sorted(by_month.items()):
+        segment = _load_segment(db, account_id, month)
+        ids = {item["id"] for item in month_items}
+        changes = []
+
+        def merge(current):
+            rows = dict(current)
+            for item in month_items:
+                item_hash = content_hash(item)
+                existing = rows.get(item["id"])
+                if existing and existing.get("content_hash") == item_hash:
+                    stats["unchanged"] += 1
+                    continue
+                row = _row_from_item(item, item_hash)
+                if existing:
+                    deltas.add(existing["posted_at"], existing.get("content_hash"), -1)
+                    # Rows archived from the hot table keep their identity
+                    for key in ("id", "created_at"):
+                        if key in existing:
+                            row[key] = existing[key]
+                deltas.add(item["posted_at"], item_hash)
+                rows[item["id"]] = row
+                changes.append((item["id"], "update" if existing else "insert"))
+                stats["updated" if existing else "inserted"] += 1
+            return rows, bool(changes)
+
+        if _rewrite_segment(db, segment, account_id, month, lambda pid, row: pid in ids, merge):
+            db.add_all([
+                TransactionChange(account_id=account_id, transaction_id=None, provider_txn_id=pid, op=op)
+                for pid, op in changes
+            ])
+            # Later pages in the same transaction must find a segment created here
+            db.flush()
+        stats["routed_cold"] += len(month_items)
+
+def _segment_months(db: Session, account_id: str, start: datetime, end: datetime) -> list:
+    return [month for (month,) in db.query(TransactionArchive.month).filter(
+        TransactionArchive.account_id == account_id,
+        TransactionArchive.month >= month_key(start),
+        TransactionArchive.month <= month_key(end)
+    ).order_by(TransactionArchive.month)]
+
+def _in_range(row: dict, start: datetime, end: datetime) -> bool:
+    return start <= datetime.fromisoformat(row["posted_at"]) < end
+
+def iter_cold_rows(db: Session, account_id: str, start: datetime, end: datetime):
+    """Archived rows posted in [start, end), streamed one segment at a time."""
+    for month in _segment_months(db, account_id, start, end):
+        payload = db.query(TransactionArchive.payload).filter(
+            TransactionArchive.account_id == account_id,
+            TransactionArchive.month == month
+        ).scalar()
+        for _, row in _iter_payload(payload):
+            if _in_range(row, start, end):
+                yield row
+
+def delete_cold_items(db: Session, account_id: str, start: datetime, end: datetime, keep_ids: set) -> int:
+    """
+    Drop archived rows posted in [start, end) whose ids aren't in keep_ids
+    (the provider no longer has them). Deletions go to the change log.
+    """
+    removed = 0
+    for month in _segment_months(db, account_id, start, end):
+        segment = _load_segment(db, account_id, month)
+        if segment is None:
+            continue
+        gone = []
+
+        def merge(current):
+            # Every collected row is one to drop
+            gone.extend(current)
+            return {}, bool(current)
+
+        _rewrite_segment(
+            db, segment, account_id, month,
+            lambda pid, row: _in_range(row, start, end) and pid not in keep_ids,
+            merge
+        )
+        db.add_all([
+            TransactionChange(account_id=account_id, transaction_id=None, provider_txn_id=pid, op="delete")
+            for pid in gone
+        ])
+        removed += len(gone)
+    return removed
+
+def archive_old_transactions(max_age_days: int = None, chunk_size: int = None) -> dict:
+    """
+    Move hot transactions older than max_age_days into per-account, per-month
+    compressed segments. Works in chunks, each merged and deleted from the hot
+    table in one short transaction, so it can be interrupted safely. It can
+    run alongside syncs: segments are locked before they are read, and each
+    chunk is re-read under that lock, so rows a sync changed or removed in
+    the meantime are archived as they are now.
+    """
+    cutoff = hot_cutoff(max_age_days)
+    chunk_size = chunk_size or settings.ARCHIVE_CHUNK_SIZE
+    result = {"archived": 0, "segments_written": 0}
+
+    db = SessionLocal()
+    try:
+        while True:
+            txns = db.query(Transaction).filter(
+                Transaction.posted_at < cutoff
+            ).order_by(Transaction.account_id, Transaction.posted_at, Transaction.id).limit(chunk_size).all()
+            if not txns:
+                break
+            keys = sorted({(txn.account_id, month_key(txn.posted_at)) for txn in txns})
+            for account_id, month in keys:
+                _lock_segment(db, account_id, month)
+            txns = db.query(Transaction).filter(
+                Transaction.id.in_([txn.id for txn in txns]),
+                Transaction.posted_at < cutoff
+            ).with_for_update().populate_existing().all()
+
+            groups = defaultdict(list)
+            for txn in txns:
+                groups[(txn.account_id, month_key(txn.posted_at))].append(txn)
+
+            for (account_id, month), group in sorted(groups.items()):
+                segment = _load_segment(db, account_id, month)
+                archived = {txn.provider_txn_id: _row_from_txn(txn) for txn in group}
+                _rewrite_segment(db, segment, account_id, month, lambda pid, row: pid in archived, lambda current: (archived, True))
+                # The next group may be the same account's next month: find a segment created here
+                db.flush()
+                result["segments_written"] += 1
+
+            archived_ids = [txn.id for txn in txns]
+            db.query(Transaction).filter(Transaction.id.in_(archived_ids)).delete(synchronize_session=False)
+            db.commit()
+            db.expunge_all()
+            result["archived"] += len(archived_ids)
+
+        logger.info(f"Archived {result['archived']} transactions older than {cutoff.isoformat()}")
+        return result
+    finally:
+        db.close()
+
+def _cold_row_to_dict(account_id: str, row: dict) -> dict:
+    return {
+        # None for rows that went straight to the cold tier and never had a hot id
+        "id": row.get("id"),
+        "account_id": account_id,
+        "provider_txn_id": row["provider_txn_id"],
+        "amount": row["amount"],
+        "currency": row["currency"],
+        "description": row["description"],
+        "posted_at": row["posted_at"],
+        "raw_json": row.get("raw_json"),
+        "content_hash": row.get("content_hash"),
+        "created_at": row.get("created_at"),
+        "archived": True,
+    }
+
+def _hot_row_to_dict(txn: Transaction) -> dict:
+    return {
+        **transaction_to_dict(txn),
+        "raw_json": txn.raw_json,
+        "content_hash": txn.content_hash,
+        "created_at": txn.created_at.isoformat() if txn.created_at else None,
+        "archived": False,
+    }
+
+def list_transactions_tiered(db: Session, account_id: str, limit: int = 200) -> list:
+    """
+    Newest-first transactions across both tiers. The hot table answers most
+    reads alone; cold segments are only opened, newest month first, while
+    they could still contribute to the first `limit` rows.
+    """
+    hot = db.query(Transaction).filter(
+        Transaction.account_id == account_id
+    ).order_by(Transaction.posted_at.desc()).limit(limit).all()
+    merged = [_hot_row_to_dict(t) for t in hot]
+
+    segments = db.query(TransactionArchive.id, TransactionArchive.month).filter(
+        TransactionArchive.account_id == account_id
+    ).order_by(TransactionArchive.month.desc()).all()
+
+    for segment_id, month in segments:
+        if len(merged) >= limit:
+            # Everything in this month is older than the start of the next month
+            kth = sorted((r["posted_at"] for r in merged), reverse=True)[limit - 1]
+            month_end = (datetime.strptime(month, "%Y-%m") + timedelta(days=32)).replace(day=1)
+            if month_end.isoformat() <= kth:
+                break
+        payload = db.query(TransactionArchive.payload).filter(TransactionArchive.id == segment_id).scalar()
+        merged.extend(_cold_row_to_dict(account_id, row) for _, row in _iter_payload(payload))
+        # Trim as we go: never more than limit rows plus one segment's
+        merged.sort(key=lambda r: r["posted_at"], reverse=True)
+        del merged[limit:]
+
+    merged.sort(key=lambda r: r["posted_at"], reverse=True)
+    return merged[:limit]
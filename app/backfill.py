@@ -0,0 +1,215 @@
+import logging
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from app.db import SessionLocal, utcnow
+from app.models import BackfillWindow, SyncState
+from app.provider_client import ProviderClient
+from app.profiling import PhaseTimer
+from app.sync import SyncTokens, load_tokens, load_sync_state, fetch_page, apply_page, new_stats
+from app.single_flight import sync_flight
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+def plan_windows(db, account_id: str, history_days: int, window_days: int) -> list:
+    """
+    Create the account's backfill windows on first call: contiguous
+    [start, end) date ranges covering history_days up to now, newest first so
+    the most relevant data lands first. Later calls return the existing plan.
+    No history (history_days <= 0) plans no windows.
+    """
+    if window_days <= 0:
+        raise ValueError(f"window_days must be positive, got {window_days}")
+    windows = db.query(BackfillWindow).filter(BackfillWindow.account_id == account_id).all()
+    if windows:
+        return windows
+
+    # Naive UTC, like every other timestamp we store
+    end = utcnow().replace(tzinfo=None)
+    start = end - timedelta(days=history_days)
+    window_end = end
+    while window_end > start:
+        window_start = max(window_end - timedelta(days=window_days), start)
+        db.add(BackfillWindow(
+            account_id=account_id,
+            window_start=window_start,
+            window_end=window_end,
+            status="pending",
+            items_fetched=0
+        ))
+        window_end = window_start
+    db.commit()
+    return db.query(BackfillWindow).filter(BackfillWindow.account_id == account_id).all()
+
+def _backfill_window(window_id: int, tokens: SyncTokens, db_lock: threading.Lock, rl: bool) -> dict:
+    """
+    Fetch one window page by page. Each page is written together with the
+    window's cursor, so a crash resumes this window from its last page.
+    Fetches run in parallel; DB work is serialized through db_lock because
+    SQLite allows a single writer anyway.
+    """
+    timer = PhaseTimer()
+    stats = new_stats()
+    # No validator store: validators are keyed by cursor, and window cursors overlap
+    client = ProviderClient()
+    db = SessionLocal()
+    try:
+        with db_lock:
+            window = db.get(BackfillWindow, window_id)
+            account_id = window.account_id
+            start, end, cursor = window.window_start, window.window_end, window.cursor
+            db.commit()
+            db.expunge_all()
+
+        while True:
+            page_data = fetch_page(client, db, tokens, cursor, stats, timer, rl=rl, start_date=start, end_date=end)
+            if not page_data:
+                break
+
+            items = page_data.get("items", [])
+            stats["items_fetched"] += len(items)
+            next_cursor = page_data.get("next_cursor")
+
+            with db_lock:
+                with timer.phase("db_upsert"):
+                    apply_page(db, account_id, items, stats)
+                window = db.get(BackfillWindow, window_id)
+                window.cursor = next_cursor
+                window.items_fetched += len(items)
+                if not next_cursor:
+                    window.status = "done"
+                sync_flight.check_lease(db, account_id)
+                with timer.phase("db_commit"):
+                    db.commit()
+                db.expunge_all()
+            page_data = items = None
+
+            cursor = next_cursor
+            if not cursor:
+                break
+
+        stats["timings"] = timer.summary()
+        return stats
+    finally:
+        db.close()
+
+def _catch_up(account_id: str, since, rl: bool) -> dict:
+    """
+    Handoff to the cursor sync: fetch only what was posted since the
+    backfill's head (the end of its newest window), then record the account
+    as synced. Everything before the head was just loaded by the windows.
+    """
+    timer = PhaseTimer()
+    stats = new_stats()
+    client = ProviderClient()
+    db = SessionLocal()
+    try:
+        tokens = load_tokens(db, account_id)
+        load_sync_state(db, account_id)
+        cursor = None
+        while True:
+            page_data = fetch_page(client, db, tokens, cursor, stats, timer, rl=rl, start_date=since)
+            if not page_data:
+                break
+
+            items = page_data.get("items", [])
+            stats["items_fetched"] += len(items)
+            cursor = page_data.get("next_cursor")
+            with timer.phase("db_upsert"):
+                apply_page(db, account_id, items, stats)
+            if not cursor:
+                # Same end state as a finished cursor sync
+                db.query(SyncState).filter(SyncState.account_id == account_id).update({
+                    "cursor": None,
+                    "last_synced_at": utcnow()
+                })
+            sync_flight.check_lease(db, account_id)
+            with timer.phase("db_commit"):
+                db.commit()
+            db.expunge_all()
+            page_data = items = None
+            if not cursor:
+                break
+
+        stats["timings"] = timer.summary()
+        return stats
+    finally:
+        db.close()
+
+def _merge_stats(total: dict, part: dict):
+    for key, value in part.items():
+        if key == "timings":
+            timings = total.setdefault("timings", {})
+            for phase, seconds in value.items():
+                timings[phase] = round(timings.get(phase, 0.0) + seconds, 6)
+        else:
+            total[key] = total.get(key, 0) + value
+
+def run_backfill(
+    account_id: str,
+    window_days: int = None,
+    concurrency: int = None,
+    history_days: int = None,
+    rl: bool = False,
+    handoff: bool = True
+) -> dict:
+    """
+    First-time history load: split the account's history into date windows
+    and fetch up to `concurrency` of them at once, each with its own cursor
+    and checkpoint. Re-running after a crash only fetches unfinished windows.
+    Once every window is done, hands off to the normal cursor sync by
+    fetching what was posted since the newest window.
+
+    Runs through the sync single-flight, so it never overlaps a sync of the
+    same account (in this process or, with SYNC_LEASE_ENABLED, another
+    worker); a sync requested meanwhile gets the backfill's stats.
+
+    stats["timings"] sums time across workers, so it can exceed wall time.
+    """
+    window_days = settings.BACKFILL_WINDOW_DAYS if window_days is None else window_days
+    concurrency = settings.BACKFILL_CONCURRENCY if concurrency is None else concurrency
+    history_days = settings.BACKFILL_HISTORY_DAYS if history_days is None else history_days
+    if window_days <= 0 or concurrency <= 0:
+        raise ValueError("window_days and concurrency must be positive")
+    return sync_flight.run(
+        account_id,
+        lambda: _run_backfill(account_id, window_days, concurrency, history_days, rl, handoff),
+        share=False
+    )
+
+def _run_backfill(account_id: str, window_days: int, concurrency: int, history_days: int, rl: bool, handoff: bool) -> dict:
+    db_lock = threading.Lock()
+    db = SessionLocal()
+    try:
+        tokens = load_tokens(db, account_id, write_lock=db_lock)
+        windows = plan_windows(db, account_id, history_days, window_days)
+        pending = [w.id for w in windows if w.status != "done"]
+        total_windows = len(windows)
+        # None when there was no history to plan
+        head = max((w.window_end for w in windows), default=None)
+    finally:
+        db.close()
+
+    stats = new_stats()
+    stats["windows_total"] = total_windows
+    stats["windows_run"] = len(pending)
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="backfill") as pool:
+            futures = [pool.submit(_backfill_window, window_id, tokens, db_lock, rl) for window_id in pending]
+            errors = []
+            for fut in futures:
+                try:
+                    _merge_stats(stats, fut.result())
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            # Finished windows are checkpointed; a re-run picks up the rest
+            logger.error(f"Backfill for {account_id} left {len(errors)} window(s) unfinished: {errors[0]}")
+            raise errors[0]
+
+    if handoff and head is not None:
+        # From here on the regular cursor sync keeps the account current
+        stats["handoff"] = _catch_up(account_id, head, rl)
+    return stats
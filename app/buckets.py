@@ -0,0 +1,63 @@
+from sqlalchemy.orm import Session
+from app.models import DayBucket
+from app.hashing import DIGEST_MODULUS, EMPTY_DIGEST, day_key
+
+class BucketDeltas:
+    """
+    Per-day digest changes collected while a page is written, then applied
+    with one read and one write per touched day.
+    """
+    def __init__(self):
+        # day -> [digest delta, count delta]
+        self.days = {}
+
+    def add(self, posted_at, item_hash: str, sign: int = 1):
+        if not item_hash:
+            # Rows from before content hashing never entered a bucket
+            return
+        entry = self.days.setdefault(day_key(posted_at), [0, 0])
+        entry[0] += sign * int(item_hash, 16)
+        entry[1] += sign
+
+    def apply(self, db: Session, account_id: str):
+        changed = {day: d for day, d in self.days.items() if d[0] % DIGEST_MODULUS or d[1]}
+        if not changed:
+            return
+        buckets = {
+            b.day: b for b in db.query(DayBucket).filter(
+                DayBucket.account_id == account_id,
+                DayBucket.day.in_(list(changed))
+            )
+        }
+        for day, (digest_delta, count_delta) in changed.items():
+            bucket = buckets.get(day)
+            if bucket is None:
+                bucket = DayBucket(account_id=account_id, day=day, digest=EMPTY_DIGEST, row_count=0)
+                db.add(bucket)
+            bucket.digest = f"{(int(bucket.digest, 16) + digest_delta) % DIGEST_MODULUS:064x}"
+            bucket.row_count += count_delta
+        self.days.clear()
+        # Later pages in the same transaction must find the buckets created here
+        db.flush()
+
+def local_digests(db: Session, account_id: str, granularity: str = "day", start_day: str = None, end_day: str = None) -> dict:
+    """
+    Our side of the comparison, same shape as the provider's digests.
+    Month digests are summed from the day buckets. Empty buckets are omitted.
+    """
+    q = db.query(DayBucket.day, DayBucket.digest, DayBucket.row_count).filter(DayBucket.account_id == account_id)
+    if start_day:
+        q = q.filter(DayBucket.day >= start_day)
+    if end_day:
+        q = q.filter(DayBucket.day < end_day)
+
+    width = 10 if granularity == "day" else 7
+    totals = {}
+    for day, digest, count in q:
+        entry = totals.setdefault(day[:width], [0, 0])
+        entry[0] += int(digest, 16)
+        entry[1] += count
+    return {
+        key: {"digest": f"{total % DIGEST_MODULUS:064x}", "count": count}
+        for key, (total, count) in totals.items() if count
+    }
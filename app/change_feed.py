@@ -0,0 +1,88 @@
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from app.models import Transaction, TransactionChange
+from app.settings import settings
+
+def record_changes(db: Session, changes: list):
+    """
+    Append (Transaction, op) pairs to the change log.
+    Call after the transactions are flushed so they have ids; the log rows are
+    committed with the page, so a consumer never sees a seq for unwritten data.
+    """
+    db.add_all([
+        TransactionChange(
+            account_id=txn.account_id,
+            transaction_id=txn.id,
+            provider_txn_id=txn.provider_txn_id,
+            op=op,
+        )
+        for txn, op in changes
+    ])
+
+def transaction_to_dict(txn: Transaction) -> dict:
+    return {
+        "id": txn.id,
+        "account_id": txn.account_id,
+        "provider_txn_id": txn.provider_txn_id,
+        "amount": txn.amount,
+        "currency": txn.currency,
+        "description": txn.description,
+        "posted_at": txn.posted_at.isoformat() if txn.posted_at else None,
+    }
+
+def list_changes(db: Session, since_seq: int = 0, account_id: str = None, limit: int = 500) -> dict:
+    """
+    Keyset page of changes after since_seq, in seq order, with the current row
+    for each (None if the row was deleted or lives in the cold archive).
+    Pass the returned next_since_seq back to continue.
+    """
+    q = db.query(TransactionChange, Transaction).outerjoin(
+        Transaction, Transaction.id == TransactionChange.transaction_id
+    ).filter(TransactionChange.seq > since_seq)
+    if account_id:
+        q = q.filter(TransactionChange.account_id == account_id)
+    # One extra row tells us whether there is more without a COUNT
+    rows = q.order_by(TransactionChange.seq).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "changes": [
+            {
+                "seq": change.seq,
+                "op": change.op,
+                "account_id": change.account_id,
+                "provider_txn_id": change.provider_txn_id,
+                "transaction": transaction_to_dict(txn) if txn else None,
+            }
+            for change, txn in rows
+        ],
+        "next_since_seq": rows[-1][0].seq if rows else since_seq,
+        "has_more": has_more,
+    }
+
+def compact_changes(db: Session, keep_last: int = None) -> int:
+    """
+    Drop log entries superseded by a later change to the same transaction.
+    The newest `keep_last` sequence numbers are kept verbatim so consumers that
+    are only slightly behind still see every intermediate op. Compaction never
+    loses state: any consumer still gets the latest change for every
+    transaction modified after its position.
+    Returns the number of entries removed.
+    """
+    keep_last = settings.CHANGE_LOG_KEEP_LAST if keep_last is None else keep_last
+    max_seq = db.query(func.max(TransactionChange.seq)).scalar()
+    if max_seq is None:
+        return 0
+    horizon = max_seq - keep_last
+
+    # Keyed by provider id: archived rows have no transaction_id
+    latest = select(func.max(TransactionChange.seq)).group_by(
+        TransactionChange.account_id, TransactionChange.provider_txn_id
+    )
+    removed = db.query(TransactionChange).filter(
+        TransactionChange.seq <= horizon,
+        TransactionChange.seq.not_in(latest)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return removed
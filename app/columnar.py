@@ -0,0 +1,374 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.models import Transaction, TransactionChange
+from app.archive import iter_cold_rows
+from app.settings import settings
+
+try:
+    import numpy as np
+except ImportError:  # optional: pip install ".[analytics]"
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Per-account columnar copy of (amount, posted_at, currency) for analytics,
+# stored as raw memory-mapped files so aggregates scan contiguous arrays
+# instead of ORM rows, and only the pages a query touches are resident.
+#
+# <COLUMNAR_CACHE_DIR>/<account fingerprint>/
+#   meta.json     count, capacity, indexed, currencies, seq, data
+#   <data>/       the current generation of column files:
+#     key.i8        64-bit hash of provider_txn_id, row order
+#     amount.i8     cents
+#     posted_at.i8  datetime64[s]
+#     currency.u2   index into meta["currencies"]
+#     sorted_key.i8 / sorted_pos.i8   keys[:indexed] sorted, for patch lookups
+#
+# The database stays authoritative. meta["seq"] is the account's change-log
+# position the cache reflects; a cache that is behind (another writer, a crash
+# between commit and patch) is rebuilt on the next query.
+#
+# Patches write into the current generation in place and only ever grow its
+# files. A rebuild writes a new generation next to it and switches meta.json
+# over with os.replace, so a reader's memory maps are never truncated under
+# it. The replaced generation is kept until the rebuild after, for readers
+# that read the old meta.json just before the switch.
+
+COLUMNS = {"key": "i8", "amount": "i8", "posted_at": "datetime64[s]", "currency": "u2"}
+TAIL_REINDEX_ROWS = 65536  # unindexed appended rows before the key index is rebuilt
+_INITIAL_CAPACITY = 1024
+_ORPHAN_GENERATION_SECONDS = 3600  # an unreferenced generation this old is a crashed rebuild
+
+class ColumnarUnavailableError(Exception):
+    """Raised when the columnar cache is disabled or NumPy isn't installed"""
+    pass
+
+def available() -> bool:
+    return settings.COLUMNAR_CACHE_ENABLED and np is not None
+
+def _require():
+    if not settings.COLUMNAR_CACHE_ENABLED:
+        raise ColumnarUnavailableError("Columnar cache is disabled (COLUMNAR_CACHE_ENABLED)")
+    if np is None:
+        raise ColumnarUnavailableError("Columnar cache needs NumPy: pip install '.[analytics]'")
+
+def _txn_key(provider_txn_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(provider_txn_id.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+def change_seq(db: Session, account_id: str) -> int:
+    return db.query(func.max(TransactionChange.seq)).filter(TransactionChange.account_id == account_id).scalar() or 0
+
+def changes_between(db: Session, account_id: str, seq_before: int, seq_after: int) -> int:
+    """
+    How many of the account's change log entries fall in (seq_before,
+    seq_after]. The seq is shared by every account, so the range's width
+    says nothing about one account's changes; count them.
+    """
+    return db.query(func.count(TransactionChange.seq)).filter(
+        TransactionChange.account_id == account_id,
+        TransactionChange.seq > seq_before,
+        TransactionChange.seq <= seq_after
+    ).scalar()
+
+# One writer per account cache within the process
+_locks = {}
+_locks_guard = threading.Lock()
+
+def _account_lock(account_id: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(account_id, threading.Lock())
+
+class ColumnarCache:
+    def __init__(self, account_id: str, root: str = None):
+        self.account_id = account_id
+        fingerprint = hashlib.sha256(account_id.encode("utf-8")).hexdigest()[:32]
+        self.path = os.path.join(root or settings.COLUMNAR_CACHE_DIR, fingerprint)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _column_file(self, meta: dict, name: str) -> str:
+        # Caches written before generations keep their files in self.path
+        return os.path.join(self.path, meta.get("data", ""), name + (".u2" if name == "currency" else ".i8"))
+
+    def meta(self):
+        try:
+            with open(self._file("meta.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_meta(self, meta: dict):
+        # Atomic: readers see either the old or the new row count, never a torn file
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._file("meta.json"))
+
+    def _open(self, meta: dict, name: str, rows: int, mode: str = "r"):
+        if rows == 0:
+            return np.empty(0, dtype=COLUMNS.get(name, "i8"))
+        return np.memmap(self._column_file(meta, name), dtype=COLUMNS.get(name, "i8"), mode=mode, shape=(rows,))
+
+    def _grow(self, meta: dict, capacity: int):
+        for name, dtype in COLUMNS.items():
+            with open(self._column_file(meta, name), "ab") as f:
+                f.truncate(capacity * np.dtype(dtype).itemsize)
+
+    def columns(self, meta: dict = None) -> dict:
+        """Read-only memory maps of the live rows."""
+        meta = meta or self.meta()
+        count = meta["count"]
+        return {
+            "amount": self._open(meta, "amount", count),
+            "posted_at": self._open(meta, "posted_at", count),
+            "currency": self._open(meta, "currency", count),
+            "currencies": meta["currencies"],
+        }
+
+    def _reindex(self, meta: dict):
+        keys = np.array(self._open(meta, "key", meta["count"]))
+        order = np.argsort(keys, kind="stable")
+        for name, values in (("sorted_key", keys[order]), ("sorted_pos", order.astype("i8"))):
+            path = self._column_file(meta, name)
+            values.tofile(path + ".tmp")
+            os.replace(path + ".tmp", path)
+        meta["indexed"] = meta["count"]
+
+    def _lookup(self, meta: dict, keys):
+        """Row positions for keys, -1 where absent."""
+        positions = np.full(len(keys), -1, dtype="i8")
+        indexed = meta["indexed"]
+        if indexed:
+            sorted_key = self._open(meta, "sorted_key", indexed)
+            at = np.minimum(np.searchsorted(sorted_key, keys), indexed - 1)
+            hit = sorted_key[at] == keys
+            positions[hit] = self._open(meta, "sorted_pos", indexed)[at[hit]]
+        tail_len = meta["count"] - indexed
+        if tail_len:
+            tail = np.array(self._open(meta, "key", meta["count"])[indexed:])
+            order = np.argsort(tail, kind="stable")
+            at = np.minimum(np.searchsorted(tail[order], keys), tail_len - 1)
+            hit = (tail[order][at] == keys) & (positions < 0)
+            positions[hit] = indexed + order[at[hit]]
+        return positions
+
+    def _write_rows(self, meta: dict, rows: dict):
+        """Upsert {provider_txn_id: (amount, posted_at, currency)}."""
+        if not rows:
+            return
+        codes = {c: i for i, c in enumerate(meta["currencies"])}
+        for _, _, currency in rows.values():
+            if currency not in codes:
+                codes[currency] = len(meta["currencies"])
+                meta["currencies"].append(currency)
+
+        keys = np.array([_txn_key(pid) for pid in rows], dtype="i8")
+        amounts = np.array([r[0] for r in rows.values()], dtype="i8")
+        posted = np.array([r[1] for r in rows.values()], dtype="datetime64[s]")
+        currency = np.array([codes[r[2]] for r in rows.values()], dtype="u2")
+
+        positions = self._lookup(meta, keys)
+        existing = positions >= 0
+        new = ~existing
+        n_new = int(new.sum())
+        count = meta["count"]
+        if count + n_new > meta["capacity"]:
+            meta["capacity"] = max(meta["capacity"] * 2, count + n_new, _INITIAL_CAPACITY)
+            self._grow(meta, meta["capacity"])
+
+        capacity = meta["capacity"]
+        positions[new] = np.arange(count, count + n_new)
+        for name, values in (("key", keys), ("amount", amounts), ("posted_at", posted), ("currency", currency)):
+            column = self._open(meta, name, capacity, mode="r+")
+            column[positions] = values
+            column.flush()
+            del column
+
+        meta["count"] = count + n_new
+        if meta["count"] - meta["indexed"] > TAIL_REINDEX_ROWS:
+            self._reindex(meta)
+
+    def apply_items(self, items: list, seq_before: int, seq_after: int):
+        """
+        Patch provider items into the cache after their page committed. The
+        caller vouches that items are every change in (seq_before, seq_after].
+        Only advances if the cache was current before the page; otherwise it
+        is left behind and rebuilt on the next query.
+        """
+        with _account_lock(self.account_id):
+            meta = self.meta()
+            if meta is None or meta["seq"] != seq_before:
+                return False
+            # Last occurrence wins, as in apply_page
+            rows = {
+                item["id"]: (item["amount"], datetime.fromisoformat(item["posted_at"]), item.get("currency") or "USD")
+                for item in items
+            }
+            self._write_rows(meta, rows)
+            meta["seq"] = seq_after
+            self._write_meta(meta)
+            return True
+
+    def rebuild(self, db: Session, only_if_stale: bool = False):
+        """
+        Reload the account from both tiers into a new generation. With
+        only_if_stale, a cache another caller brought up to date while this
+        one waited for the lock is returned as it is.
+        """
+        with _account_lock(self.account_id):
+            seq = change_seq(db, self.account_id)
+            old = self.meta()
+            if only_if_stale and old is not None and old["seq"] == seq:
+                return old
+
+            meta = {"count": 0, "capacity": 0, "indexed": 0, "currencies": [], "seq": seq, "data": f"gen-{uuid.uuid4().hex[:12]}"}
+            os.makedirs(os.path.join(self.path, meta["data"]))
+            # Readers keep using the current generation until meta.json is switched below
+
+            rows = {}
+            for pid, amount, posted_at, currency in db.query(
+                Transaction.provider_txn_id, Transaction.amount, Transaction.posted_at, Transaction.currency
+            ).filter(Transaction.account_id == self.account_id).yield_per(10000):
+                rows[pid] = (amount, posted_at, currency or "USD")
+                if len(rows) >= 100000:
+                    self._write_rows(meta, rows)
+                    rows = {}
+            for row in iter_cold_rows(db, self.account_id, datetime.min, datetime.max):
+                rows[row["provider_txn_id"]] = (row["amount"], datetime.fromisoformat(row["posted_at"]), row["currency"] or "USD")
+                if len(rows) >= 100000:
+                    self._write_rows(meta, rows)
+                    rows = {}
+            self._write_rows(meta, rows)
+            self._reindex(meta)
+            if old is not None:
+                meta["previous"] = old.get("data", "")
+            self._write_meta(meta)
+            if old is not None:
+                self._remove_generation(old.get("previous"))
+            self._remove_orphan_generations(keep={meta["data"], meta.get("previous")})
+            return meta
+
+    def _remove_generation(self, data):
+        if data is None:
+            return
+        if data:
+            shutil.rmtree(os.path.join(self.path, data), ignore_errors=True)
+            return
+        # A cache from before generations kept its column files next to meta.json
+        for name in list(COLUMNS) + ["sorted_key", "sorted_pos"]:
+            try:
+                os.remove(self._column_file({}, name))
+            except FileNotFoundError:
+                pass
+
+    def _remove_orphan_generations(self, keep: set):
+        """Generations no meta.json points to: crashed rebuilds, once they're old enough not to be another process's build in progress."""
+        for entry in os.scandir(self.path):
+            if entry.is_dir() and entry.name.startswith("gen-") and entry.name not in keep:
+                if time.time() - entry.stat().st_mtime > _ORPHAN_GENERATION_SECONDS:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+def patch_cache(account_id: str, items: list, seq_before: int, seq_after: int, changes: int, logged: int):
+    """
+    Called by sync after a page commit when the cache is enabled. seq_before
+    and seq_after bracket the page's writes, `changes` is how many change
+    log entries the page wrote and `logged` how many the account has in that
+    range (changes_between). If the range holds more, another writer's
+    changes to the account are in it too; items don't include them, so the
+    cache is left behind for a rebuild rather than marked as covering them.
+    """
+    if not available():
+        return
+    if logged != changes:
+        return
+    try:
+        ColumnarCache(account_id).apply_items(items, seq_before, seq_after)
+    except Exception as e:
+        # The cache is derived data; never fail a sync over it
+        logger.warning(f"Columnar cache patch failed for {account_id}: {e}")
+
+def load_columns(db: Session, account_id: str) -> dict:
+    """Current columns for an account, rebuilding the cache first if it is behind."""
+    _require()
+    cache = ColumnarCache(account_id)
+    for attempt in range(3):
+        meta = cache.meta()
+        if meta is None or meta["seq"] != change_seq(db, account_id):
+            meta = cache.rebuild(db, only_if_stale=True)
+        try:
+            return cache.columns(meta)
+        except FileNotFoundError:
+            # Two rebuilds went by since meta was read and its generation is gone
+            if attempt == 2:
+                raise
+
+def _select(cols: dict, start: datetime = None, end: datetime = None, currency: str = None):
+    """(day number since epoch, amount) arrays for the matching rows."""
+    # Seconds -> days; floor division keeps pre-1970 dates right
+    days = cols["posted_at"].view("i8") // 86400
+    amounts = cols["amount"]
+    if not (start or end or currency):
+        return days, amounts
+    mask = np.ones(len(amounts), dtype=bool)
+    if start:
+        mask &= cols["posted_at"] >= np.datetime64(start, "s")
+    if end:
+        mask &= cols["posted_at"] < np.datetime64(end, "s")
+    if currency:
+        if currency not in cols["currencies"]:
+            mask[:] = False
+        else:
+            mask &= cols["currency"] == cols["currencies"].index(currency)
+    return days[mask], amounts[mask]
+
+def _daily_series(days, amounts):
+    """Totals and counts for every day from the first to the last, by bincount (no sort)."""
+    first = int(days.min())
+    offsets = days - first
+    totals = np.bincount(offsets, weights=amounts)
+    counts = np.bincount(offsets, minlength=len(totals))
+    return np.datetime64(first, "D") + np.arange(len(totals)), totals, counts
+
+def daily_totals(cols: dict, start: datetime = None, end: datetime = None, currency: str = None) -> dict:
+    """Per-day sum and count of amounts, days without transactions omitted."""
+    days, amounts = _select(cols, start, end, currency)
+    if not len(days):
+        return {"days": [], "totals": [], "counts": []}
+    series_days, totals, counts = _daily_series(days, amounts)
+    present = counts > 0
+    return {
+        "days": [str(d) for d in series_days[present]],
+        "totals": totals[present].astype("i8").tolist(),
+        "counts": counts[present].tolist(),
+    }
+
+def moving_average(cols: dict, window_days: int = 7, start: datetime = None, end: datetime = None, currency: str = None) -> dict:
+    """Trailing window_days mean of daily totals, counting empty days as zero."""
+    days, amounts = _select(cols, start, end, currency)
+    if not len(days):
+        return {"days": [], "moving_average": []}
+    series_days, daily, _ = _daily_series(days, amounts)
+    # Trailing window, shorter at the start of the series
+    sums = np.convolve(daily, np.ones(window_days))[:len(daily)]
+    divisors = np.minimum(np.arange(1, len(daily) + 1), window_days)
+    return {
+        "days": [str(d) for d in series_days],
+        "moving_average": np.round(sums / divisors, 2).tolist(),
+    }
+
+def percentiles(cols: dict, qs=(50, 90, 99), start: datetime = None, end: datetime = None, currency: str = None) -> dict:
+    _, amounts = _select(cols, start, end, currency)
+    if not len(amounts):
+        return {"count": 0, "percentiles": {f"{q:g}": None for q in qs}}
+    values = np.percentile(amounts, qs)
+    return {"count": int(len(amounts)), "percentiles": {f"{q:g}": float(v) for q, v in zip(qs, values)}}
@@ -0,0 +1,40 @@
+import asyncio
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from app.settings import settings
+
+class OverloadedError(Exception):
+    """Raised when a concurrency cap is already full"""
+    pass
+
+class ConcurrencyLimiter:
+    """
+    Non-blocking concurrency cap for async endpoints. Instead of queueing
+    (and piling up latency) requests beyond the cap are rejected straight
+    away so the caller can shed load with a 503.
+    Only used from the event loop thread, so a plain counter is enough.
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            raise OverloadedError(f"Concurrency limit of {self.limit} reached")
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+# Blocking DB work from async endpoints runs here rather than on the shared
+# threadpool, so it can't be starved by (or starve) sync endpoints.
+db_executor = ThreadPoolExecutor(max_workers=settings.DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+async def run_db(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, partial(fn, *args, **kwargs))
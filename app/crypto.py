@@ -1,6 +1,6 @@
 import base64
 import hashlib
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
 from app.settings import settings
 
 def build_fernet(token_key: str) -> Fernet:
@@ -11,6 +11,19 @@ def build_fernet(token_key: str) -> Fernet:
     key = base64.urlsafe_b64encode(digest)
     return Fernet(key)
 
+def configured_keys() -> list:
+    """
+    All token keys, newest first. TOKEN_KEY is the primary (encrypting) key,
+    TOKEN_KEYS_PREVIOUS is a comma-separated list of retired keys kept for decryption.
+    """
+    keys = [settings.TOKEN_KEY]
+    keys += [k.strip() for k in settings.TOKEN_KEYS_PREVIOUS.split(",") if k.strip()]
+    return keys
+
+def build_multifernet(token_keys: list) -> MultiFernet:
+    # MultiFernet encrypts with the first key and tries each key in turn to decrypt
+    return MultiFernet([build_fernet(k) for k in token_keys])
+
 def encrypt_str(s: str, token_key: str = None) -> str:
     """
     Encrypts string s using token_key. 
@@ -29,15 +42,16 @@ def encrypt_str(s: str, token_key: str = None) -> str:
 def decrypt_str(token: str, token_key: str = None) -> str:
     """
     Decrypts token using token_key.
+    If token_key not provided, any configured key (current or previous) is accepted.
     Raises ValueError if token is invalid.
     """
     if not token:
         return ""
-    if token_key is None:
-        token_key = settings.TOKEN_KEY
-
     try:
-        f = build_fernet(token_key)
+        if token_key is None:
+            f = build_multifernet(configured_keys())
+        else:
+            f = build_fernet(token_key)
         # Fernet decrypt expects bytes
         plaintext_bytes = f.decrypt(token.encode("utf-8"))
         return plaintext_bytes.decode("utf-8")
@@ -45,3 +59,17 @@ def decrypt_str(token: str, token_key: str = None) -> str:
         # Fernet raises InvalidToken (or others), we wrap to ValueError or return empty?
         # Requirement: "Ensure decrypt raises a clear ValueError if invalid token."
         raise ValueError(f"Decryption failed: {str(e)}") from e
+
+def rotate_str(token: str, token_keys: list = None, f: MultiFernet = None) -> str:
+    """
+    Re-encrypts token under the newest key.
+    Raises ValueError if no configured key can decrypt it.
+    """
+    if not token:
+        return token
+    if f is None:
+        f = build_multifernet(token_keys or configured_keys())
+    try:
+        return f.rotate(token.encode("utf-8")).decode("utf-8")
+    except Exception as e:
+        raise ValueError(f"Rotation failed: {str(e)}") from e
@@ -1,13 +1,65 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.settings import settings
 
-engine = create_engine(
-    settings.DATABASE_URL, 
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
-)
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+def _is_sqlite_memory(url: str) -> bool:
+    return _is_sqlite(url) and (url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url)
+
+def apply_sqlite_profile(dbapi_connection, read_only: bool = False):
+    """
+    Per-connection SQLite settings (SQLITE_PROFILE_ENABLED).
+    WAL lets readers run alongside the single writer, and busy_timeout makes a
+    blocked writer wait instead of failing with "database is locked".
+    synchronous=NORMAL is durable across application crashes in WAL mode;
+    only an OS crash or power loss can drop the last commits.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        if not read_only:
+            # Persistent, stored in the file; readers don't need to set it
+            cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA cache_size={int(settings.SQLITE_CACHE_SIZE)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+        cursor.execute(f"PRAGMA temp_store={settings.SQLITE_TEMP_STORE}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+    finally:
+        cursor.close()
+
+def make_engine(url: str, read_only: bool = False):
+    if not _is_sqlite(url):
+        return create_engine(url, pool_size=settings.DB_POOL_SIZE, max_overflow=settings.DB_MAX_OVERFLOW)
+
+    kwargs = {"connect_args": {"check_same_thread": False}}
+    if not _is_sqlite_memory(url):
+        # Every concurrent sync holds a connection; the default 5 + 10 queues them
+        kwargs["pool_size"] = settings.DB_READ_POOL_SIZE if read_only else settings.DB_POOL_SIZE
+        kwargs["max_overflow"] = settings.DB_READ_MAX_OVERFLOW if read_only else settings.DB_MAX_OVERFLOW
+    new_engine = create_engine(url, **kwargs)
+
+    if settings.SQLITE_PROFILE_ENABLED:
+        @event.listens_for(new_engine, "connect")
+        def _on_connect(dbapi_connection, connection_record):
+            apply_sqlite_profile(dbapi_connection, read_only=read_only)
+    return new_engine
+
+engine = make_engine(settings.DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Read endpoints get their own pool of query_only connections so they never
+# queue behind syncs for a connection. An in-memory database can't be opened
+# twice, so there it is the same engine.
+if _is_sqlite(settings.DATABASE_URL) and not _is_sqlite_memory(settings.DATABASE_URL):
+    read_engine = make_engine(settings.DATABASE_URL, read_only=True)
+else:
+    read_engine = engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
 Base = declarative_base()
 
 def get_db():
@@ -17,6 +69,13 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 from datetime import datetime, timezone
 
 def utcnow() -> datetime:
@@ -0,0 +1,24 @@
+import json
+import hashlib
+
+def content_hash(item: dict) -> str:
+    """
+    Stable SHA-256 of a provider item. Key order and whitespace don't matter,
+    so the same item always hashes the same regardless of how it was serialized.
+    """
+    canonical = json.dumps(item, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+# Bucket digests: the sum of the item hashes mod 2^256. Order-independent and
+# incrementally updatable (add a row's hash, subtract it on delete/update), and
+# sums of day digests give month digests, so buckets roll up like a Merkle tree.
+DIGEST_MODULUS = 2 ** 256
+EMPTY_DIGEST = "0" * 64
+
+def digest_add(digest: str, item_hash: str, sign: int = 1) -> str:
+    total = (int(digest, 16) + sign * int(item_hash, 16)) % DIGEST_MODULUS
+    return f"{total:064x}"
+
+def day_key(posted_at) -> str:
+    """Bucket key for a posted_at datetime or ISO string (naive UTC): YYYY-MM-DD."""
+    return posted_at[:10] if isinstance(posted_at, str) else posted_at.strftime("%Y-%m-%d")
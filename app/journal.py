@@ -0,0 +1,209 @@
+import os
+import json
+import mmap
+import zlib
+import struct
+import hashlib
+import threading
+from app.settings import settings
+
+# Append-only journal of raw provider pages, one directory per account:
+#
+#   <JOURNAL_DIR>/<account fingerprint>/
+#     account                      the account id, for replaying everything
+#     00000000000000000000.seg     segments named by the offset of their first byte
+#     00000000000067108901.seg
+#
+# A record is <u32 length><u32 crc32> followed by a JSON payload. Offsets are
+# global across segments, so an applier can checkpoint one integer. A torn
+# record at the tail (crash mid-write) fails its length or CRC check, reads
+# stop there, and the next writer truncates it.
+
+_HEADER = struct.Struct("<II")
+_SEGMENT_SUFFIX = ".seg"
+
+def _fingerprint(account_id: str) -> str:
+    return hashlib.sha256(account_id.encode("utf-8")).hexdigest()[:32]
+
+class PageJournal:
+    def __init__(self, account_id: str, root: str = None, segment_bytes: int = None, fsync: bool = None):
+        self.account_id = account_id
+        self.path = os.path.join(root or settings.JOURNAL_DIR, _fingerprint(account_id))
+        self.segment_bytes = segment_bytes or settings.JOURNAL_SEGMENT_BYTES
+        self.fsync = settings.JOURNAL_FSYNC if fsync is None else fsync
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment_base = None
+        self._end = None
+
+    def _segments(self) -> list:
+        """(base offset, path) of every segment, oldest first."""
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            (int(name[:-len(_SEGMENT_SUFFIX)]), os.path.join(self.path, name))
+            for name in names if name.endswith(_SEGMENT_SUFFIX)
+        )
+
+    @staticmethod
+    def _scan(buf, pos: int, size: int):
+        """Yield (payload, end position) for each intact record from pos."""
+        while pos + _HEADER.size <= size:
+            length, crc = _HEADER.unpack_from(buf, pos)
+            start = pos + _HEADER.size
+            if start + length > size:
+                return
+            payload = bytes(buf[start:start + length])
+            if zlib.crc32(payload) != crc:
+                return
+            pos = start + length
+            yield payload, pos
+
+    def read_from(self, offset: int = 0):
+        """Yield (record, end offset) for every record at or after offset."""
+        for base, path in self._segments():
+            size = os.path.getsize(path)
+            if base + size <= offset or size == 0:
+                continue
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # mm.size() is fixed at map time: records appended later are read by the next call
+                complete = True
+                pos = max(offset - base, 0)
+                for payload, pos in self._scan(mm, pos, mm.size()):
+                    yield json.loads(payload), base + pos
+                if pos < mm.size():
+                    complete = False
+            if not complete:
+                # Torn or still-being-written record: nothing after it is trustworthy yet
+                return
+
+    @staticmethod
+    def _valid_end(path: str) -> int:
+        """
+        End of the last intact record in a segment. Only the tail can be torn,
+        so walk the record headers (payloads are skipped, not read) and check
+        the CRC of the last record only.
+        """
+        size = os.path.getsize(path)
+        pos = last = 0
+        with open(path, "rb") as f:
+            while pos + _HEADER.size <= size:
+                f.seek(pos)
+                length, _ = _HEADER.unpack(f.read(_HEADER.size))
+                if pos + _HEADER.size + length > size:
+                    break
+                last, pos = pos, pos + _HEADER.size + length
+            if pos > last:
+                f.seek(last)
+                length, crc = _HEADER.unpack(f.read(_HEADER.size))
+                if zlib.crc32(f.read(length)) != crc:
+                    # Complete length but garbage payload: drop it too
+                    pos = last
+        return pos
+
+    def _open_for_append(self):
+        os.makedirs(self.path, exist_ok=True)
+        account_file = os.path.join(self.path, "account")
+        if not os.path.exists(account_file):
+            with open(account_file, "w") as f:
+                f.write(self.account_id)
+
+        segments = self._segments()
+        if not segments:
+            base, path = 0, os.path.join(self.path, f"{0:020d}{_SEGMENT_SUFFIX}")
+            open(path, "ab").close()
+        else:
+            base, path = segments[-1]
+        # Drop a torn tail left by a crash
+        valid = self._valid_end(path)
+        if valid < os.path.getsize(path):
+            with open(path, "r+b") as f:
+                f.truncate(valid)
+        self._file = open(path, "ab")
+        self._segment_base = base
+        self._end = base + valid
+
+    def end_offset(self) -> int:
+        with self._lock:
+            if self._end is None:
+                self._open_for_append()
+            return self._end
+
+    def append(self, record: dict) -> int:
+        """Durably append one record. Returns the offset just past it."""
+        payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        data = _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self._file is None:
+                self._open_for_append()
+            if self._end > self._segment_base and self._end - self._segment_base + len(data) > self.segment_bytes:
+                # Rotate: the new segment is named by its first offset
+                self._file.close()
+                self._segment_base = self._end
+                self._file = open(os.path.join(self.path, f"{self._end:020d}{_SEGMENT_SUFFIX}"), "ab")
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._end += len(data)
+            return self._end
+
+    def is_boundary(self, offset: int) -> bool:
+        """
+        True if offset is the start of a record in this journal, or its end.
+        A checkpoint that fails this was taken against a different journal
+        (lost or replaced directory, changed JOURNAL_DIR, restored database).
+        """
+        if offset == self.end_offset():
+            return True
+        if offset > self._end:
+            return False
+        for base, path in reversed(self._segments()):
+            if base > offset:
+                continue
+            # Walk record headers from the segment start; payloads are skipped, not read
+            pos, target = 0, offset - base
+            with open(path, "rb") as f:
+                while pos < target:
+                    header = f.read(_HEADER.size)
+                    if len(header) < _HEADER.size:
+                        return False
+                    length, _ = _HEADER.unpack(header)
+                    pos += _HEADER.size + length
+                    f.seek(pos)
+            return pos == target
+        # Before the first remaining segment: pruned or never there
+        return False
+
+    def prune(self, before_offset: int) -> int:
+        """Delete segments that end at or before before_offset. Returns the number removed."""
+        with self._lock:
+            segments = self._segments()
+            removed = 0
+            # Never the last segment: it is the one being appended to
+            for (base, path), (next_base, _) in zip(segments, segments[1:]):
+                if next_base <= before_offset:
+                    os.remove(path)
+                    removed += 1
+            return removed
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._end = None
+
+def journal_accounts(root: str = None) -> list:
+    """Account ids that have a journal under root."""
+    root = root or settings.JOURNAL_DIR
+    accounts = []
+    for name in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        try:
+            with open(os.path.join(root, name, "account")) as f:
+                accounts.append(f.read())
+        except FileNotFoundError:
+            continue
+    return accounts
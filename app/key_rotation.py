@@ -0,0 +1,163 @@
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from sqlalchemy import select, update, and_, bindparam
+from app.db import SessionLocal, utcnow
+from app.models import Connection, KeyRotationJob
+from app.crypto import build_multifernet, configured_keys, rotate_str
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+def job_name_for_key(token_key: str) -> str:
+    # Progress is tracked per target key, so a new rotation starts a fresh job.
+    # Domain-separated so the name reveals nothing about the Fernet key itself.
+    return hashlib.sha256(b"key-rotation-job:" + token_key.encode("utf-8")).hexdigest()[:16]
+
+def _rotate_chunk(rows: list, token_keys: list):
+    """
+    Worker: re-encrypt one chunk of (id, access_token_enc, refresh_token_enc) rows.
+    Runs in a separate process, so it only deals in plain tuples. Returns the
+    rotated rows and the ids of rows no configured key could decrypt, which
+    are left as they are rather than failing the chunk.
+    """
+    f = build_multifernet(token_keys)
+    out = []
+    failed = []
+    for conn_id, access_enc, refresh_enc in rows:
+        try:
+            out.append((
+                conn_id,
+                access_enc,
+                refresh_enc,
+                rotate_str(access_enc, f=f),
+                rotate_str(refresh_enc, f=f) if refresh_enc else refresh_enc,
+            ))
+        except ValueError:
+            failed.append(conn_id)
+    return out, failed
+
+def _completed(result) -> Future:
+    fut = Future()
+    fut.set_result(result)
+    return fut
+
+def reencrypt_connections(chunk_size: int = None, workers: int = None) -> dict:
+    """
+    Re-encrypts every connection's tokens under the newest TOKEN_KEY.
+
+    Rows are streamed in primary-key order, chunk_size at a time, and rotated on
+    a process pool (workers=0 rotates inline). Each chunk is written in its own
+    short transaction together with the job watermark, so the table is never
+    locked for long and an interrupted job resumes after the last written chunk.
+
+    Updates are compare-and-swap on both old ciphertexts: a row the app
+    rewrote in the meantime (token refresh, reconnect) already uses the newest
+    key and is left alone.
+
+    Rows that can't be decrypted with any configured key (corrupt, or from a
+    key already dropped) are counted in "failed", logged, and their ids for
+    this run returned in "failed_ids"; the job carries on past them.
+    """
+    chunk_size = chunk_size or settings.KEY_ROTATION_CHUNK_SIZE
+    workers = settings.KEY_ROTATION_WORKERS if workers is None else workers
+    token_keys = configured_keys()
+    name = job_name_for_key(token_keys[0])
+
+    db = SessionLocal()
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+
+    try:
+        job = db.query(KeyRotationJob).filter(KeyRotationJob.name == name).first()
+        if not job:
+            job = KeyRotationJob(name=name, last_id=0, rotated=0, skipped=0, failed=0)
+            db.add(job)
+            db.commit()
+            db.refresh(job)
+        if job.completed_at is not None:
+            return {"job": name, "rotated": job.rotated, "skipped": job.skipped, "failed": job.failed, "failed_ids": [], "last_id": job.last_id, "resumed": False}
+
+        resumed = job.last_id > 0
+        if resumed:
+            logger.info(f"Resuming key rotation {name} after connection id {job.last_id}")
+
+        cas_update = (
+            update(Connection)
+            .where(and_(
+                Connection.id == bindparam("b_id"),
+                Connection.access_token_enc == bindparam("b_old_access"),
+                # IS, not =: a connection without a refresh token stores NULL
+                Connection.refresh_token_enc.is_not_distinct_from(bindparam("b_old_refresh")),
+            ))
+            .values(access_token_enc=bindparam("b_access"), refresh_token_enc=bindparam("b_refresh"))
+            .execution_options(synchronize_session=False)
+        )
+
+        read_after = job.last_id
+        exhausted = False
+        in_flight = deque()
+        max_in_flight = max(workers, 1) * 2
+        failed_ids = []
+
+        while True:
+            # Keep the pool busy: read ahead while earlier chunks are rotating
+            while not exhausted and len(in_flight) < max_in_flight:
+                rows = db.execute(
+                    select(Connection.id, Connection.access_token_enc, Connection.refresh_token_enc)
+                    .where(Connection.id > read_after)
+                    .order_by(Connection.id)
+                    .limit(chunk_size)
+                ).all()
+                if not rows:
+                    exhausted = True
+                    break
+                rows = [tuple(r) for r in rows]
+                read_after = rows[-1][0]
+                if pool:
+                    in_flight.append((read_after, pool.submit(_rotate_chunk, rows, token_keys)))
+                else:
+                    in_flight.append((read_after, _completed(_rotate_chunk(rows, token_keys))))
+                # Don't hold a read transaction open while waiting on workers
+                db.commit()
+
+            if not in_flight:
+                break
+
+            # Write chunks back in order so the watermark is always contiguous
+            chunk_last_id, fut = in_flight.popleft()
+            rotated_rows, failed = fut.result()
+            params = [
+                {"b_id": conn_id, "b_old_access": old_access, "b_old_refresh": old_refresh, "b_access": new_access, "b_refresh": new_refresh}
+                for conn_id, old_access, old_refresh, new_access, new_refresh in rotated_rows
+            ]
+            written = 0
+            if params:
+                result = db.connection().execute(cas_update, params)
+                written = result.rowcount if result.rowcount is not None and result.rowcount >= 0 else len(params)
+            if failed:
+                logger.warning(f"Key rotation {name}: no configured key decrypts connection ids {failed}, left as they are")
+                failed_ids.extend(failed)
+            job.rotated += written
+            job.skipped += len(params) - written
+            job.failed += len(failed)
+            job.last_id = chunk_last_id
+            db.commit()
+
+        job.completed_at = utcnow()
+        db.commit()
+        logger.info(f"Key rotation {name} complete: {job.rotated} rotated, {job.skipped} skipped, {job.failed} failed")
+        return {
+            "job": name,
+            "rotated": job.rotated,
+            "skipped": job.skipped,
+            "failed": job.failed,
+            "failed_ids": failed_ids,
+            "last_id": job.last_id,
+            "resumed": resumed,
+        }
+
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+        db.close()
@@ -1,22 +1,38 @@
 import uuid
+import json
 import logging
-from datetime import timedelta, timezone
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from fastapi import FastAPI, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from typing import Optional
+from sqlalchemy.exc import IntegrityError
+from pydantic import BaseModel, Field
+from typing import Optional, List
 
 from app.settings import settings
-from app.db import engine, Base, get_db, utcnow
-from app.models import Connection, Transaction, OAuthState
+from app.db import engine, Base, get_db, get_read_db, utcnow
+from app.models import Connection, OAuthState, Transaction, WebhookEvent
 from app.crypto import encrypt_str
 from app.provider_mock import router as provider_router
-from app.provider_client import ProviderClient
+from app.provider_client import ProviderClient, close_shared_async_client
+from app.concurrency import ConcurrencyLimiter, OverloadedError, run_db
+from app.resilience import CircuitOpenError, resilience_snapshot
 from app.sync import run_sync
+from app.single_flight import SyncInProgressError
+from app.backfill import run_backfill
+from app.reconcile import reconcile_account
+from app.change_feed import list_changes
+from app.archive import list_transactions_tiered
+from app.search import ensure_search_index, search_transactions
+from app.schema import upgrade_schema
+from app import columnar
+from app.webhooks import debouncer, verify_signature
 from app.logging_config import configure_logging
 
-# Create tables
+# Create tables, then upgrade the ones an earlier version created
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
+ensure_search_index(engine)
 
 # Configure logging
 configure_logging()
@@ -24,6 +40,19 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Fintech OAuth Sync Lab")
 
+@app.on_event("startup")
+def start_debouncer():
+    if settings.WEBHOOK_DEBOUNCE_ENABLED:
+        debouncer.start(tick_seconds=settings.WEBHOOK_TICK_SECONDS)
+
+@app.on_event("shutdown")
+def stop_debouncer():
+    debouncer.stop()
+
+@app.on_event("shutdown")
+async def close_provider_client():
+    await close_shared_async_client()
+
 @app.middleware("http")
 async def add_request_logging(request: Request, call_next):
     request_id = str(uuid.uuid4())
@@ -46,50 +75,43 @@ app.include_router(provider_router, prefix="/provider", tags=["mock-provider"])
 class StartConnectRequest(BaseModel):
     account_id: str
 
+class BackfillRequest(BaseModel):
+    account_id: str
+    window_days: Optional[int] = Field(None, gt=0)
+    concurrency: Optional[int] = Field(None, gt=0)
+    history_days: Optional[int] = Field(None, gt=0)
+
+class ReconcileRequest(BaseModel):
+    account_id: str
+    rl: bool = False
+
 class SyncRequest(BaseModel):
     account_id: str
     rl: bool = False
+    profile: bool = False
 
-@app.post("/connect/start")
-def start_connect(req: StartConnectRequest, request: Request, db: Session = Depends(get_db)):
-    state = str(uuid.uuid4())
-    
-    # Store state in DB with TTL
-    oauth_state = OAuthState(
-        state=state,
-        account_id=req.account_id,
-        expires_at=utcnow() + timedelta(minutes=10)
-    )
+connect_limiter = ConcurrencyLimiter(settings.CONNECT_MAX_CONCURRENCY)
+
+@asynccontextmanager
+async def connect_slot(request: Request):
+    # Shed load early rather than queueing behind a slow provider
+    try:
+        async with connect_limiter.slot():
+            yield
+    except OverloadedError as e:
+        logger.warning(f"Connect request rejected: {e}", extra={"request_id": request.state.request_id})
+        raise HTTPException(status_code=503, detail="Too many concurrent connect requests", headers={"Retry-After": "1"})
+
+def _store_oauth_state(db: Session, oauth_state: OAuthState):
     db.add(oauth_state)
     db.commit()
-    
-    redirect_uri = f"{settings.APP_BASE_URL}/connect/callback"
-    
-    # Check provider mock directly or construct URL
-    # In real world, we construct the URL to redirec the user to.
-    auth_url = (
-        f"{settings.PROVIDER_BASE_URL}/authorize"
-        f"?client_id={settings.PROVIDER_CLIENT_ID}"
-        f"&redirect_uri={redirect_uri}"
-        f"&state={state}"
-    )
-    
-    logger.info(f"Started connect flow for account {req.account_id}", extra={"request_id": request.state.request_id})
-    return {"authorize_url": auth_url, "state": state}
 
-@app.get("/connect/callback")
-def connect_callback(
-    code: str,
-    state: str,
-    request: Request,
-    db: Session = Depends(get_db)
-):
-    # Lookup state
+def _consume_oauth_state(db: Session, state: str):
+    """Look up and delete (use once) an OAuth state. Returns (account_id, error)."""
     oauth_state_row = db.query(OAuthState).filter(OAuthState.state == state).first()
     
     if not oauth_state_row:
-        logger.warning(f"Invalid state received: {state}", extra={"request_id": request.state.request_id})
-        raise HTTPException(status_code=400, detail="Invalid state")
+        return None, "Invalid state"
         
     # Handle naive/aware comparison. DB likely returns naive (UTC context).
     expires_at = oauth_state_row.expires_at
@@ -99,27 +121,16 @@ def connect_callback(
     if expires_at < utcnow():
         db.delete(oauth_state_row)
         db.commit()
-        logger.warning(f"Expired state received: {state}", extra={"request_id": request.state.request_id})
-        raise HTTPException(status_code=400, detail="State expired")
+        return None, "State expired"
     
     account_id = oauth_state_row.account_id
     
     # Use once and delete
     db.delete(oauth_state_row)
     db.commit()
-        
-    client = ProviderClient()
-    try:
-        tokens = client.exchange_code_for_token(code)
-    except Exception as e:
-        logger.error(f"Token exchange failed: {e}", extra={"request_id": request.state.request_id})
-        raise HTTPException(status_code=400, detail=f"Token exchange failed: {e}")
-        
-    access_token = tokens["access_token"]
-    refresh_token = tokens.get("refresh_token")
-    expires_in = tokens.get("expires_in")
-    
-    # Store connection
+    return account_id, None
+
+def _store_connection(db: Session, account_id: str, access_token: str, refresh_token: Optional[str]):
     conn = db.query(Connection).filter(Connection.account_id == account_id).first()
     if not conn:
         conn = Connection(account_id=account_id)
@@ -130,27 +141,275 @@ def connect_callback(
     # Calculate expires_at ... skipped for brevity, not critical for sync lab logic
     
     db.commit()
-    
-    return {"status": "connected", "account_id": account_id}
+
+@app.post("/connect/start")
+async def start_connect(req: StartConnectRequest, request: Request, db: Session = Depends(get_db)):
+    async with connect_slot(request):
+        state = str(uuid.uuid4())
+        
+        # Store state in DB with TTL
+        oauth_state = OAuthState(
+            state=state,
+            account_id=req.account_id,
+            expires_at=utcnow() + timedelta(minutes=10)
+        )
+        await run_db(_store_oauth_state, db, oauth_state)
+        
+        redirect_uri = f"{settings.APP_BASE_URL}/connect/callback"
+        
+        # Check provider mock directly or construct URL
+        # In real world, we construct the URL to redirec the user to.
+        auth_url = (
+            f"{settings.PROVIDER_BASE_URL}/authorize"
+            f"?client_id={settings.PROVIDER_CLIENT_ID}"
+            f"&redirect_uri={redirect_uri}"
+            f"&state={state}"
+        )
+        
+        logger.info(f"Started connect flow for account {req.account_id}", extra={"request_id": request.state.request_id})
+        return {"authorize_url": auth_url, "state": state}
+
+@app.get("/connect/callback")
+async def connect_callback(
+    code: str,
+    state: str,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    async with connect_slot(request):
+        account_id, error = await run_db(_consume_oauth_state, db, state)
+        if error:
+            logger.warning(f"{error} received: {state}", extra={"request_id": request.state.request_id})
+            raise HTTPException(status_code=400, detail=error)
+            
+        # Awaited, not blocking a thread, while the provider's token endpoint responds
+        client = ProviderClient()
+        try:
+            tokens = await client.aexchange_code_for_token(code)
+        except CircuitOpenError as e:
+            logger.warning(f"Token exchange rejected, provider circuit open: {e}", extra={"request_id": request.state.request_id})
+            raise HTTPException(status_code=503, detail=str(e))
+        except Exception as e:
+            logger.error(f"Token exchange failed: {e}", extra={"request_id": request.state.request_id})
+            raise HTTPException(status_code=400, detail=f"Token exchange failed: {e}")
+            
+        access_token = tokens["access_token"]
+        refresh_token = tokens.get("refresh_token")
+        
+        # Store connection
+        await run_db(_store_connection, db, account_id, access_token, refresh_token)
+        
+        return {"status": "connected", "account_id": account_id}
 
 @app.post("/sync/run")
 def trigger_sync(req: SyncRequest, request: Request):
+    if req.profile and not settings.SYNC_PROFILE_REQUESTS_ENABLED:
+        raise HTTPException(status_code=403, detail="Per-request profiling is disabled (SYNC_PROFILE_REQUESTS_ENABLED)")
     try:
         logger.info(f"Triggering sync for {req.account_id}", extra={"request_id": request.state.request_id})
-        stats = run_sync(req.account_id, rl=req.rl)
+        stats = run_sync(req.account_id, rl=req.rl, profile=req.profile)
         return {"status": "success", "stats": stats}
+    except SyncInProgressError as e:
+        raise HTTPException(
+            status_code=409,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after) + 1)}
+        )
+    except CircuitOpenError as e:
+        logger.warning(f"Sync rejected, provider circuit open: {e}", extra={"request_id": request.state.request_id})
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after) + 1)}
+        )
     except Exception as e:
         logger.error(f"Sync exception: {e}", extra={"request_id": request.state.request_id})
         raise HTTPException(status_code=500, detail=str(e))
 
+def _record_webhook_event(db: Session, account_id: str, event_id: Optional[str]) -> str:
+    """"ignored" for an unknown account, "duplicate" for an event_id already seen, else "queued"."""
+    if not db.query(Connection.id).filter(Connection.account_id == account_id).first():
+        return "ignored"
+    if event_id is None:
+        return "queued"
+    db.query(WebhookEvent).filter(
+        # Naive UTC, as stored
+        WebhookEvent.received_at < utcnow().replace(tzinfo=None) - timedelta(hours=settings.WEBHOOK_EVENT_RETENTION_HOURS)
+    ).delete(synchronize_session=False)
+    db.add(WebhookEvent(event_id=str(event_id), account_id=account_id))
+    try:
+        db.commit()
+    except IntegrityError:
+        # The provider redelivered it (a retry or a replay)
+        db.rollback()
+        return "duplicate"
+    return "queued"
+
+@app.post("/webhooks/provider", status_code=202)
+async def provider_webhook(request: Request, db: Session = Depends(get_db)):
+    body = await request.body()
+    if not verify_signature(body, request.headers.get("X-Provider-Signature")):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+
+    try:
+        event = json.loads(body)
+        account_id = event["account_id"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Malformed event")
+
+    status = await run_db(_record_webhook_event, db, account_id, event.get("event_id"))
+    if status == "ignored":
+        logger.warning(f"Webhook for unknown account {account_id}", extra={"request_id": request.state.request_id})
+        return {"status": "ignored"}
+    if status == "duplicate":
+        return {"status": "duplicate"}
+
+    # Don't sync inline: bursts are coalesced by the debouncer
+    debouncer.mark_dirty(account_id)
+    return {"status": "queued"}
+
+@app.get("/webhooks/status")
+def webhook_status():
+    return debouncer.snapshot()
+
+@app.get("/health/provider")
+def provider_health():
+    # Breaker state and hedge win rates per provider
+    return resilience_snapshot()
+
+@app.post("/sync/backfill")
+def trigger_backfill(req: BackfillRequest, request: Request):
+    # For newly connected accounts: parallel windowed history load, then regular sync
+    try:
+        logger.info(f"Triggering backfill for {req.account_id}", extra={"request_id": request.state.request_id})
+        stats = run_backfill(
+            req.account_id,
+            window_days=req.window_days,
+            concurrency=req.concurrency,
+            history_days=req.history_days
+        )
+        return {"status": "success", "stats": stats}
+    except SyncInProgressError as e:
+        raise HTTPException(
+            status_code=409,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after) + 1)}
+        )
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+    except Exception as e:
+        logger.error(f"Backfill exception: {e}", extra={"request_id": request.state.request_id})
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/sync/reconcile")
+def trigger_reconcile(req: ReconcileRequest, request: Request):
+    # Integrity check: compares digests and re-fetches only drifted days
+    try:
+        logger.info(f"Reconciling {req.account_id}", extra={"request_id": request.state.request_id})
+        stats = reconcile_account(req.account_id, rl=req.rl)
+        return {"status": "success", "stats": stats}
+    except SyncInProgressError as e:
+        raise HTTPException(
+            status_code=409,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after) + 1)}
+        )
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+    except Exception as e:
+        logger.error(f"Reconcile exception: {e}", extra={"request_id": request.state.request_id})
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/transactions")
 def list_transactions(
     account_id: str,
     limit: int = 200,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    txns = db.query(Transaction).filter(
+    # The original contract: rows of the hot table only. /v2/transactions includes archived months.
+    return db.query(Transaction).filter(
         Transaction.account_id == account_id
     ).order_by(Transaction.posted_at.desc()).limit(limit).all()
-    
-    return txns
+
+@app.get("/v2/transactions")
+def list_transactions_v2(
+    account_id: str,
+    limit: int = 200,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Hot rows plus archived months, merged newest first. Same fields as
+    /transactions plus `archived`; `id` is null for archived rows that
+    were never in the hot table.
+    """
+    return list_transactions_tiered(db, account_id, limit=limit)
+
+@app.get("/transactions/search")
+def transaction_search(
+    account_id: str,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Ranked matches on description; pass next_cursor back for the next page.
+    Searches the hot tier only: archived transactions (posted before
+    `archive_cutoff` in the response) are not included. List them with
+    /v2/transactions.
+    """
+    try:
+        return search_transactions(db, account_id, q, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _columns(db: Session, account_id: str) -> dict:
+    try:
+        return columnar.load_columns(db, account_id)
+    except columnar.ColumnarUnavailableError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+@app.get("/analytics/daily")
+def analytics_daily(
+    account_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    currency: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    # Served from the columnar cache, not the transactions table
+    return columnar.daily_totals(_columns(db, account_id), start, end, currency)
+
+@app.get("/analytics/moving-average")
+def analytics_moving_average(
+    account_id: str,
+    window_days: int = Query(7, ge=1, le=365),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    currency: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    return columnar.moving_average(_columns(db, account_id), window_days, start, end, currency)
+
+@app.get("/analytics/percentiles")
+def analytics_percentiles(
+    account_id: str,
+    q: List[float] = Query([50, 90, 99]),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    currency: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    if any(not 0 <= p <= 100 for p in q):
+        raise HTTPException(status_code=400, detail="Percentiles must be between 0 and 100")
+    return columnar.percentiles(_columns(db, account_id), q, start, end, currency)
+
+@app.get("/transactions/changes")
+def transaction_changes(
+    since_seq: int = 0,
+    account_id: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_read_db)
+):
+    # Poll with the returned next_since_seq; cost is O(changes), not O(rows)
+    return list_changes(db, since_seq=since_seq, account_id=account_id, limit=limit)
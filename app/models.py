@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, Text, LargeBinary, UniqueConstraint, Index
 from sqlalchemy.sql import func
 from app.db import Base, utcnow
 
@@ -35,6 +35,7 @@ class Transaction(Base):
     description = Column(String, nullable=True)
     posted_at = Column(DateTime, nullable=False)
     raw_json = Column(Text, nullable=True)
+    content_hash = Column(String(64), nullable=True)  # sha256 of the provider item
     created_at = Column(DateTime, default=func.now())
 
     __table_args__ = (
@@ -47,5 +48,114 @@ class SyncState(Base):
     id = Column(Integer, primary_key=True, index=True)
     account_id = Column(String, unique=True, nullable=False)
     cursor = Column(Text, nullable=True)
+    journal_offset = Column(Integer, nullable=False, default=0)  # page journal position applied so far
     last_synced_at = Column(DateTime, nullable=True)
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class PageValidator(Base):
+    __tablename__ = "page_validators"
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(String, nullable=False)
+    cursor = Column(String, nullable=False, default="")  # "" is the first page
+    etag = Column(String, nullable=True)
+    last_modified = Column(String, nullable=True)
+    next_cursor = Column(Text, nullable=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('account_id', 'cursor', name='uq_account_page_cursor'),
+    )
+
+class KeyRotationJob(Base):
+    __tablename__ = "key_rotation_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)  # fingerprint of the target key
+    last_id = Column(Integer, nullable=False, default=0)  # connections.id watermark
+    rotated = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)  # rows no configured key could decrypt
+    completed_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class TransactionChange(Base):
+    __tablename__ = "transaction_changes"
+
+    # AUTOINCREMENT so sequence numbers are never reused, even after compaction
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    account_id = Column(String, nullable=False)
+    transaction_id = Column(Integer, nullable=True, index=True)  # None for archived (cold) rows
+    provider_txn_id = Column(String, nullable=False)
+    op = Column(String, nullable=False)  # "insert" | "update" | "delete"
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        Index('ix_transaction_changes_account_seq', 'account_id', 'seq'),
+        {"sqlite_autoincrement": True},
+    )
+
+class BackfillWindow(Base):
+    __tablename__ = "backfill_windows"
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(String, nullable=False, index=True)
+    window_start = Column(DateTime, nullable=False)
+    window_end = Column(DateTime, nullable=False)
+    cursor = Column(Text, nullable=True)  # next page within the window
+    status = Column(String, nullable=False, default="pending")  # "pending" | "done"
+    items_fetched = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('account_id', 'window_start', name='uq_backfill_account_window'),
+    )
+
+class TransactionArchive(Base):
+    __tablename__ = "transaction_archives"
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(String, nullable=False)
+    month = Column(String(7), nullable=False)  # "YYYY-MM" of posted_at
+    payload = Column(LargeBinary, nullable=False)  # zlib-compressed JSON, keyed by provider_txn_id
+    row_count = Column(Integer, nullable=False, default=0)
+    version = Column(Integer, nullable=False, default=0)  # bumped on every write; saves are conditional on it
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('account_id', 'month', name='uq_archive_account_month'),
+    )
+
+class DayBucket(Base):
+    __tablename__ = "day_buckets"
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(String, nullable=False)
+    day = Column(String(10), nullable=False)  # "YYYY-MM-DD" of posted_at
+    digest = Column(String(64), nullable=False)  # sum of content hashes mod 2^256
+    row_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('account_id', 'day', name='uq_bucket_account_day'),
+    )
+
+class SyncLease(Base):
+    __tablename__ = "sync_leases"
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(String, unique=True, nullable=False)
+    owner = Column(String, nullable=True)  # worker running the sync; None when idle
+    generation = Column(Integer, nullable=False, default=0)  # bumped on every acquire
+    expires_at = Column(DateTime, nullable=True)  # naive UTC; renewed while the sync runs
+    finished_at = Column(DateTime, nullable=True)
+    last_result = Column(Text, nullable=True)  # JSON stats of the last finished run
+    last_error = Column(Text, nullable=True)
+
+class WebhookEvent(Base):
+    __tablename__ = "webhook_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(String, unique=True, nullable=False)  # provider's id; a replay reuses it
+    account_id = Column(String, nullable=False)
+    received_at = Column(DateTime, index=True, nullable=False, default=utcnow)
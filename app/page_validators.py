@@ -0,0 +1,64 @@
+from sqlalchemy.orm import Session
+from app.models import PageValidator
+
+class DbPageValidatorStore:
+    """
+    Persists page validators (ETag / Last-Modified) per (account, cursor) so that
+    a resync can send conditional requests and skip unchanged pages.
+    The next_cursor is stored alongside so a 304 can still follow the cursor chain.
+    """
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _row(self, account_id: str, cursor: str):
+        return self.db.query(PageValidator).filter(
+            PageValidator.account_id == account_id,
+            PageValidator.cursor == (cursor or "")
+        ).first()
+
+    def get(self, account_id: str, cursor: str):
+        row = self._row(account_id, cursor)
+        if not row:
+            return None
+        return {"etag": row.etag, "last_modified": row.last_modified, "next_cursor": row.next_cursor}
+
+    def put(self, account_id: str, cursor: str, etag: str, last_modified: str, next_cursor: str):
+        # Not committed here; it is committed with the page it describes so a
+        # crash before the page is written can't leave a validator for unwritten data
+        row = self._row(account_id, cursor)
+        if not row:
+            row = PageValidator(account_id=account_id, cursor=cursor or "")
+            self.db.add(row)
+        row.etag = etag
+        row.last_modified = last_modified
+        row.next_cursor = next_cursor
+
+    def clear(self, account_id: str):
+        self.db.query(PageValidator).filter(PageValidator.account_id == account_id).delete()
+
+class DeferredPageValidatorStore:
+    """
+    Validator store for a fetcher that doesn't write the pages itself.
+    Reads come from the database; a new validator is held until take() so it
+    can travel with its page (e.g. in the page journal) and be stored by
+    whoever applies the page. `lock` serializes the reads with other DB users.
+    """
+    def __init__(self, db: Session, lock):
+        self.db = db
+        self.lock = lock
+        self._inner = DbPageValidatorStore(db)
+        self._pending = None
+
+    def get(self, account_id: str, cursor: str):
+        with self.lock:
+            validator = self._inner.get(account_id, cursor)
+            # Don't keep a read transaction open between pages
+            self.db.commit()
+        return validator
+
+    def put(self, account_id: str, cursor: str, etag: str, last_modified: str, next_cursor: str):
+        self._pending = {"cursor": cursor, "etag": etag, "last_modified": last_modified, "next_cursor": next_cursor}
+
+    def take(self):
+        validator, self._pending = self._pending, None
+        return validator
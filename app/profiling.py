@@ -0,0 +1,91 @@
+import os
+import time
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager
+from app.db import utcnow
+
+logger = logging.getLogger(__name__)
+
+class PhaseTimer:
+    """
+    Accumulates wall time per named phase.
+    Phases must not be nested; whatever is not covered by a phase ends up in "other".
+    """
+    def __init__(self):
+        self._start = time.perf_counter()
+        self.totals = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] = self.totals.get(name, 0.0) + (time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        total = time.perf_counter() - self._start
+        out = {name: round(seconds, 6) for name, seconds in self.totals.items()}
+        out["other"] = round(max(total - sum(self.totals.values()), 0.0), 6)
+        out["total"] = round(total, 6)
+        return out
+
+# cProfile can only have one active profiler at a time on newer Pythons
+_profile_lock = threading.Lock()
+
+def _prune_profiles(out_dir: str, keep: int):
+    """Delete all but the newest `keep` .prof files in out_dir."""
+    dumps = sorted(
+        (entry for entry in os.scandir(out_dir) if entry.is_file() and entry.name.endswith(".prof")),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True
+    )
+    for entry in dumps[keep:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+@contextmanager
+def maybe_profile(enabled: bool, out_dir: str, label: str, keep: int = None):
+    """
+    Profile the enclosed block with cProfile and dump stats to out_dir,
+    then delete all but the newest `keep` dumps there (None keeps all).
+    Yields a dict whose "path" is filled in once the profile is written
+    (None if profiling was disabled or another profile was already running).
+
+    Only the calling thread is profiled: cProfile hooks the thread that
+    enables it. Work the block hands to other threads (hedged fetch
+    attempts, the journal fetcher, backfill windows, run_db) shows up as
+    the time spent waiting for it, not as its own calls; PhaseTimer's
+    timings still account for it.
+    """
+    result = {"path": None}
+    if not enabled:
+        yield result
+        return
+
+    if not _profile_lock.acquire(blocking=False):
+        logger.warning(f"Profiler busy, running {label} without profiling")
+        yield result
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield result
+        finally:
+            profiler.disable()
+            os.makedirs(out_dir, exist_ok=True)
+            safe_label = "".join(c if c.isalnum() or c in "-_" else "_" for c in label)
+            path = os.path.join(out_dir, f"{safe_label}-{utcnow().strftime('%Y%m%dT%H%M%S%f')}.prof")
+            profiler.dump_stats(path)
+            result["path"] = path
+            logger.info(f"Wrote profile to {path}")
+            if keep is not None:
+                _prune_profiles(out_dir, keep)
+    finally:
+        _profile_lock.release()
@@ -1,5 +1,8 @@
+import time
+from datetime import datetime
 import httpx
 from app.settings import settings
+from app.resilience import get_breaker, get_latency_tracker, get_hedge_stats, hedged_call
 
 class TokenExpiredError(Exception):
     """Raised when provider returns 401"""
@@ -10,16 +13,91 @@ class RateLimitedError(Exception):
     def __init__(self, retry_after: int):
         self.retry_after = retry_after
 
+# One AsyncClient per process so connections to the provider are pooled
+_async_client = None
+
+def get_shared_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=settings.HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=settings.PROVIDER_MAX_CONNECTIONS)
+        )
+    return _async_client
+
+async def close_shared_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
 class ProviderClient:
-    def __init__(self):
+    def __init__(self, validator_store=None):
+        # Optional store of per-(account, cursor) ETag/Last-Modified validators.
+        # Must provide get(account_id, cursor) and put(account_id, cursor, etag, last_modified, next_cursor).
+        self.validator_store = validator_store
         self.base_url = settings.PROVIDER_BASE_URL
         self.client_id = settings.PROVIDER_CLIENT_ID
         self.client_secret = settings.PROVIDER_CLIENT_SECRET
         self.timeout = settings.HTTP_TIMEOUT_SECONDS
+        # Breaker and latency stats are shared by every client for this provider
+        self.breaker = get_breaker(self.base_url)
+        self.latency = get_latency_tracker(self.base_url)
+        self.hedge_stats = get_hedge_stats(self.base_url)
 
     def _get_client(self):
         return httpx.Client(timeout=self.timeout)
 
+    def _get_async_client(self) -> httpx.AsyncClient:
+        # Shared, not context-managed per call: closing it is the app's job on shutdown
+        return get_shared_async_client()
+
+    def _record_failure(self, e: Exception, elapsed: float):
+        if isinstance(e, (TokenExpiredError, RateLimitedError)):
+            # The provider answered, so these don't count against its health
+            self.breaker.record(True, elapsed)
+        elif isinstance(e, httpx.HTTPStatusError):
+            self.breaker.record(e.response.status_code < 500, elapsed)
+        else:
+            # Timeouts, connection errors, etc.
+            self.breaker.record(False, elapsed)
+
+    def _record_success(self, elapsed: float):
+        self.breaker.record(True, elapsed)
+        self.latency.observe(elapsed)
+
+    def _guarded(self, fn, hedge: bool = False):
+        """
+        Run a provider call through the circuit breaker.
+        Raises CircuitOpenError without touching the network while the circuit is open.
+        """
+        self.breaker.before_call()
+        start = time.monotonic()
+        try:
+            if hedge and settings.HEDGE_ENABLED:
+                result = hedged_call(fn, self.latency.p95(), self.hedge_stats)
+            else:
+                result = fn()
+        except Exception as e:
+            self._record_failure(e, time.monotonic() - start)
+            raise
+
+        self._record_success(time.monotonic() - start)
+        return result
+
+    async def _aguarded(self, fn):
+        """Async counterpart of _guarded; fn is a coroutine function."""
+        self.breaker.before_call()
+        start = time.monotonic()
+        try:
+            result = await fn()
+        except Exception as e:
+            self._record_failure(e, time.monotonic() - start)
+            raise
+
+        self._record_success(time.monotonic() - start)
+        return result
+
     def exchange_code_for_token(self, code: str):
         data = {
             "grant_type": "authorization_code",
@@ -27,11 +105,29 @@ class ProviderClient:
             "client_id": self.client_id,
             "client_secret": self.client_secret
         }
-        with self._get_client() as client:
-            resp = client.post(f"{self.base_url}/token", data=data)
+        def call():
+            with self._get_client() as client:
+                resp = client.post(f"{self.base_url}/token", data=data)
+                resp.raise_for_status()
+                return resp.json()
+
+        return self._guarded(call)
+
+    async def aexchange_code_for_token(self, code: str):
+        """Non-blocking token exchange over the shared async client."""
+        data = {
+            "grant_type": "authorization_code",
+            "code": code,
+            "client_id": self.client_id,
+            "client_secret": self.client_secret
+        }
+        async def call():
+            resp = await self._get_async_client().post(f"{self.base_url}/token", data=data)
             resp.raise_for_status()
             return resp.json()
 
+        return await self._aguarded(call)
+
     def refresh_access_token(self, refresh_token: str):
         data = {
             "grant_type": "refresh_token",
@@ -39,40 +135,111 @@ class ProviderClient:
             "client_id": self.client_id,
             "client_secret": self.client_secret
         }
-        with self._get_client() as client:
-            resp = client.post(f"{self.base_url}/token", data=data)
-            if resp.status_code == 401 or resp.status_code == 403:
-                # If refresh token itself is expired/invalid
-                raise TokenExpiredError("Refresh token expired or invalid")
-            resp.raise_for_status()
-            return resp.json()
+        def call():
+            with self._get_client() as client:
+                resp = client.post(f"{self.base_url}/token", data=data)
+                if resp.status_code == 401 or resp.status_code == 403:
+                    # If refresh token itself is expired/invalid
+                    raise TokenExpiredError("Refresh token expired or invalid")
+                resp.raise_for_status()
+                return resp.json()
 
-    def fetch_transactions_page(self, account_id: str, access_token: str, cursor: str = None, rl: bool = False):
+        return self._guarded(call)
+
+    def fetch_transactions_page(
+        self,
+        account_id: str,
+        access_token: str,
+        cursor: str = None,
+        rl: bool = False,
+        start_date: datetime = None,
+        end_date: datetime = None
+    ):
         params = {"account_id": account_id}
         if cursor:
             params["cursor"] = cursor
+        # Optional [start_date, end_date) window; cursors are then scoped to that window
+        if start_date:
+            params["start_date"] = start_date.isoformat()
+        if end_date:
+            params["end_date"] = end_date.isoformat()
         if rl:
             params["rl"] = "true"
             
         headers = {"Authorization": f"Bearer {access_token}"}
+
+        # Conditional request if we've seen this page before
+        validator = None
+        windowed = bool(start_date or end_date)
+        if self.validator_store is not None and not windowed:
+            validator = self.validator_store.get(account_id, cursor)
+        if validator:
+            if validator.get("etag"):
+                headers["If-None-Match"] = validator["etag"]
+            elif validator.get("last_modified"):
+                headers["If-Modified-Since"] = validator["last_modified"]
         
-        with self._get_client() as client:
-            resp = client.get(
-                f"{self.base_url}/transactions", 
-                params=params, 
-                headers=headers
-            )
-            
-            if resp.status_code == 401:
-                raise TokenExpiredError("Access token expired")
-            
-            if resp.status_code == 429:
-                retry_header = resp.headers.get("Retry-After", "1")
-                try:
-                    retry_after = int(retry_header)
-                except ValueError:
-                    retry_after = 1
-                raise RateLimitedError(retry_after)
-            
-            resp.raise_for_status()
-            return resp.json()
+        def call():
+            with self._get_client() as client:
+                resp = client.get(
+                    f"{self.base_url}/transactions", 
+                    params=params, 
+                    headers=headers
+                )
+                
+                if resp.status_code == 401:
+                    raise TokenExpiredError("Access token expired")
+                
+                if resp.status_code == 429:
+                    retry_header = resp.headers.get("Retry-After", "1")
+                    try:
+                        retry_after = int(retry_header)
+                    except ValueError:
+                        retry_after = 1
+                    raise RateLimitedError(retry_after)
+
+                if resp.status_code == 304:
+                    return resp, None
+                
+                resp.raise_for_status()
+                return resp, resp.json()
+
+        # Page fetches are idempotent GETs, so they may be hedged
+        resp, page = self._guarded(call, hedge=True)
+
+        if page is None:
+            # Unchanged since last fetch: no body to parse, follow the stored cursor chain
+            return {"items": [], "next_cursor": validator["next_cursor"], "not_modified": True}
+
+        if self.validator_store is not None and not windowed:
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+            if etag or last_modified:
+                self.validator_store.put(account_id, cursor, etag, last_modified, page.get("next_cursor"))
+        return page
+
+    def fetch_digests(
+        self,
+        account_id: str,
+        access_token: str,
+        granularity: str = "day",
+        start_date: datetime = None,
+        end_date: datetime = None
+    ) -> dict:
+        """Provider's bucket digests: {bucket key: {"digest", "count"}}."""
+        params = {"account_id": account_id, "granularity": granularity}
+        if start_date:
+            params["start_date"] = start_date.isoformat()
+        if end_date:
+            params["end_date"] = end_date.isoformat()
+        headers = {"Authorization": f"Bearer {access_token}"}
+
+        def call():
+            with self._get_client() as client:
+                resp = client.get(f"{self.base_url}/digests", params=params, headers=headers)
+                if resp.status_code == 401:
+                    raise TokenExpiredError("Access token expired")
+                resp.raise_for_status()
+                return resp.json()["buckets"]
+
+        return self._guarded(call)
@@ -1,9 +1,16 @@
 from fastapi import APIRouter, HTTPException, Query, Form, Header, Response
 from pydantic import BaseModel
 from typing import Optional
+from email.utils import format_datetime, parsedate_to_datetime
 import uuid
+import math
 import datetime
+import hashlib
 import json
+import httpx
+from app.settings import settings
+from app.webhooks import sign_payload
+from app.hashing import content_hash, digest_add, day_key, EMPTY_DIGEST
 
 router = APIRouter()
 
@@ -13,6 +20,33 @@ ratelimit_memory = set()
 def reset_ratelimits():
     ratelimit_memory.clear()
 
+# Per-account data shape. Accounts not listed get the default 3 pages x 5 items.
+# Bumping "revision" changes every item's description, simulating edits on the provider side.
+# "edited" / "deleted" are item indexes changed or removed after the fact, to simulate drift.
+DEFAULT_MOCK_ACCOUNT = {"pages": 3, "page_size": 5, "history_days": 10, "revision": 0, "edited": frozenset(), "deleted": frozenset()}
+mock_accounts = {}
+
+def configure_mock_account(
+    account_id: str,
+    pages: int = 3,
+    page_size: int = 5,
+    history_days: int = 10,
+    revision: int = 0,
+    edited=(),
+    deleted=()
+):
+    mock_accounts[account_id] = {
+        "pages": pages,
+        "page_size": page_size,
+        "history_days": history_days,
+        "revision": revision,
+        "edited": frozenset(edited),
+        "deleted": frozenset(deleted),
+    }
+
+def reset_mock_accounts():
+    mock_accounts.clear()
+
 @router.get("/authorize")
 def authorize(
     client_id: str,
@@ -46,36 +80,94 @@ def token(
         "expires_in": expires_in
     }
 
-def generate_mock_txns(account_id: str, page: int):
-    # 3 pages total: 0, 1, 2. Page 3 is empty.
-    if page > 2:
-        return []
+def _mock_timeline(account_id: str):
+    profile = mock_accounts.get(account_id, DEFAULT_MOCK_ACCOUNT)
+    total = profile["pages"] * profile["page_size"]
+    # Anchored to midnight so a page's content (and ETag) is stable within a day.
+    # Items are spread evenly over the account's history, oldest first.
+    today = datetime.datetime.combine(datetime.datetime.now(datetime.timezone.utc).date(), datetime.time())
+    base_time = today - datetime.timedelta(days=profile["history_days"])
+    spacing = datetime.timedelta(days=profile["history_days"]) / total
+    return profile, total, base_time, spacing
+
+def _first_index_at_or_after(when, total, base_time, spacing):
+    idx = min(max(math.ceil((when - base_time) / spacing), 0), total)
+    # Nudge for rounding at the boundary
+    while idx > 0 and base_time + spacing * (idx - 1) >= when:
+        idx -= 1
+    while idx < total and base_time + spacing * idx < when:
+        idx += 1
+    return idx
+
+def mock_item_range(account_id: str, start_date=None, end_date=None):
+    """Index range [lo, hi) of the account's items posted in [start_date, end_date)"""
+    # Item timestamps are naive UTC
+    if start_date and start_date.tzinfo:
+        start_date = start_date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    if end_date and end_date.tzinfo:
+        end_date = end_date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    _, total, base_time, spacing = _mock_timeline(account_id)
+    lo = _first_index_at_or_after(start_date, total, base_time, spacing) if start_date else 0
+    hi = _first_index_at_or_after(end_date, total, base_time, spacing) if end_date else total
+    return lo, max(lo, hi)
+
+def generate_mock_txns(account_id: str, page: int, start_date=None, end_date=None):
+    # Default shape: 3 pages total: 0, 1, 2. Page 3 is empty.
+    # With a date range, pages are numbered within the range.
+    profile, total, base_time, spacing = _mock_timeline(account_id)
+    page_size = profile["page_size"]
+    lo, hi = mock_item_range(account_id, start_date, end_date)
     
-    base_time = datetime.datetime.now() - datetime.timedelta(days=10)
-    # 5 items per page
     items = []
-    for i in range(5):
-        idx = page * 5 + i
-        provider_txn_id = f"txn_{account_id}_{idx}"
-        amount = 1000 + (idx * 100) 
-        posted_at = base_time + datetime.timedelta(hours=idx)
-        
-        items.append({
-            "id": provider_txn_id,
-            "amount": amount,
-            "currency": "USD",
-            "description": f"Mock Txn {idx} for {account_id}",
-            "posted_at": posted_at.isoformat(),
-            "status": "posted"
-        })
-    return items
+    for idx in range(lo + page * page_size, min(lo + (page + 1) * page_size, hi)):
+        if idx in profile["deleted"]:
+            continue
+        items.append(_mock_item(account_id, idx, profile, base_time, spacing))
+    has_more = lo + (page + 1) * page_size < hi
+    return items, has_more
+
+def _mock_item(account_id: str, idx: int, profile: dict, base_time, spacing) -> dict:
+    amount = 1000 + (idx * 100)
+    posted_at = base_time + spacing * idx
+    description = f"Mock Txn {idx} for {account_id}"
+    if profile["revision"]:
+        description += f" (rev {profile['revision']})"
+    if idx in profile["edited"]:
+        description += " (edited)"
+    return {
+        "id": f"txn_{account_id}_{idx}",
+        "amount": amount,
+        "currency": "USD",
+        "description": description,
+        "posted_at": posted_at.isoformat(),
+        "status": "posted"
+    }
+
+def mock_digests(account_id: str, granularity: str = "day", start_date=None, end_date=None) -> dict:
+    """Per-day or per-month {"digest", "count"} over the account's items in [start_date, end_date)."""
+    profile, _, base_time, spacing = _mock_timeline(account_id)
+    lo, hi = mock_item_range(account_id, start_date, end_date)
+    width = 10 if granularity == "day" else 7
+    buckets = {}
+    for idx in range(lo, hi):
+        if idx in profile["deleted"]:
+            continue
+        item = _mock_item(account_id, idx, profile, base_time, spacing)
+        bucket = buckets.setdefault(day_key(item["posted_at"])[:width], {"digest": EMPTY_DIGEST, "count": 0})
+        bucket["digest"] = digest_add(bucket["digest"], content_hash(item))
+        bucket["count"] += 1
+    return buckets
 
 @router.get("/transactions")
 def transactions_endpoint(
     response: Response,
     account_id: str = Query(...),
     cursor: Optional[str] = Query(None),
-    rl: Optional[bool] = Query(False)
+    rl: Optional[bool] = Query(False),
+    start_date: Optional[datetime.datetime] = Query(None),
+    end_date: Optional[datetime.datetime] = Query(None),
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None)
 ):
     page = 0
     if cursor and cursor.startswith("p"):
@@ -84,7 +176,7 @@ def transactions_endpoint(
         except ValueError:
             page = 0
     
-    key = f"{account_id}:{cursor}"
+    key = f"{account_id}:{start_date}:{end_date}:{cursor}"
     
     if rl:
         if key not in ratelimit_memory:
@@ -97,13 +189,77 @@ def transactions_endpoint(
             # Previously blocked, now allow.
             pass
 
-    items = generate_mock_txns(account_id, page)
+    items, has_more = generate_mock_txns(account_id, page, start_date, end_date)
     
     next_cursor = None
-    if len(items) > 0 and page < 2:
+    if len(items) > 0 and has_more:
         next_cursor = f"p{page+1}"
         
-    return {
+    body = {
         "items": items,
         "next_cursor": next_cursor
     }
+
+    # Validators: strong ETag over the body, Last-Modified from the newest item
+    etag = '"' + hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()[:32] + '"'
+    last_modified = None
+    if items:
+        newest = max(datetime.datetime.fromisoformat(i["posted_at"]) for i in items)
+        last_modified = format_datetime(newest.replace(tzinfo=datetime.timezone.utc), usegmt=True)
+
+    headers = {"ETag": etag}
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+
+    if if_none_match is not None:
+        if if_none_match == etag:
+            return Response(status_code=304, headers=headers)
+    elif if_modified_since and last_modified:
+        try:
+            if parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since):
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+
+    response.headers.update(headers)
+    return body
+
+@router.get("/digests")
+def digests_endpoint(
+    account_id: str = Query(...),
+    granularity: str = Query("day", pattern="^(day|month)$"),
+    start_date: Optional[datetime.datetime] = Query(None),
+    end_date: Optional[datetime.datetime] = Query(None)
+):
+    # Integrity digests so clients can find drifted days without re-downloading everything
+    return {"granularity": granularity, "buckets": mock_digests(account_id, granularity, start_date, end_date)}
+
+def build_webhook_event(account_id: str, event: str = "transactions.updated") -> dict:
+    return {
+        "event_id": str(uuid.uuid4()),
+        "event": event,
+        "account_id": account_id,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+def emit_webhooks(account_id: str, count: int = 1, post=None) -> list:
+    """
+    Deliver `count` signed notifications for an account to the app's receiver.
+    `post` defaults to httpx.post; tests pass a TestClient's post.
+    """
+    post = post or httpx.post
+    url = f"{settings.APP_BASE_URL}/webhooks/provider"
+    statuses = []
+    for _ in range(count):
+        body = json.dumps(build_webhook_event(account_id)).encode("utf-8")
+        resp = post(url, content=body, headers={
+            "Content-Type": "application/json",
+            "X-Provider-Signature": sign_payload(body),
+        })
+        statuses.append(resp.status_code)
+    return statuses
+
+@router.post("/webhooks/emit")
+def emit_webhooks_endpoint(account_id: str = Query(...), count: int = Query(1)):
+    # Simulate the provider noticing new data for an account
+    return {"delivered": emit_webhooks(account_id, count)}
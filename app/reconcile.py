@@ -0,0 +1,188 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from app.db import SessionLocal
+from app.models import Transaction, DayBucket
+from app.provider_client import ProviderClient, TokenExpiredError
+from app.archive import iter_cold_rows, delete_cold_items
+from app.buckets import local_digests
+from app.change_feed import record_changes
+from app.hashing import DIGEST_MODULUS, day_key
+from app.profiling import PhaseTimer
+from app.sync import SyncTokens, load_tokens, fetch_page, apply_page, new_stats
+from app.single_flight import sync_flight
+
+logger = logging.getLogger(__name__)
+
+def _month_bounds(month: str):
+    start = datetime.strptime(month, "%Y-%m")
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+def _day_ranges(days: list) -> list:
+    """Sorted "YYYY-MM-DD" keys -> [start, end) datetimes, consecutive days merged."""
+    ranges = []
+    for day in days:
+        start = datetime.strptime(day, "%Y-%m-%d")
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = start + timedelta(days=1)
+        else:
+            ranges.append([start, start + timedelta(days=1)])
+    return [tuple(r) for r in ranges]
+
+def _mismatched(remote: dict, local: dict) -> list:
+    return sorted(key for key in remote.keys() | local.keys() if remote.get(key) != local.get(key))
+
+def rebuild_buckets(db: Session, account_id: str, start: datetime = None, end: datetime = None):
+    """
+    Recompute day buckets in [start, end) (default: all history) from the
+    stored rows in both tiers. Used for accounts synced before buckets existed
+    and to reset days that reconciliation has just re-fetched.
+    """
+    start = start or datetime.min
+    end = end or datetime.max
+    totals = {}
+
+    def add(posted_at, item_hash):
+        if item_hash:
+            entry = totals.setdefault(day_key(posted_at), [0, 0])
+            entry[0] += int(item_hash, 16)
+            entry[1] += 1
+
+    for posted_at, item_hash in db.query(Transaction.posted_at, Transaction.content_hash).filter(
+        Transaction.account_id == account_id,
+        Transaction.posted_at >= start,
+        Transaction.posted_at < end
+    ):
+        add(posted_at, item_hash)
+    for row in iter_cold_rows(db, account_id, start, end):
+        add(row["posted_at"], row.get("content_hash"))
+
+    q = db.query(DayBucket).filter(DayBucket.account_id == account_id)
+    if start != datetime.min:
+        q = q.filter(DayBucket.day >= day_key(start))
+    if end != datetime.max:
+        q = q.filter(DayBucket.day < day_key(end))
+    q.delete(synchronize_session=False)
+    db.add_all([
+        DayBucket(account_id=account_id, day=day, digest=f"{total % DIGEST_MODULUS:064x}", row_count=count)
+        for day, (total, count) in totals.items()
+    ])
+
+def _fetch_digests(client: ProviderClient, db: Session, tokens: SyncTokens, granularity: str, start=None, end=None) -> dict:
+    access_token = tokens.access_token
+    try:
+        return client.fetch_digests(tokens.account_id, access_token, granularity, start, end)
+    except TokenExpiredError:
+        tokens.refresh(client, db, access_token)
+        return client.fetch_digests(tokens.account_id, tokens.access_token, granularity, start, end)
+
+def _delete_missing_hot(db: Session, account_id: str, start: datetime, end: datetime, keep_ids: set) -> int:
+    gone = [
+        txn for txn in db.query(Transaction).filter(
+            Transaction.account_id == account_id,
+            Transaction.posted_at >= start,
+            Transaction.posted_at < end
+        )
+        if txn.provider_txn_id not in keep_ids
+    ]
+    if gone:
+        record_changes(db, [(txn, "delete") for txn in gone])
+        db.query(Transaction).filter(Transaction.id.in_([txn.id for txn in gone])).delete(synchronize_session=False)
+    return len(gone)
+
+def _refetch_range(client, db, tokens, account_id, start, end, stats, timer, rl):
+    """Re-download [start, end), drop rows the provider no longer has, and reset the range's buckets."""
+    seen = set()
+    cursor = None
+    while True:
+        page_data = fetch_page(client, db, tokens, cursor, stats, timer, rl=rl, start_date=start, end_date=end)
+        if not page_data:
+            break
+        items = page_data.get("items", [])
+        stats["items_fetched"] += len(items)
+        seen.update(item["id"] for item in items)
+        with timer.phase("db_upsert"):
+            apply_page(db, account_id, items, stats)
+        sync_flight.check_lease(db, account_id)
+        with timer.phase("db_commit"):
+            db.commit()
+        db.expunge_all()
+        cursor = page_data.get("next_cursor")
+        if not cursor:
+            break
+
+    with timer.phase("db_upsert"):
+        stats["deleted"] += _delete_missing_hot(db, account_id, start, end, seen)
+        stats["deleted"] += delete_cold_items(db, account_id, start, end, seen)
+        # Recompute rather than trust the deltas: heals buckets that drifted for
+        # any reason, e.g. rows stored before content hashing
+        rebuild_buckets(db, account_id, start, end)
+    sync_flight.check_lease(db, account_id)
+    with timer.phase("db_commit"):
+        db.commit()
+    db.expunge_all()
+
+def reconcile_account(account_id: str, rl: bool = False) -> dict:
+    """
+    Check stored transactions against the provider without re-downloading
+    them: compare month digests, then day digests inside mismatched months,
+    then re-fetch only the mismatched days. A clean account costs one digest
+    request; a drifted one costs one more per bad month plus the bad days.
+
+    Runs through the sync single-flight, like a backfill: rebuilding buckets
+    and re-fetching days must not interleave with a sync of the same account,
+    whose bucket deltas and inserts would race with them.
+    """
+    return sync_flight.run(account_id, lambda: _reconcile_account(account_id, rl), share=False)
+
+def _reconcile_account(account_id: str, rl: bool) -> dict:
+    timer = PhaseTimer()
+    stats = new_stats()
+    stats.update({
+        "buckets_rebuilt": False,
+        "months_checked": 0,
+        "months_mismatched": 0,
+        "days_mismatched": 0,
+        "ranges_refetched": 0,
+        "deleted": 0,
+    })
+
+    db = SessionLocal()
+    client = ProviderClient()
+    try:
+        tokens = load_tokens(db, account_id)
+        if db.query(DayBucket.id).filter(DayBucket.account_id == account_id).first() is None:
+            # Account synced before buckets existed: build them once from what we have
+            with timer.phase("db_upsert"):
+                rebuild_buckets(db, account_id)
+                sync_flight.check_lease(db, account_id)
+                db.commit()
+            stats["buckets_rebuilt"] = True
+
+        with timer.phase("network"):
+            remote_months = _fetch_digests(client, db, tokens, "month")
+        local_months = local_digests(db, account_id, "month")
+        bad_months = _mismatched(remote_months, local_months)
+        stats["months_checked"] = len(remote_months.keys() | local_months.keys())
+        stats["months_mismatched"] = len(bad_months)
+
+        bad_days = []
+        for month in bad_months:
+            start, end = _month_bounds(month)
+            with timer.phase("network"):
+                remote_days = _fetch_digests(client, db, tokens, "day", start, end)
+            local_days = local_digests(db, account_id, "day", day_key(start), day_key(end))
+            bad_days.extend(_mismatched(remote_days, local_days))
+        stats["days_mismatched"] = len(bad_days)
+
+        for start, end in _day_ranges(bad_days):
+            _refetch_range(client, db, tokens, account_id, start, end, stats, timer, rl)
+            stats["ranges_refetched"] += 1
+
+        if bad_days:
+            logger.info(f"Reconciled {account_id}: {len(bad_days)} drifted day(s) re-fetched")
+        stats["timings"] = timer.summary()
+        return stats
+    finally:
+        db.close()
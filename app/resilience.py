@@ -0,0 +1,291 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from app.settings import settings
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the provider circuit is open"""
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"Circuit for {name} is open, retry in {retry_after:.1f}s")
+
+class CircuitBreaker:
+    """
+    Rolling-window circuit breaker.
+
+    CLOSED: calls pass through; outcomes are recorded in a window of the last
+    `window_size` calls. A call counts as failed if it errored or took longer
+    than `slow_call_seconds`. Once `min_calls` are recorded and the failure
+    rate reaches `failure_rate_threshold`, the breaker opens.
+    OPEN: calls fail fast with CircuitOpenError for `open_seconds`.
+    HALF_OPEN: up to `half_open_max_calls` probes are let through. One failed
+    probe re-opens the breaker, all probes succeeding closes it.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 5.0,
+        window_size: int = 20,
+        min_calls: int = 10,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 3,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._window = deque(maxlen=window_size)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+        self.rejected = 0
+        self.transitions = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        # Caller holds the lock
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._transition(self.HALF_OPEN)
+
+    def _transition(self, state: str):
+        # Caller holds the lock
+        self._state = state
+        self.transitions += 1
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+        if state == self.OPEN:
+            self._opened_at = self._clock()
+        if state == self.CLOSED:
+            self._window.clear()
+
+    def before_call(self):
+        """Admit or reject a call. Must be paired with record()."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.OPEN:
+                self.rejected += 1
+                retry_after = self.open_seconds - (self._clock() - self._opened_at)
+                raise CircuitOpenError(self.name, max(retry_after, 0.0))
+            if self._state == self.HALF_OPEN:
+                if self._half_open_in_flight >= self.half_open_max_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 0.0)
+                self._half_open_in_flight += 1
+
+    def record(self, success: bool, latency: float):
+        failed = not success or latency > self.slow_call_seconds
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                if failed:
+                    self._transition(self.OPEN)
+                    return
+                self._half_open_successes += 1
+                if self._half_open_successes >= self.half_open_max_calls:
+                    self._transition(self.CLOSED)
+                return
+
+            if self._state == self.OPEN:
+                # Late result from a call admitted before the breaker opened
+                return
+
+            self._window.append(failed)
+            if len(self._window) >= self.min_calls:
+                failure_rate = sum(self._window) / len(self._window)
+                if failure_rate >= self.failure_rate_threshold:
+                    self._transition(self.OPEN)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._maybe_half_open()
+            calls = len(self._window)
+            return {
+                "state": self._state,
+                "window_calls": calls,
+                "failure_rate": (sum(self._window) / calls) if calls else 0.0,
+                "rejected": self.rejected,
+                "transitions": self.transitions,
+            }
+
+class LatencyTracker:
+    """Keeps the last N successful call latencies to derive a hedge delay"""
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def p95(self):
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+class HedgeStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.primary_wins = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+
+    def record(self, hedged: bool, hedge_won: bool = False, skipped: bool = False):
+        with self._lock:
+            self.calls += 1
+            if skipped:
+                self.hedges_skipped += 1
+            if hedged:
+                self.hedged += 1
+                if hedge_won:
+                    self.hedge_wins += 1
+                else:
+                    self.primary_wins += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "primary_wins": self.primary_wins,
+                "hedge_wins": self.hedge_wins,
+                "hedges_skipped": self.hedges_skipped,
+                "hedge_win_rate": (self.hedge_wins / self.hedged) if self.hedged else 0.0,
+            }
+
+# Per-provider registries, keyed by provider base URL
+_breakers = {}
+_latencies = {}
+_hedge_stats = {}
+_registry_lock = threading.Lock()
+# Hedges only. A hedge runs only if a slot is free, so none waits in the pool's queue.
+_hedge_pool = ThreadPoolExecutor(max_workers=settings.HEDGE_MAX_IN_FLIGHT, thread_name_prefix="hedge")
+_hedge_slots = threading.BoundedSemaphore(settings.HEDGE_MAX_IN_FLIGHT)
+
+def get_breaker(name: str) -> CircuitBreaker:
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                failure_rate_threshold=settings.BREAKER_FAILURE_RATE,
+                slow_call_seconds=settings.BREAKER_SLOW_CALL_SECONDS,
+                window_size=settings.BREAKER_WINDOW_SIZE,
+                min_calls=settings.BREAKER_MIN_CALLS,
+                open_seconds=settings.BREAKER_OPEN_SECONDS,
+                half_open_max_calls=settings.BREAKER_HALF_OPEN_CALLS,
+            )
+        return _breakers[name]
+
+def get_latency_tracker(name: str) -> LatencyTracker:
+    with _registry_lock:
+        if name not in _latencies:
+            _latencies[name] = LatencyTracker(min_samples=settings.HEDGE_MIN_SAMPLES)
+        return _latencies[name]
+
+def get_hedge_stats(name: str) -> HedgeStats:
+    with _registry_lock:
+        if name not in _hedge_stats:
+            _hedge_stats[name] = HedgeStats()
+        return _hedge_stats[name]
+
+def reset_breakers():
+    with _registry_lock:
+        _breakers.clear()
+        _latencies.clear()
+        _hedge_stats.clear()
+
+def resilience_snapshot() -> dict:
+    with _registry_lock:
+        names = set(_breakers) | set(_hedge_stats)
+        breakers = dict(_breakers)
+        hedges = dict(_hedge_stats)
+    return {
+        name: {
+            "breaker": breakers[name].snapshot() if name in breakers else None,
+            "hedging": hedges[name].snapshot() if name in hedges else None,
+        }
+        for name in sorted(names)
+    }
+
+def _start_primary(fn) -> Future:
+    """
+    The first attempt gets a thread of its own. A shared pool would make it
+    queue behind other calls' attempts, and the caller's elapsed time (the
+    latency the hedge delay comes from) would include that wait.
+    """
+    future = Future()
+
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="hedge-primary", daemon=True).start()
+    return future
+
+def _start_hedge(fn):
+    """Submit the second attempt if a hedge slot is free, else None."""
+    if not _hedge_slots.acquire(blocking=False):
+        return None
+    hedge = _hedge_pool.submit(fn)
+    hedge.add_done_callback(lambda _: _hedge_slots.release())
+    return hedge
+
+def hedged_call(fn, delay, stats: HedgeStats):
+    """
+    Run fn(); if it has not returned after `delay` seconds, run it a second
+    time and return whichever finishes first. fn must be idempotent.
+    A failure from the first finisher falls back to the other attempt.
+    With HEDGE_MAX_IN_FLIGHT hedges already running, no hedge is sent and
+    the call waits for its first attempt.
+    """
+    if delay is None:
+        stats.record(hedged=False)
+        return fn()
+
+    primary = _start_primary(fn)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        stats.record(hedged=False)
+        return primary.result()
+
+    hedge = _start_hedge(fn)
+    if hedge is None:
+        stats.record(hedged=False, skipped=True)
+        return primary.result()
+    pending = {primary, hedge}
+    first_error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is None:
+                stats.record(hedged=True, hedge_won=fut is hedge)
+                return fut.result()
+            if first_error is None:
+                first_error = fut.exception()
+
+    stats.record(hedged=True, hedge_won=False)
+    raise first_error
@@ -0,0 +1,81 @@
+import logging
+from sqlalchemy import inspect
+from app.models import Base
+
+logger = logging.getLogger(__name__)
+
+# create_all only creates missing tables. Changes to tables that already exist
+# in a deployed database are listed here and applied at startup, in order;
+# every step checks the live schema first, so running it again is a no-op.
+
+# (table, column, default for existing rows or None for a nullable column)
+ADDED_COLUMNS = [
+    ("transactions", "content_hash", None),
+    ("sync_state", "journal_offset", "0"),
+    ("transaction_archives", "version", "0"),
+    ("key_rotation_jobs", "failed", "0"),
+]
+
+# (table, column) whose NOT NULL was dropped
+RELAXED_NOT_NULL = [
+    ("transaction_changes", "transaction_id"),
+]
+
+def _add_column(conn, table_name: str, column_name: str, default: str):
+    column = Base.metadata.tables[table_name].c[column_name]
+    ddl = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column.type.compile(dialect=conn.dialect)}"
+    if default is not None:
+        ddl += f" NOT NULL DEFAULT {default}"
+    conn.exec_driver_sql(ddl)
+
+def _rebuild_sqlite_table(conn, table_name: str):
+    """
+    SQLite can't change a column's constraints in place: recreate the table
+    from the model and copy the rows over (the documented 12-step procedure,
+    minus foreign keys, which these tables don't have).
+    """
+    table = Base.metadata.tables[table_name]
+    inspector = inspect(conn)
+    old_columns = {c["name"] for c in inspector.get_columns(table_name)}
+    columns = ", ".join(c.name for c in table.columns if c.name in old_columns)
+    # Index names are global in SQLite: free them for the new table
+    for index in inspector.get_indexes(table_name):
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index['name']}")
+    conn.exec_driver_sql(f"ALTER TABLE {table_name} RENAME TO {table_name}__old")
+    table.create(conn)
+    conn.exec_driver_sql(f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {table_name}__old")
+    if inspector.has_table("sqlite_sequence"):
+        # Keep the AUTOINCREMENT high-water mark: compacted-away ids must stay unused
+        conn.exec_driver_sql(f"DELETE FROM sqlite_sequence WHERE name = '{table_name}'")
+        conn.exec_driver_sql(f"UPDATE sqlite_sequence SET name = '{table_name}' WHERE name = '{table_name}__old'")
+    conn.exec_driver_sql(f"DROP TABLE {table_name}__old")
+
+def upgrade_schema(engine) -> list:
+    """Bring an existing database up to the models. Returns the steps applied."""
+    applied = []
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        tables = set(inspector.get_table_names())
+
+        for table_name, column_name, default in ADDED_COLUMNS:
+            if table_name not in tables:
+                continue
+            if column_name not in {c["name"] for c in inspector.get_columns(table_name)}:
+                _add_column(conn, table_name, column_name, default)
+                applied.append(f"add {table_name}.{column_name}")
+
+        for table_name, column_name in RELAXED_NOT_NULL:
+            if table_name not in tables:
+                continue
+            column = next(c for c in inspect(conn).get_columns(table_name) if c["name"] == column_name)
+            if column["nullable"]:
+                continue
+            if conn.dialect.name == "sqlite":
+                _rebuild_sqlite_table(conn, table_name)
+            else:
+                conn.exec_driver_sql(f"ALTER TABLE {table_name} ALTER COLUMN {column_name} DROP NOT NULL")
+            applied.append(f"drop not null {table_name}.{column_name}")
+
+    for step in applied:
+        logger.info(f"Schema upgrade: {step}")
+    return applied
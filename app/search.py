@@ -0,0 +1,191 @@
+import base64
+import json
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from app.models import Transaction
+from app.change_feed import transaction_to_dict
+from app.archive import hot_cutoff
+
+# Full-text index over transactions.description.
+# On SQLite this is a contentless FTS5 table: it stores only the index, keyed
+# by transactions.id, and is kept current by triggers, so every write path
+# (run_sync, backfill, archival deletes) updates it incrementally in the same
+# transaction. Each row also indexes one account token ('a' + hex of the
+# account id, a single token whatever the id contains), and every query ANDs
+# it in: the index only ever returns, and bm25 only ever scores, the
+# account's own matches. Its column weight is 0, so it doesn't affect ranking.
+# Other backends fall back to an unranked LIKE scan.
+#
+# Archived rows (app.archive) live in compressed month segments, not in
+# `transactions`, so they aren't searchable. Every response says so
+# ("includes_archived": false) and gives the archive cutoff: rows posted
+# before it may have been archived and are then missing from the results.
+
+FTS_TABLE = "transactions_fts"
+_ACCOUNT_KEY = "'a' || hex({}.account_id)"
+
+_INSTALL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        account_key, description, content='', prefix='2 3'
+    )""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', 'bm25(0.0, 1.0)')",
+    f"""CREATE TRIGGER IF NOT EXISTS transactions_fts_ai AFTER INSERT ON transactions BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, account_key, description) VALUES (new.id, {_ACCOUNT_KEY.format("new")}, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS transactions_fts_ad AFTER DELETE ON transactions BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, account_key, description) VALUES ('delete', old.id, {_ACCOUNT_KEY.format("old")}, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS transactions_fts_au AFTER UPDATE OF account_id, description ON transactions BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, account_key, description) VALUES ('delete', old.id, {_ACCOUNT_KEY.format("old")}, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, account_key, description) VALUES (new.id, {_ACCOUNT_KEY.format("new")}, new.description);
+    END""",
+]
+
+# The first version: external content, description only, no account token
+_DROP_OLD = [
+    "DROP TRIGGER IF EXISTS transactions_fts_ai",
+    "DROP TRIGGER IF EXISTS transactions_fts_ad",
+    "DROP TRIGGER IF EXISTS transactions_fts_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+def _is_sqlite(bind) -> bool:
+    return bind.dialect.name == "sqlite"
+
+def _install(conn):
+    for statement in _INSTALL:
+        conn.exec_driver_sql(statement)
+
+def ensure_search_index(engine):
+    """
+    Create the index for databases that predate it (or have the first,
+    unscoped version), and fill it once from the stored rows.
+    """
+    if not _is_sqlite(engine):
+        return
+    with engine.begin() as conn:
+        exists = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+        ).first()
+        if exists:
+            columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({FTS_TABLE})")}
+            if "account_key" in columns:
+                return
+            for statement in _DROP_OLD:
+                conn.exec_driver_sql(statement)
+        _install(conn)
+        conn.exec_driver_sql(
+            f"INSERT INTO {FTS_TABLE}(rowid, account_key, description) "
+            f"SELECT id, {_ACCOUNT_KEY.format('transactions')}, description FROM transactions"
+        )
+
+@event.listens_for(Transaction.__table__, "after_create")
+def _create_search_index(target, conn, **kw):
+    if _is_sqlite(conn):
+        _install(conn)
+
+@event.listens_for(Transaction.__table__, "before_drop")
+def _drop_search_index(target, conn, **kw):
+    if _is_sqlite(conn):
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+def _account_token(account_id: str) -> str:
+    # Same as _ACCOUNT_KEY: SQLite's hex() of a TEXT value is its UTF-8 bytes
+    return "a" + account_id.encode("utf-8").hex()
+
+def build_match_query(q: str, account_id: str = None):
+    """
+    User text -> FTS5 query. Every term must match in description; the last
+    one as a prefix, so "star buc" finds "Starbucks". Terms are quoted, so
+    FTS syntax in the input is searched for literally rather than
+    interpreted. With account_id, only that account's rows can match.
+    """
+    terms = q.split()
+    if not terms:
+        return None
+    parts = [f"description : {_quote(t)}" for t in terms]
+    parts[-1] += "*"
+    if account_id is not None:
+        parts.insert(0, f"account_key : {_quote(_account_token(account_id))}")
+    return " AND ".join(parts)
+
+def _encode_cursor(score: float, txn_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([score, txn_id]).encode("utf-8")).decode("ascii")
+
+def _decode_cursor(cursor: str):
+    try:
+        score, txn_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(score), int(txn_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid search cursor")
+
+def search_transactions(db: Session, account_id: str, q: str, limit: int = 50, cursor: str = None) -> dict:
+    """
+    Best matches first (bm25 over description), keyset-paginated on
+    (rank, id): pass the returned next_cursor back to get the next page.
+    Scores are relative to the current index, so rows written between pages
+    can shift the order slightly. Only the hot tier is searched.
+    """
+    if not _is_sqlite(db.get_bind()):
+        return _with_coverage(_search_like(db, account_id, q, limit, cursor))
+
+    match = build_match_query(q, account_id)
+    if match is None:
+        return _with_coverage({"results": [], "next_cursor": None})
+    after = _decode_cursor(cursor) if cursor else (float("-inf"), 0)
+
+    # rank is the table's bm25 config (account column weighted 0), lower-is-better.
+    # The account token is in the match, so only the account's rows are scored.
+    rows = db.execute(text(f"""
+        SELECT rowid, rank AS score
+        FROM {FTS_TABLE}
+        WHERE {FTS_TABLE} MATCH :match
+          AND (rank, rowid) > (:score, :id)
+        ORDER BY rank, rowid
+        LIMIT :limit
+    """), {"match": match, "score": after[0], "id": after[1], "limit": limit + 1}).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    txns = {
+        t.id: t for t in db.query(Transaction).filter(
+            Transaction.id.in_([r.rowid for r in rows]),
+            Transaction.account_id == account_id
+        )
+    } if rows else {}
+
+    return _with_coverage({
+        "results": [
+            {**transaction_to_dict(txns[r.rowid]), "score": round(-r.score, 6)}
+            for r in rows if r.rowid in txns
+        ],
+        "next_cursor": _encode_cursor(rows[-1].score, rows[-1].rowid) if has_more else None,
+    })
+
+def _with_coverage(response: dict) -> dict:
+    response["includes_archived"] = False
+    response["archive_cutoff"] = hot_cutoff().isoformat()
+    return response
+
+def _like_escape(term: str) -> str:
+    # User text is matched literally: %, _ and the escape character itself aren't wildcards
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _search_like(db: Session, account_id: str, q: str, limit: int, cursor: str) -> dict:
+    # No ranking without an FTS index: all terms must appear, newest id first
+    query = db.query(Transaction).filter(Transaction.account_id == account_id)
+    for term in q.split():
+        query = query.filter(Transaction.description.ilike(f"%{_like_escape(term)}%", escape="\\"))
+    if cursor:
+        query = query.filter(Transaction.id < _decode_cursor(cursor)[1])
+    txns = query.order_by(Transaction.id.desc()).limit(limit + 1).all()
+
+    has_more = len(txns) > limit
+    txns = txns[:limit]
+    return {
+        "results": [{**transaction_to_dict(t), "score": None} for t in txns],
+        "next_cursor": _encode_cursor(0.0, txns[-1].id) if has_more else None,
+    }
@@ -4,6 +4,10 @@ class Settings(BaseSettings):
     APP_BASE_URL: str = "http://127.0.0.1:8000"
     DATABASE_URL: str = "sqlite:///./app.db"
     TOKEN_KEY: str = "dev-token-key-change-me"
+    # Comma-separated retired keys, still accepted for decryption during a rotation
+    TOKEN_KEYS_PREVIOUS: str = ""
+    KEY_ROTATION_CHUNK_SIZE: int = 1000
+    KEY_ROTATION_WORKERS: int = 4
     
     PROVIDER_BASE_URL: str = "http://127.0.0.1:8000/provider"
     PROVIDER_CLIENT_ID: str = "demo-client"
@@ -12,4 +16,106 @@ class Settings(BaseSettings):
     RATE_LIMIT_MAX_RETRIES: int = 5
     HTTP_TIMEOUT_SECONDS: int = 10
 
+    # Async connect endpoints: pooled provider connections, DB executor size and
+    # a cap on in-flight connect requests (beyond it they get a fast 503)
+    PROVIDER_MAX_CONNECTIONS: int = 100
+    DB_EXECUTOR_WORKERS: int = 16
+    CONNECT_MAX_CONCURRENCY: int = 200
+
+    # Database pools; the read pool serves the read-only endpoints (SQLite file databases)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_READ_POOL_SIZE: int = 10
+    DB_READ_MAX_OVERFLOW: int = 20
+
+    # SQLite connection profile, applied on connect
+    SQLITE_PROFILE_ENABLED: bool = True
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    # How long a writer waits for the write lock. SQLite's busy handler polls with
+    # growing sleeps, so with several concurrent syncs a writer can keep losing the
+    # lock to newer arrivals; 5 s wasn't enough for 8 syncs in scripts/bench_db_profile.py
+    SQLITE_BUSY_TIMEOUT_MS: int = 30000
+    # Per connection (negative = KiB): up to DB_POOL_SIZE + DB_MAX_OVERFLOW +
+    # DB_READ_POOL_SIZE + DB_READ_MAX_OVERFLOW connections (50 by default) can
+    # each fill it, so 8 MiB is ~400 MiB worst case. Hot pages also sit in the
+    # OS page cache through mmap_size, shared by all connections.
+    SQLITE_CACHE_SIZE: int = -8192
+    SQLITE_MMAP_SIZE: int = 268435456
+    SQLITE_TEMP_STORE: str = "MEMORY"
+
+    # Profile every sync with cProfile. /sync/run profile=true asks for one run, but
+    # only if SYNC_PROFILE_REQUESTS_ENABLED: the endpoint has no auth, and profiling
+    # costs CPU and disk. Only the newest SYNC_PROFILE_MAX_FILES dumps are kept.
+    # Dumps cover the sync's own thread only, not work it hands to other threads.
+    SYNC_PROFILE: bool = False
+    SYNC_PROFILE_DIR: str = "./profiles"
+    SYNC_PROFILE_REQUESTS_ENABLED: bool = False
+    SYNC_PROFILE_MAX_FILES: int = 20
+
+    # First-time backfill: history is split into windows fetched in parallel
+    BACKFILL_HISTORY_DAYS: int = 730
+    BACKFILL_WINDOW_DAYS: int = 30
+    BACKFILL_CONCURRENCY: int = 4
+
+    # Change feed: compaction keeps the newest N log entries untouched
+    CHANGE_LOG_KEEP_LAST: int = 10000
+
+    # Hot/cold tiering: older transactions move to compressed monthly archive segments
+    HOT_RETENTION_DAYS: int = 90
+    ARCHIVE_CHUNK_SIZE: int = 5000
+
+    # Columnar analytics cache (needs the "analytics" extra: NumPy)
+    COLUMNAR_CACHE_ENABLED: bool = False
+    COLUMNAR_CACHE_DIR: str = "./columnar_cache"
+
+    # Page journal: fetchers append raw pages to disk, an applier batches them into the DB
+    SYNC_JOURNAL_ENABLED: bool = False
+    JOURNAL_DIR: str = "./journal"
+    JOURNAL_SEGMENT_BYTES: int = 64 * 1024 * 1024
+    JOURNAL_FSYNC: bool = True
+    JOURNAL_APPLY_BATCH_PAGES: int = 20
+    # Delete fully applied segments after each journaled sync, keeping this many applied bytes
+    # (the segment being appended to is never deleted, so disk use stays under about
+    # JOURNAL_SEGMENT_BYTES + JOURNAL_RETAIN_APPLIED_BYTES per account). Off by default:
+    # once the first segment is gone the journal can no longer be replayed into a fresh
+    # database, only into one whose checkpoint is still within the retained bytes
+    JOURNAL_PRUNE_APPLIED: bool = False
+    JOURNAL_RETAIN_APPLIED_BYTES: int = 64 * 1024 * 1024
+
+    # Concurrent syncs of one account share a run; the lease extends that across workers.
+    # A caller waits for the running sync at most SYNC_LEASE_WAIT_SECONDS (it holds a
+    # request thread meanwhile), then gets a 409 with Retry-After; keep it near a typical sync
+    SYNC_LEASE_ENABLED: bool = True
+    SYNC_LEASE_TTL_SECONDS: float = 60.0
+    SYNC_LEASE_WAIT_SECONDS: float = 30.0
+    SYNC_LEASE_POLL_SECONDS: float = 0.5
+
+    # Provider webhooks: notifications are coalesced per account into one sync
+    WEBHOOK_SECRET: str = "demo-webhook-secret"
+    WEBHOOK_DEBOUNCE_ENABLED: bool = True
+    WEBHOOK_QUIET_SECONDS: float = 5.0
+    WEBHOOK_MAX_WAIT_SECONDS: float = 60.0
+    WEBHOOK_SYNC_BATCH_SIZE: int = 10
+    WEBHOOK_TICK_SECONDS: float = 1.0
+    # A failed webhook-triggered sync is retried after this, doubling per failure up to the max
+    WEBHOOK_RETRY_BASE_SECONDS: float = 5.0
+    WEBHOOK_RETRY_MAX_SECONDS: float = 300.0
+    # Delivered event_ids are remembered this long so provider retries are dropped
+    WEBHOOK_EVENT_RETENTION_HOURS: float = 72.0
+
+    # Per-provider circuit breaker
+    BREAKER_FAILURE_RATE: float = 0.5
+    BREAKER_SLOW_CALL_SECONDS: float = 5.0
+    BREAKER_WINDOW_SIZE: int = 20
+    BREAKER_MIN_CALLS: int = 10
+    BREAKER_OPEN_SECONDS: float = 30.0
+    BREAKER_HALF_OPEN_CALLS: int = 3
+
+    # Hedged page fetches: a second GET fires once the first passes the observed p95
+    HEDGE_ENABLED: bool = False
+    HEDGE_MIN_SAMPLES: int = 20
+    # Hedges running at once, process-wide; past this a slow call just waits for its first attempt
+    HEDGE_MAX_IN_FLIGHT: int = 16
+
 settings = Settings()
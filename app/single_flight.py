@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from datetime import timedelta
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from app.db import SessionLocal, utcnow
+from app.models import SyncLease
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+class SyncInProgressError(Exception):
+    """A sync of the account is running and didn't finish within SYNC_LEASE_WAIT_SECONDS."""
+    def __init__(self, account_id: str, retry_after: float):
+        super().__init__(f"Sync already running for {account_id}")
+        self.retry_after = retry_after
+
+class LeaseLostError(Exception):
+    """The running sync's lease was taken over (it went unrenewed past its TTL); its writes must stop."""
+    pass
+
+class SharedSyncError(Exception):
+    """The run this call attached to, in another worker, failed."""
+    pass
+
+def _now():
+    # Naive UTC, as stored
+    return utcnow().replace(tzinfo=None)
+
+def _try_acquire(account_id: str, owner: str, ttl: float, expired_only: bool = False):
+    """
+    Take the account's lease if it is free or expired (only if expired, for
+    a caller already waiting on a run). Returns the lease row (expunged) and
+    whether we got it.
+    """
+    db = SessionLocal()
+    try:
+        now = _now()
+        values = {"owner": owner, "generation": SyncLease.generation + 1, "expires_at": now + timedelta(seconds=ttl)}
+        expired = SyncLease.owner.isnot(None) & (SyncLease.expires_at < now)
+        # One conditional UPDATE, so two workers can't both see the lease as free
+        acquired = db.query(SyncLease).filter(
+            SyncLease.account_id == account_id,
+            expired if expired_only else or_(SyncLease.owner.is_(None), expired)
+        ).update(values, synchronize_session=False) == 1
+        db.commit()
+        if not acquired and db.query(SyncLease.id).filter(SyncLease.account_id == account_id).first() is None:
+            db.add(SyncLease(account_id=account_id, owner=owner, generation=1, expires_at=values["expires_at"]))
+            try:
+                db.commit()
+                acquired = True
+            except IntegrityError:
+                # Another worker created it first
+                db.rollback()
+        lease = db.query(SyncLease).filter(SyncLease.account_id == account_id).first()
+        db.expunge(lease)
+        return lease, acquired
+    finally:
+        db.close()
+
+def _update_lease(account_id: str, owner: str, values: dict) -> bool:
+    db = SessionLocal()
+    try:
+        updated = db.query(SyncLease).filter(
+            SyncLease.account_id == account_id,
+            SyncLease.owner == owner
+        ).update(values, synchronize_session=False)
+        db.commit()
+        return updated == 1
+    finally:
+        db.close()
+
+def _retry_after(lease) -> float:
+    """Seconds until the holder's lease runs out: by then it has finished, or renewed, or died and can be taken over."""
+    if lease is None or lease.expires_at is None:
+        return settings.SYNC_LEASE_POLL_SECONDS
+    return max((lease.expires_at - _now()).total_seconds(), settings.SYNC_LEASE_POLL_SECONDS)
+
+def _read_lease(account_id: str):
+    db = SessionLocal()
+    try:
+        lease = db.query(SyncLease).filter(SyncLease.account_id == account_id).first()
+        if lease is not None:
+            db.expunge(lease)
+        return lease
+    finally:
+        db.close()
+
+def _shared_result(lease: SyncLease) -> dict:
+    if lease.last_error is not None:
+        raise SharedSyncError(lease.last_error)
+    return dict(json.loads(lease.last_result or "{}"), coalesced=True)
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # (owner, generation) of the lease held for this run, if any
+        self.lease = None
+        self.lease_lost = False
+
+class SyncSingleFlight:
+    """
+    At most one sync per account at a time. A call for an account that is
+    already syncing in this process waits for that run and gets its stats
+    (marked "coalesced") or its exception. With SYNC_LEASE_ENABLED, the
+    leader also takes a lease row in the database, so a call in another
+    worker waits for the holder and reads the stats it stored on release.
+    A lease whose holder died runs out after SYNC_LEASE_TTL_SECONDS; the
+    holder renews it every third of that while it runs. A holder that
+    stalled past the TTL and had its lease taken over must not keep
+    writing: the run's code calls check_lease() inside each transaction,
+    before committing.
+
+    Waiting, for a run here or in another worker, is capped at
+    SYNC_LEASE_WAIT_SECONDS, after which SyncInProgressError is raised.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # account_id -> _Flight
+        self._flights = {}
+        self._owner_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self.runs = 0
+        self.coalesced = 0
+
+    def run(self, account_id: str, fn, share: bool = True):
+        """
+        With share=False the call still excludes every other run for the
+        account, but never takes another run's result: it waits for the
+        running one to finish and then runs fn itself (a backfill must load
+        history, not reuse a sync's stats). Calls that arrive while it runs
+        share its result as usual.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(account_id)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[account_id] = _Flight()
+                elif share:
+                    self.coalesced += 1
+            if leader:
+                break
+            if not flight.done.wait(settings.SYNC_LEASE_WAIT_SECONDS):
+                lease = _read_lease(account_id) if settings.SYNC_LEASE_ENABLED else None
+                raise SyncInProgressError(account_id, retry_after=_retry_after(lease))
+            if share:
+                if flight.error is not None:
+                    raise flight.error
+                return dict(flight.result, coalesced=True)
+
+        try:
+            flight.result = self._run_leased(account_id, flight, fn, share) if settings.SYNC_LEASE_ENABLED else fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[account_id]
+                self.runs += 1
+            flight.done.set()
+
+    def _run_leased(self, account_id: str, flight: _Flight, fn, share: bool = True):
+        owner = f"{self._owner_prefix}:{uuid.uuid4().hex[:8]}"
+        ttl = settings.SYNC_LEASE_TTL_SECONDS
+        deadline = time.monotonic() + settings.SYNC_LEASE_WAIT_SECONDS
+        lease, acquired = _try_acquire(account_id, owner, ttl)
+        if not acquired:
+            logger.info(f"Sync for {account_id} is running in {lease.owner}, waiting for it")
+        while not acquired:
+            if time.monotonic() >= deadline:
+                raise SyncInProgressError(account_id, retry_after=_retry_after(lease))
+            time.sleep(settings.SYNC_LEASE_POLL_SECONDS)
+            # Only an expired lease is taken over: a released one means the run
+            # we waited on (or a later one) finished, and its result covers this
+            # call. An exclusive call takes a released lease and runs its own.
+            lease, acquired = _try_acquire(account_id, owner, ttl, expired_only=share)
+            if not acquired and lease.owner is None and share:
+                return self._count_shared(lease)
+
+        flight.lease = (owner, lease.generation)
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(ttl / 3):
+                if not _update_lease(account_id, owner, {"expires_at": _now() + timedelta(seconds=ttl)}):
+                    logger.warning(f"Lost sync lease for {account_id}, stopping the run at its next commit")
+                    flight.lease_lost = True
+                    return
+
+        renewer = threading.Thread(target=heartbeat, name=f"sync-lease-{account_id}", daemon=True)
+        renewer.start()
+        result = error = None
+        try:
+            result = fn()
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            stop.set()
+            renewer.join()
+            _update_lease(account_id, owner, {
+                "owner": None,
+                "expires_at": None,
+                "finished_at": _now(),
+                "last_result": json.dumps(result, default=str) if error is None else None,
+                "last_error": str(error) if error is not None else None,
+            })
+
+    def check_lease(self, db, account_id: str):
+        """
+        Raise LeaseLostError if the account's running sync no longer holds
+        its lease. Call it in the transaction about to commit: once its
+        writes are flushed SQLite holds the write lock, so a takeover can't
+        land between the check and the commit. A no-op without a lease.
+        """
+        with self._lock:
+            flight = self._flights.get(account_id)
+        if flight is None or flight.lease is None:
+            return
+        owner, generation = flight.lease
+        # Pending writes first, so the transaction holds the write lock when checking
+        db.flush()
+        held = not flight.lease_lost and db.query(SyncLease.id).filter(
+            SyncLease.account_id == account_id,
+            SyncLease.owner == owner,
+            SyncLease.generation == generation
+        ).first() is not None
+        if not held:
+            flight.lease_lost = True
+            raise LeaseLostError(f"Sync lease for {account_id} was taken over; abandoning this run")
+
+    def _count_shared(self, lease: SyncLease) -> dict:
+        with self._lock:
+            self.coalesced += 1
+        return _shared_result(lease)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"in_flight": sorted(self._flights), "runs": self.runs, "coalesced": self.coalesced}
+
+sync_flight = SyncSingleFlight()
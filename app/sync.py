@@ -1,5 +1,7 @@
 import time
 import logging
+import threading
+from contextlib import nullcontext
 from datetime import datetime
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
@@ -7,127 +9,503 @@ from app.db import SessionLocal, utcnow
 from app.models import Connection, Transaction, SyncState
 from app.provider_client import ProviderClient, TokenExpiredError, RateLimitedError
 from app.crypto import encrypt_str, decrypt_str
+from app.page_validators import DbPageValidatorStore, DeferredPageValidatorStore
+from app.journal import PageJournal
+from app.change_feed import record_changes
+from app.hashing import content_hash
+from app.archive import hot_cutoff, upsert_cold_items
+from app.buckets import BucketDeltas
+from app.columnar import available as columnar_available, change_seq, changes_between, patch_cache
+from app.profiling import PhaseTimer, maybe_profile
+from app.single_flight import sync_flight
 from app.settings import settings
 
 logger = logging.getLogger(__name__)
 
-def run_sync(account_id: str, rl: bool = False) -> dict:
-    stats = {
+def run_sync(account_id: str, rl: bool = False, profile: bool = False) -> dict:
+    """
+    Sync one account. stats["timings"] breaks wall time down by phase.
+    With profile=True (or SYNC_PROFILE set) a cProfile dump of the run is
+    written to SYNC_PROFILE_DIR (which keeps the newest SYNC_PROFILE_MAX_FILES)
+    and its path returned in stats["profile_path"]; it covers the calling
+    thread only (see maybe_profile), so a journaled sync's fetcher thread
+    and hedged fetch attempts appear only as waits.
+    A call for an account that is already syncing (here or, with
+    SYNC_LEASE_ENABLED, in another worker) doesn't start a second run: it
+    waits and gets that run's stats with stats["coalesced"] set, whatever
+    its own rl / profile arguments.
+    """
+    return sync_flight.run(account_id, lambda: _run_sync_once(account_id, rl, profile))
+
+def _run_sync_once(account_id: str, rl: bool, profile: bool) -> dict:
+    sync_fn = _run_sync_journaled if settings.SYNC_JOURNAL_ENABLED else _run_sync
+    with maybe_profile(
+        profile or settings.SYNC_PROFILE, settings.SYNC_PROFILE_DIR, f"sync-{account_id}", keep=settings.SYNC_PROFILE_MAX_FILES
+    ) as prof:
+        stats = sync_fn(account_id, rl=rl)
+    if prof["path"]:
+        stats["profile_path"] = prof["path"]
+    return stats
+
+def apply_page(db: Session, account_id: str, items: list, stats: dict):
+    """
+    Idempotent upsert of one page of provider items.
+    Existing rows are looked up with one query per page instead of one per item.
+    Items older than the hot cutoff that aren't already in the hot table are
+    written to their cold archive segment instead. Day bucket digests are
+    adjusted for every real change, in the same transaction.
+    """
+    ids = [item["id"] for item in items]
+    existing_by_id = {
+        txn.provider_txn_id: txn
+        for txn in db.query(Transaction).filter(
+            Transaction.account_id == account_id,
+            Transaction.provider_txn_id.in_(ids)
+        )
+    } if ids else {}
+    changes = []
+    deltas = BucketDeltas()
+
+    cutoff = hot_cutoff()
+    cold_items = [
+        item for item in items
+        if item["id"] not in existing_by_id and datetime.fromisoformat(item["posted_at"]) < cutoff
+    ]
+    if cold_items:
+        upsert_cold_items(db, account_id, cold_items, stats, deltas)
+        cold_ids = {item["id"] for item in cold_items}
+        items = [item for item in items if item["id"] not in cold_ids]
+
+    for item in items:
+        provider_txn_id = item["id"]
+        existing = existing_by_id.get(provider_txn_id)
+        item_hash = content_hash(item)
+        
+        if existing:
+            if existing.content_hash == item_hash:
+                # Same content as stored: no write, no change log entry
+                stats["unchanged"] += 1
+                continue
+            deltas.add(existing.posted_at, existing.content_hash, -1)
+            # Update fields
+            existing.amount = item["amount"]
+            existing.currency = item["currency"]
+            existing.description = item["description"]
+            existing.posted_at = datetime.fromisoformat(item["posted_at"])
+            existing.raw_json = str(item)
+            existing.content_hash = item_hash
+            deltas.add(existing.posted_at, item_hash)
+            changes.append((existing, "update"))
+            stats["updated"] += 1
+        else:
+            new_txn = Transaction(
+                account_id=account_id,
+                provider_txn_id=provider_txn_id,
+                amount=item["amount"],
+                currency=item["currency"],
+                description=item["description"],
+                posted_at=datetime.fromisoformat(item["posted_at"]),
+                raw_json=str(item),
+                content_hash=item_hash
+            )
+            db.add(new_txn)
+            # Repeats of the same id later in the page become updates
+            existing_by_id[provider_txn_id] = new_txn
+            deltas.add(new_txn.posted_at, item_hash)
+            changes.append((new_txn, "insert"))
+            stats["inserted"] += 1
+
+    if changes:
+        # Assigns ids to new rows so the change log can reference them
+        db.flush()
+        record_changes(db, changes)
+    deltas.apply(db, account_id)
+
+class SyncTokens:
+    """
+    Decrypted tokens for one account, shared by everything fetching for it.
+    Refreshes are serialized so concurrent fetchers that all see a 401 only
+    refresh once. `write_lock`, if given, is held while the new tokens are
+    persisted, for callers that serialize their DB writes.
+    """
+    def __init__(self, account_id: str, access_token: str, refresh_token: str, write_lock=None):
+        self.account_id = account_id
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.write_lock = write_lock or nullcontext()
+        self._lock = threading.Lock()
+
+    def refresh(self, client: ProviderClient, db: Session, stale_access_token: str):
+        with self._lock:
+            if self.access_token != stale_access_token:
+                # Another fetcher already refreshed
+                return
+            new_tokens = client.refresh_access_token(self.refresh_token)
+            self.access_token = new_tokens["access_token"]
+            token_values = {"access_token_enc": encrypt_str(self.access_token)}
+            # Optionally update refresh token if provided
+            if "refresh_token" in new_tokens:
+                self.refresh_token = new_tokens["refresh_token"]
+                token_values["refresh_token_enc"] = encrypt_str(self.refresh_token)
+            with self.write_lock:
+                db.query(Connection).filter(Connection.account_id == self.account_id).update(token_values)
+                db.commit()
+
+def load_tokens(db: Session, account_id: str, write_lock=None) -> SyncTokens:
+    connection = db.query(Connection).filter(Connection.account_id == account_id).first()
+    if not connection:
+        raise ValueError(f"No connection found for account {account_id}")
+    tokens = SyncTokens(
+        account_id,
+        decrypt_str(connection.access_token_enc),
+        decrypt_str(connection.refresh_token_enc),
+        write_lock=write_lock
+    )
+    db.expunge(connection)
+    return tokens
+
+def fetch_page(
+    client: ProviderClient,
+    db: Session,
+    tokens: SyncTokens,
+    cursor: str,
+    stats: dict,
+    timer: PhaseTimer,
+    rl: bool = False,
+    **window
+):
+    """
+    Fetch one page, refreshing the access token on 401 and backing off
+    exponentially on 429. `window` is passed through to the provider
+    (start_date / end_date for windowed backfills).
+    """
+    page_data = None
+    retries = 0
+    
+    while retries <= settings.RATE_LIMIT_MAX_RETRIES:
+        access_token = tokens.access_token
+        try:
+            with timer.phase("network"):
+                page_data = client.fetch_transactions_page(tokens.account_id, access_token, cursor, rl=rl, **window)
+            stats["pages_fetched"] += 1
+            break # Success, exit retry loop
+            
+        except TokenExpiredError:
+            # Refresh logic
+            logger.info("Token expired, refreshing...")
+            try:
+                with timer.phase("token_refresh"):
+                    tokens.refresh(client, db, access_token)
+                # Retry the request immediately without counting index against rate limit
+                continue 
+            except Exception as e:
+                logger.error(f"Failed to refresh token: {e}")
+                raise
+        
+        except RateLimitedError as e:
+            retries += 1
+            if retries > settings.RATE_LIMIT_MAX_RETRIES:
+                raise Exception("Max rate limit retries exceeded")
+            
+            stats["rate_limit_retries"] += 1
+            # Exponential backoff: retry_after * (2 ^ (retry-1))
+            sleep_time = e.retry_after * (2 ** (retries - 1))
+            logger.warning(f"Rate limited. Sleeping {sleep_time}s")
+            with timer.phase("backoff_sleep"):
+                time.sleep(sleep_time)
+
+    return page_data
+
+def new_stats() -> dict:
+    return {
         "pages_fetched": 0,
+        "pages_not_modified": 0,
         "items_fetched": 0,
         "inserted": 0,
         "updated": 0,
+        "unchanged": 0,
+        "routed_cold": 0,
         "rate_limit_retries": 0
     }
+
+def load_sync_state(db: Session, account_id: str):
+    """(cursor, journal_offset) for the account, creating its SyncState on first sync."""
+    sync_state = db.query(SyncState).filter(SyncState.account_id == account_id).first()
+    if not sync_state:
+        sync_state = SyncState(account_id=account_id, journal_offset=0)
+        db.add(sync_state)
+        db.commit()
+        db.refresh(sync_state)
+    result = (sync_state.cursor, sync_state.journal_offset or 0)
+    db.expunge_all()
+    return result
+
+def _run_sync(account_id: str, rl: bool = False) -> dict:
+    timer = PhaseTimer()
+    stats = new_stats()
     
+    # One session for the whole sync, but nothing is kept in it between pages:
+    # the identity map is cleared after every page commit and Connection /
+    # SyncState are updated with UPDATE statements, so memory stays flat no
+    # matter how many pages the account has.
     db = SessionLocal()
-    client = ProviderClient()
+    client = ProviderClient(validator_store=DbPageValidatorStore(db))
     
     try:
-        connection = db.query(Connection).filter(Connection.account_id == account_id).first()
-        if not connection:
-            raise ValueError(f"No connection found for account {account_id}")
-            
-        sync_state = db.query(SyncState).filter(SyncState.account_id == account_id).first()
-        if not sync_state:
-            sync_state = SyncState(account_id=account_id)
-            db.add(sync_state)
-            db.commit()
-            db.refresh(sync_state)
+        tokens = load_tokens(db, account_id)
             
-        cursor = sync_state.cursor
-        access_token = decrypt_str(connection.access_token_enc)
-        refresh_token = decrypt_str(connection.refresh_token_enc)
+        cursor, _ = load_sync_state(db, account_id)
         
         while True:
-            # Attempt to fetch page with retries for Rate Limit
-            page_data = None
-            retries = 0
-            
-            while retries <= settings.RATE_LIMIT_MAX_RETRIES:
-                try:
-                    page_data = client.fetch_transactions_page(account_id, access_token, cursor, rl=rl)
-                    stats["pages_fetched"] += 1
-                    break # Success, exit retry loop
-                    
-                except TokenExpiredError:
-                    # Refresh logic
-                    logger.info("Token expired, refreshing...")
-                    try:
-                        new_tokens = client.refresh_access_token(refresh_token)
-                        access_token = new_tokens["access_token"]
-                        connection.access_token_enc = encrypt_str(access_token)
-                        # Optionally update refresh token if provided
-                        if "refresh_token" in new_tokens:
-                            refresh_token = new_tokens["refresh_token"]
-                            connection.refresh_token_enc = encrypt_str(refresh_token)
-                        db.commit()
-                        # Retry the request immediately without counting index against rate limit
-                        continue 
-                    except Exception as e:
-                        logger.error(f"Failed to refresh token: {e}")
-                        raise
-                
-                except RateLimitedError as e:
-                    retries += 1
-                    if retries > settings.RATE_LIMIT_MAX_RETRIES:
-                        raise Exception("Max rate limit retries exceeded")
-                    
-                    stats["rate_limit_retries"] += 1
-                    # Exponential backoff: retry_after * (2 ^ (retry-1))
-                    sleep_time = e.retry_after * (2 ** (retries - 1))
-                    logger.warning(f"Rate limited. Sleeping {sleep_time}s")
-                    time.sleep(sleep_time)
-
+            page_data = fetch_page(client, db, tokens, cursor, stats, timer, rl=rl)
             if not page_data:
                 break
+
+            if page_data.get("not_modified"):
+                # 304: page unchanged since the last sync, nothing to parse or write
+                stats["pages_not_modified"] += 1
                 
             items = page_data.get("items", [])
             stats["items_fetched"] += len(items)
-            
-            for item in items:
-                # Idempotent Upsert
-                # check existing
-                provider_txn_id = item["id"]
-                existing = db.query(Transaction).filter(
-                    Transaction.account_id == account_id,
-                    Transaction.provider_txn_id == provider_txn_id
-                ).first()
-                
-                if existing:
-                    # Update fields
-                    existing.amount = item["amount"]
-                    existing.description = item["description"]
-                    # ... other fields
-                    existing.raw_json = str(item)
-                    stats["updated"] += 1
-                else:
-                    new_txn = Transaction(
-                        account_id=account_id,
-                        provider_txn_id=provider_txn_id,
-                        amount=item["amount"],
-                        currency=item["currency"],
-                        description=item["description"],
-                        posted_at=datetime.fromisoformat(item["posted_at"]),
-                        raw_json=str(item)
-                    )
-                    db.add(new_txn)
-                    stats["inserted"] += 1
-            
-            db.commit()
-            
             next_cursor = page_data.get("next_cursor")
             
-            # Update checkpoint
-            sync_state.cursor = next_cursor
-            sync_state.last_synced_at = utcnow()
-            db.commit()
+            seq_before = change_seq(db, account_id) if columnar_available() and items else None
+            changes_before = _changes_logged(stats)
+            with timer.phase("db_upsert"):
+                apply_page(db, account_id, items, stats)
+            
+            # Update checkpoint in the same transaction as the page
+            db.query(SyncState).filter(SyncState.account_id == account_id).update({
+                "cursor": next_cursor,
+                "last_synced_at": utcnow()
+            })
+            seq_after, logged = _seq_in_transaction(db, account_id, seq_before) if seq_before is not None else (None, None)
+            sync_flight.check_lease(db, account_id)
+            with timer.phase("db_commit"):
+                db.commit()
+            db.expunge_all()
+            if seq_before is not None:
+                with timer.phase("columnar_patch"):
+                    patch_cache(account_id, items, seq_before, seq_after, _changes_logged(stats) - changes_before, logged)
+            # Don't hold on to the page while waiting for the next one
+            page_data = items = None
             
             cursor = next_cursor
             if not cursor:
                 break
                 
+        stats["timings"] = timer.summary()
         return stats
         
     finally:
         db.close()
+
+def _changes_logged(stats: dict) -> int:
+    # Every insert or update, hot or cold, writes one change log entry
+    return stats["inserted"] + stats["updated"]
+
+def _seq_in_transaction(db: Session, account_id: str, seq_before: int):
+    """
+    The account's change log position as of this transaction's writes, and
+    how many of its entries lie after seq_before. Read before the commit: by
+    then the transaction holds the write lock, so no other writer's changes
+    can sneak in between this and the commit.
+    """
+    db.flush()
+    seq_after = change_seq(db, account_id)
+    return seq_after, changes_between(db, account_id, seq_before, seq_after)
+
+def _apply_journal_batch(db: Session, account_id: str, batch: list, stats: dict, timer: PhaseTimer) -> int:
+    """Apply journaled pages in one transaction, advancing SyncState past them."""
+    seq_before = change_seq(db, account_id) if columnar_available() else None
+    changes_before = _changes_logged(stats)
+    validators = DbPageValidatorStore(db)
+    with timer.phase("db_upsert"):
+        for record, _ in batch:
+            if record["not_modified"]:
+                stats["pages_not_modified"] += 1
+            stats["items_fetched"] += len(record["items"])
+            apply_page(db, account_id, record["items"], stats)
+            validator = record.get("validator")
+            if validator:
+                validators.put(account_id, validator["cursor"], validator["etag"], validator["last_modified"], validator["next_cursor"])
+                db.flush()
+
+    last_record, end_offset = batch[-1]
+    db.query(SyncState).filter(SyncState.account_id == account_id).update({
+        "cursor": last_record["next_cursor"],
+        "journal_offset": end_offset,
+        "last_synced_at": utcnow()
+    })
+    seq_after, logged = _seq_in_transaction(db, account_id, seq_before) if seq_before is not None else (None, None)
+    sync_flight.check_lease(db, account_id)
+    with timer.phase("db_commit"):
+        db.commit()
+    db.expunge_all()
+    if seq_before is not None:
+        with timer.phase("columnar_patch"):
+            items = [item for record, _ in batch for item in record["items"]]
+            patch_cache(account_id, items, seq_before, seq_after, _changes_logged(stats) - changes_before, logged)
+    stats["apply_batches"] += 1
+    return end_offset
+
+def apply_journal(db: Session, journal: PageJournal, account_id: str, offset: int, stats: dict, timer: PhaseTimer, db_lock=None) -> int:
+    """Apply every journaled page after offset, JOURNAL_APPLY_BATCH_PAGES per transaction. Returns the new offset."""
+    db_lock = db_lock or nullcontext()
+    batch = []
+    for record, end_offset in journal.read_from(offset):
+        batch.append((record, end_offset))
+        if len(batch) >= settings.JOURNAL_APPLY_BATCH_PAGES:
+            with db_lock:
+                offset = _apply_journal_batch(db, account_id, batch, stats, timer)
+            batch = []
+    if batch:
+        with db_lock:
+            offset = _apply_journal_batch(db, account_id, batch, stats, timer)
+    return offset
+
+class JournalMismatchError(Exception):
+    """SyncState.journal_offset doesn't point into the account's journal on disk"""
+    pass
+
+def _checked_journal_offset(db: Session, journal: PageJournal, account_id: str, offset: int) -> int:
+    """
+    The stored offset, or the journal's end if the offset was taken against
+    a different journal (lost or replaced directory, changed JOURNAL_DIR,
+    database restored from another host). Whatever that journal held is
+    skipped rather than guessed at: the stored cursor still says where the
+    database is, and fetching resumes from it.
+    """
+    if journal.is_boundary(offset):
+        return offset
+    end = journal.end_offset()
+    logger.warning(
+        f"Journal offset {offset} for {account_id} doesn't match {journal.path}; "
+        f"resetting it to {end} and resuming from the stored cursor"
+    )
+    db.query(SyncState).filter(SyncState.account_id == account_id).update({"journal_offset": end})
+    db.commit()
+    return end
+
+def _journal_stats() -> dict:
+    stats = new_stats()
+    stats.update({"journal_pages": 0, "apply_batches": 0, "journal_segments_pruned": 0})
+    return stats
+
+def _run_sync_journaled(account_id: str, rl: bool = False) -> dict:
+    """
+    run_sync with fetching and DB writes decoupled through the page journal.
+    A fetcher thread appends raw pages to the account's journal at network
+    speed; this thread applies them in batches and only then advances
+    SyncState (cursor and journal offset, in the same commit). A DB stall
+    doesn't hold up the provider connection, and a failed apply is retried
+    from the journal on the next run instead of being re-downloaded.
+    """
+    timer = PhaseTimer()
+    stats = _journal_stats()
+    journal = PageJournal(account_id)
+    # The fetcher only touches the DB to read validators and store refreshed tokens
+    db_lock = threading.Lock()
+    db = SessionLocal()
+    try:
+        tokens = load_tokens(db, account_id, write_lock=db_lock)
+        _, offset = load_sync_state(db, account_id)
+        offset = _checked_journal_offset(db, journal, account_id, offset)
+        # Pages journaled by an earlier run but never applied go in first
+        offset = apply_journal(db, journal, account_id, offset, stats, timer, db_lock)
+        cursor, _ = load_sync_state(db, account_id)
+
+        appended = threading.Condition()
+        fetch = {"done": False, "error": None, "timings": None}
+        stop = threading.Event()
+
+        def fetch_pages(cursor):
+            fetch_timer = PhaseTimer()
+            fetch_db = SessionLocal()
+            client = ProviderClient(validator_store=DeferredPageValidatorStore(fetch_db, db_lock))
+            try:
+                while not stop.is_set():
+                    page_data = fetch_page(client, fetch_db, tokens, cursor, stats, fetch_timer, rl=rl)
+                    if not page_data:
+                        break
+                    record = {
+                        "account_id": account_id,
+                        "cursor": cursor,
+                        "next_cursor": page_data.get("next_cursor"),
+                        "not_modified": bool(page_data.get("not_modified")),
+                        "items": page_data.get("items", []),
+                        "validator": client.validator_store.take(),
+                        "fetched_at": utcnow().isoformat(),
+                    }
+                    with fetch_timer.phase("journal_append"):
+                        journal.append(record)
+                    stats["journal_pages"] += 1
+                    with appended:
+                        appended.notify()
+                    cursor = record["next_cursor"]
+                    if not cursor:
+                        break
+            except Exception as e:
+                fetch["error"] = e
+            finally:
+                fetch_db.close()
+                fetch["timings"] = fetch_timer.summary()
+                with appended:
+                    fetch["done"] = True
+                    appended.notify()
+
+        fetcher = threading.Thread(target=fetch_pages, args=(cursor,), name=f"journal-fetch-{account_id}", daemon=True)
+        fetcher.start()
+        try:
+            while True:
+                with appended:
+                    while not fetch["done"] and journal.end_offset() == offset:
+                        appended.wait()
+                    done = fetch["done"]
+                applied = apply_journal(db, journal, account_id, offset, stats, timer, db_lock)
+                if done and applied == offset and journal.end_offset() != offset:
+                    # Nothing readable past offset yet the journal goes on: never loop on it
+                    raise JournalMismatchError(f"Journal for {account_id} has unreadable records after offset {offset}")
+                offset = applied
+                if done and journal.end_offset() == offset:
+                    break
+            if settings.JOURNAL_PRUNE_APPLIED:
+                # Applied pages are in the database; keep only the configured tail on disk
+                stats["journal_segments_pruned"] = journal.prune(offset - settings.JOURNAL_RETAIN_APPLIED_BYTES)
+        finally:
+            stop.set()
+            fetcher.join()
+            journal.close()
+
+        if fetch["error"]:
+            # Whatever was journaled is applied; the rest is fetched next run
+            raise fetch["error"]
+        stats["timings"] = timer.summary()
+        stats["fetch_timings"] = fetch["timings"]
+        return stats
+    finally:
+        db.close()
+
+def replay_journal(account_id: str) -> dict:
+    """
+    Apply the account's journal to the current database without contacting
+    the provider, from wherever that database's SyncState left off (the start,
+    for a fresh database).
+    """
+    timer = PhaseTimer()
+    stats = _journal_stats()
+    journal = PageJournal(account_id)
+    db = SessionLocal()
+    try:
+        _, offset = load_sync_state(db, account_id)
+        if not journal.is_boundary(offset):
+            raise JournalMismatchError(
+                f"Journal offset {offset} for {account_id} doesn't match {journal.path}; "
+                f"replay needs the journal this database was synced with"
+            )
+        apply_journal(db, journal, account_id, offset, stats, timer)
+        stats["timings"] = timer.summary()
+        return stats
+    finally:
+        journal.close()
+        db.close()
@@ -0,0 +1,170 @@
+import hmac
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.settings import settings
+from app.sync import run_sync
+
+logger = logging.getLogger(__name__)
+
+def sign_payload(body: bytes, secret: str = None) -> str:
+    secret = secret if secret is not None else settings.WEBHOOK_SECRET
+    return hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+def verify_signature(body: bytes, signature: str, secret: str = None) -> bool:
+    if not signature:
+        return False
+    return hmac.compare_digest(sign_payload(body, secret), signature)
+
+class SyncDebouncer:
+    """
+    Coalesces bursts of provider notifications into one sync per account.
+
+    An account becomes due once no notification has arrived for `quiet_seconds`,
+    or once it has been dirty for `max_wait_seconds` (so a constant trickle of
+    notifications can't starve it). Due accounts are synced in batches of
+    `batch_size`. A notification that arrives while its account is syncing marks
+    it dirty again, so changes made mid-sync are picked up by a follow-up run.
+
+    A sync that fails puts its account back as dirty, due again after
+    `retry_base_seconds` (doubling with each consecutive failure, capped at
+    `retry_max_seconds`, and never sooner than the error's retry_after), so
+    an acknowledged notification isn't dropped. Dirty state lives only in
+    this process's memory: a restart loses it, and those accounts wait for
+    their next notification or regular sync.
+    """
+    def __init__(
+        self,
+        quiet_seconds: float = 5.0,
+        max_wait_seconds: float = 60.0,
+        batch_size: int = 10,
+        retry_base_seconds: float = 5.0,
+        retry_max_seconds: float = 300.0,
+        sync_fn=None,
+        clock=time.monotonic,
+    ):
+        self.quiet_seconds = quiet_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.batch_size = batch_size
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.sync_fn = sync_fn or run_sync
+        self._clock = clock
+        self._lock = threading.Lock()
+        # account_id -> {"first_seen", "last_seen", "notifications", "failures", "retry_at"}
+        self._dirty = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.notifications = 0
+        self.syncs_run = 0
+        self.syncs_failed = 0
+
+    def mark_dirty(self, account_id: str, now: float = None):
+        now = self._clock() if now is None else now
+        with self._lock:
+            self.notifications += 1
+            entry = self._dirty.get(account_id)
+            if entry is None:
+                self._dirty[account_id] = {"first_seen": now, "last_seen": now, "notifications": 1, "failures": 0, "retry_at": None}
+            else:
+                entry["last_seen"] = now
+                entry["notifications"] += 1
+
+    def _is_due(self, entry: dict, now: float) -> bool:
+        if entry["retry_at"] is not None:
+            # Backing off after a failed sync; new notifications don't cut it short
+            return now >= entry["retry_at"]
+        return now - entry["last_seen"] >= self.quiet_seconds or now - entry["first_seen"] >= self.max_wait_seconds
+
+    def _take_due(self, now: float) -> list:
+        """Remove and return up to batch_size due accounts with their failure counts."""
+        with self._lock:
+            due = [account_id for account_id, entry in self._dirty.items() if self._is_due(entry, now)]
+            # Oldest first
+            due.sort(key=lambda a: self._dirty[a]["first_seen"])
+            due = due[:self.batch_size]
+            return [(account_id, self._dirty.pop(account_id)["failures"]) for account_id in due]
+
+    def _requeue(self, account_id: str, failures: int, error: Exception, now: float):
+        """Mark an account whose sync failed dirty again, due after a backoff."""
+        delay = min(self.retry_base_seconds * 2 ** (failures - 1), self.retry_max_seconds)
+        delay = max(delay, getattr(error, "retry_after", 0) or 0)
+        with self._lock:
+            self.syncs_failed += 1
+            entry = self._dirty.setdefault(account_id, {"first_seen": now, "last_seen": now, "notifications": 0})
+            entry["failures"] = failures
+            entry["retry_at"] = now + delay
+
+    def flush_due(self, now: float = None) -> dict:
+        """Sync one batch of due accounts. Returns account_id -> stats (or error)."""
+        now = self._clock() if now is None else now
+        batch = self._take_due(now)
+        if not batch:
+            return {}
+
+        def sync_one(due):
+            account_id, failures = due
+            try:
+                return account_id, self.sync_fn(account_id)
+            except Exception as e:
+                self._requeue(account_id, failures + 1, e, now)
+                logger.error(f"Webhook-triggered sync failed for {account_id} ({failures + 1} in a row), will retry: {e}")
+                return account_id, {"error": str(e)}
+
+        with ThreadPoolExecutor(max_workers=len(batch)) as pool:
+            results = dict(pool.map(sync_one, batch))
+        with self._lock:
+            self.syncs_run += len(batch)
+        return results
+
+    def _loop(self, tick_seconds: float):
+        while not self._stop.wait(tick_seconds):
+            try:
+                while self.flush_due():
+                    pass
+            except Exception as e:
+                logger.error(f"Debouncer tick failed: {e}")
+
+    def start(self, tick_seconds: float = 1.0):
+        # Locked: app lifespans may start/stop concurrently (e.g. several test clients)
+        with self._thread_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, args=(tick_seconds,), name="sync-debouncer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._thread_lock:
+            self._stop.set()
+            if self._thread:
+                self._thread.join()
+                self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self._dirty.clear()
+            self.notifications = 0
+            self.syncs_run = 0
+            self.syncs_failed = 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "dirty_accounts": len(self._dirty),
+                "notifications": self.notifications,
+                "syncs_run": self.syncs_run,
+                "syncs_failed": self.syncs_failed,
+                "retrying": sum(1 for entry in self._dirty.values() if entry["retry_at"] is not None),
+            }
+
+debouncer = SyncDebouncer(
+    quiet_seconds=settings.WEBHOOK_QUIET_SECONDS,
+    max_wait_seconds=settings.WEBHOOK_MAX_WAIT_SECONDS,
+    batch_size=settings.WEBHOOK_SYNC_BATCH_SIZE,
+    retry_base_seconds=settings.WEBHOOK_RETRY_BASE_SECONDS,
+    retry_max_seconds=settings.WEBHOOK_RETRY_MAX_SECONDS,
+)
@@ -0,0 +1,14 @@
+import argparse
+from app.archive import archive_old_transactions
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old transactions into compressed monthly archive segments")
+    parser.add_argument("--max-age-days", type=int, default=None, help="Archive rows posted before this many days ago (default HOT_RETENTION_DAYS)")
+    parser.add_argument("--chunk-size", type=int, default=None, help="Rows moved per transaction (default ARCHIVE_CHUNK_SIZE)")
+    args = parser.parse_args()
+
+    result = archive_old_transactions(max_age_days=args.max_age_days, chunk_size=args.chunk_size)
+    print(f"Archived {result['archived']} transactions ({result['segments_written']} segment writes)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Concurrent syncs plus /transactions readers against a SQLite file, once with
+# the connection profile off and once with it on. Each run is a fresh process
+# (settings are read at import) and a fresh database; the provider is the
+# mock router, called in-process.
+#
+#   python scripts/bench_db_profile.py --accounts 8 --readers 8 --pages 20
+
+def percentile(sorted_values: list, pct: float):
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100.0 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def run_once(args) -> dict:
+    from fastapi.testclient import TestClient
+    from app.main import app as fastapi_app
+    from app.db import engine, Base, SessionLocal, ReadSessionLocal
+    from app.models import Connection
+    from app.crypto import encrypt_str
+    from app.provider_client import ProviderClient
+    from app.provider_mock import configure_mock_account
+    from app.search import ensure_search_index
+    from app.archive import list_transactions_tiered
+    from app.sync import run_sync
+
+    Base.metadata.create_all(bind=engine)
+    ensure_search_index(engine)
+    ProviderClient._get_client = lambda self: TestClient(fastapi_app, base_url="http://127.0.0.1:8000")
+
+    account_ids = [f"bench_{i}" for i in range(args.accounts)]
+    db = SessionLocal()
+    for account_id in account_ids:
+        configure_mock_account(account_id, pages=args.pages, page_size=args.page_size, history_days=30)
+        db.add(Connection(account_id=account_id, access_token_enc=encrypt_str("at"), refresh_token_enc=encrypt_str("rt")))
+    db.commit()
+    db.close()
+
+    sync_errors = []
+    read_errors = []
+    read_latencies = []
+    items = [0]
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def syncer(account_id):
+        try:
+            stats = run_sync(account_id)
+            with lock:
+                items[0] += stats["items_fetched"]
+        except Exception as e:
+            with lock:
+                sync_errors.append(type(e).__name__ + ": " + str(e)[:60])
+
+    def reader(n):
+        while not done.is_set():
+            start = time.perf_counter()
+            session = ReadSessionLocal()
+            try:
+                list_transactions_tiered(session, account_ids[n % len(account_ids)], 100)
+                with lock:
+                    read_latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                with lock:
+                    read_errors.append(type(e).__name__)
+            finally:
+                session.close()
+
+    readers = [threading.Thread(target=reader, args=(n,)) for n in range(args.readers)]
+    syncers = [threading.Thread(target=syncer, args=(a,)) for a in account_ids]
+    started = time.perf_counter()
+    for t in readers + syncers:
+        t.start()
+    for t in syncers:
+        t.join()
+    wall = time.perf_counter() - started
+    done.set()
+    for t in readers:
+        t.join()
+
+    read_latencies.sort()
+    return {
+        "wall_seconds": round(wall, 3),
+        "syncs_ok": len(account_ids) - len(sync_errors),
+        "sync_errors": len(sync_errors),
+        "sync_error_samples": sorted(set(sync_errors))[:3],
+        "items_per_second": round(items[0] / wall, 1),
+        "reads": len(read_latencies),
+        "read_errors": len(read_errors),
+        "reads_per_second": round(len(read_latencies) / wall, 1),
+        "read_p50_ms": round(percentile(read_latencies, 50) * 1000, 2) if read_latencies else None,
+        "read_p95_ms": round(percentile(read_latencies, 95) * 1000, 2) if read_latencies else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare SQLite throughput with and without the connection profile")
+    parser.add_argument("--accounts", type=int, default=8, help="Concurrent syncs, one per account")
+    parser.add_argument("--readers", type=int, default=8, help="Reader threads listing transactions")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--worker", choices=["on", "off"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_once(args)))
+        return
+
+    results = {}
+    for mode in ("off", "on"):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                SQLITE_PROFILE_ENABLED="true" if mode == "on" else "false",
+                HOT_RETENTION_DAYS="3650",
+            )
+            out = subprocess.run(
+                [sys.executable, __file__, "--worker", mode,
+                 "--accounts", str(args.accounts), "--readers", str(args.readers),
+                 "--pages", str(args.pages), "--page-size", str(args.page_size)],
+                env=env, capture_output=True, text=True, check=True
+            )
+            results[f"profile_{mode}"] = json.loads(out.stdout.strip().splitlines()[-1])
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
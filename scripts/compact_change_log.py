@@ -0,0 +1,18 @@
+import argparse
+from app.db import SessionLocal
+from app.change_feed import compact_changes
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact the transaction change log")
+    parser.add_argument("--keep-last", type=int, default=None, help="Newest entries to keep verbatim (default CHANGE_LOG_KEEP_LAST)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        removed = compact_changes(db, keep_last=args.keep_last)
+    finally:
+        db.close()
+    print(f"Removed {removed} superseded change log entries")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import httpx
+
+# Drives N virtual users through the full connect flow:
+#   /connect/start -> /provider/authorize -> /connect/callback -> /sync/run
+# Users arrive as a Poisson process at --rate users/sec.
+#
+# Usage:
+#   python scripts/load_connect_flow.py --start-server --users 200 --rate 20 --output load.json
+#   python scripts/load_connect_flow.py --base-url http://127.0.0.1:8000 --users 50 --rate 5
+
+ENDPOINTS = ["connect_start", "provider_authorize", "connect_callback", "sync_run"]
+
+def percentile(sorted_values: list, pct: float):
+    if not sorted_values:
+        return None
+    # Nearest-rank
+    rank = max(math.ceil(pct / 100.0 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+        self.flows_ok = 0
+        self.flows_failed = 0
+
+    async def timed(self, endpoint: str, coro, parse=None):
+        """Await one request and record it. parse, if given, extracts the value to return."""
+        start = time.perf_counter()
+        try:
+            resp = await coro
+        except httpx.HTTPError as e:
+            self.errors[endpoint][type(e).__name__] += 1
+            raise
+        elapsed = time.perf_counter() - start
+        if resp.status_code >= 400:
+            self.errors[endpoint][f"HTTP {resp.status_code}"] += 1
+            resp.raise_for_status()
+        result = resp
+        if parse is not None:
+            try:
+                result = parse(resp)
+            except (ValueError, KeyError, TypeError) as e:
+                # A 2xx with a body the flow can't use is still a failed request
+                self.errors[endpoint][type(e).__name__] += 1
+                raise
+        self.latencies[endpoint].append(elapsed)
+        return result
+
+    def report(self, wall_seconds: float) -> dict:
+        endpoints = {}
+        total_requests = 0
+        for endpoint in ENDPOINTS:
+            values = sorted(self.latencies.get(endpoint, []))
+            errors = dict(self.errors.get(endpoint, {}))
+            total_requests += len(values) + sum(errors.values())
+            endpoints[endpoint] = {
+                "ok": len(values),
+                "errors": errors,
+                "throughput_rps": round(len(values) / wall_seconds, 3) if wall_seconds else None,
+                "p50_ms": round(percentile(values, 50) * 1000, 2) if values else None,
+                "p95_ms": round(percentile(values, 95) * 1000, 2) if values else None,
+                "p99_ms": round(percentile(values, 99) * 1000, 2) if values else None,
+                "max_ms": round(values[-1] * 1000, 2) if values else None,
+            }
+        return {
+            "wall_seconds": round(wall_seconds, 3),
+            "flows_ok": self.flows_ok,
+            "flows_failed": self.flows_failed,
+            "flows_per_second": round(self.flows_ok / wall_seconds, 3) if wall_seconds else None,
+            "requests_total": total_requests,
+            "requests_per_second": round(total_requests / wall_seconds, 3) if wall_seconds else None,
+            "endpoints": endpoints,
+        }
+
+def _path_and_query(url: str) -> str:
+    parsed = urlparse(url)
+    return f"{parsed.path}?{parsed.query}"
+
+async def virtual_user(client: httpx.AsyncClient, recorder: Recorder, run_id: str, n: int, do_sync: bool):
+    account_id = f"load_{run_id}_{n}"
+    try:
+        authorize_url = await recorder.timed(
+            "connect_start",
+            client.post("/connect/start", json={"account_id": account_id}),
+            parse=lambda r: r.json()["authorize_url"],
+        )
+        redirect_to = await recorder.timed(
+            "provider_authorize",
+            client.get(_path_and_query(authorize_url)),
+            parse=lambda r: r.json()["redirect_to"],
+        )
+
+        await recorder.timed("connect_callback", client.get(_path_and_query(redirect_to)))
+
+        if do_sync:
+            await recorder.timed("sync_run", client.post("/sync/run", json={"account_id": account_id}))
+        recorder.flows_ok += 1
+    except Exception:
+        # timed() has recorded it against the failing endpoint
+        recorder.flows_failed += 1
+
+async def run_load(base_url: str, users: int, rate: float, timeout: float, max_connections: int, do_sync: bool, seed: int,
+                   transport: httpx.AsyncBaseTransport = None) -> dict:
+    recorder = Recorder()
+    rng = random.Random(seed)
+    run_id = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits, transport=transport) as client:
+        tasks = []
+        start = time.perf_counter()
+        for n in range(users):
+            tasks.append(asyncio.create_task(virtual_user(client, recorder, run_id, n, do_sync)))
+            if rate > 0 and n < users - 1:
+                # Exponential inter-arrival times -> Poisson arrivals
+                await asyncio.sleep(rng.expovariate(rate))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - start
+
+    return recorder.report(wall)
+
+def start_server(port: int, workers: int) -> subprocess.Popen:
+    """Start the app with uvicorn on a throwaway SQLite database."""
+    db_path = os.path.join(tempfile.mkdtemp(prefix="loadgen-"), "load.db")
+    base = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{db_path}",
+        APP_BASE_URL=base,
+        PROVIDER_BASE_URL=f"{base}/provider",
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("Server exited during startup")
+        try:
+            if httpx.get(f"{base}/health/provider", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("Server did not become ready within 30s")
+
+def print_report(report: dict):
+    print(f"Flows: {report['flows_ok']} ok, {report['flows_failed']} failed in {report['wall_seconds']}s "
+          f"({report['flows_per_second']} flows/s, {report['requests_per_second']} req/s)")
+    print(f"{'endpoint':<20}{'ok':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  errors")
+    for endpoint, r in report["endpoints"].items():
+        errors = ", ".join(f"{k}: {v}" for k, v in r["errors"].items()) or "-"
+        print(f"{endpoint:<20}{r['ok']:>6}{str(r['throughput_rps']):>9}{str(r['p50_ms']):>10}"
+              f"{str(r['p95_ms']):>10}{str(r['p99_ms']):>10}  {errors}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent OAuth connect-flow load generator")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=100, help="Number of virtual users")
+    parser.add_argument("--rate", type=float, default=10.0, help="Arrival rate in users/sec (0 = all at once)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--no-sync", action="store_true", help="Stop after /connect/callback")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for arrival times, for comparable runs")
+    parser.add_argument("--start-server", action="store_true", help="Start a local uvicorn with a temporary database")
+    parser.add_argument("--port", type=int, default=8765, help="Port for --start-server")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for --start-server")
+    parser.add_argument("--label", default=None, help="Tag stored in the results, e.g. a release version")
+    parser.add_argument("--output", default=None, help="Write results JSON here")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if args.start_server:
+        server = start_server(args.port, args.workers)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        report = asyncio.run(run_load(
+            base_url, args.users, args.rate, args.timeout, args.max_connections, not args.no_sync, args.seed
+        ))
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+    report["config"] = {
+        "label": args.label,
+        "base_url": base_url,
+        "users": args.users,
+        "rate": args.rate,
+        "sync": not args.no_sync,
+        "seed": args.seed,
+        "started_server": args.start_server,
+        "workers": args.workers,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import argparse
+from app.db import SessionLocal
+from app.models import Connection
+from app.reconcile import reconcile_account
+
+# Nightly integrity check: clean accounts cost one digest request each
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile stored transactions against the provider")
+    parser.add_argument("--account-id", action="append", help="Account to check (repeatable; default all connected accounts)")
+    args = parser.parse_args()
+
+    account_ids = args.account_id
+    if not account_ids:
+        db = SessionLocal()
+        try:
+            account_ids = [a for (a,) in db.query(Connection.account_id).order_by(Connection.account_id)]
+        finally:
+            db.close()
+
+    failed = 0
+    for account_id in account_ids:
+        try:
+            stats = reconcile_account(account_id)
+        except Exception as e:
+            failed += 1
+            print(f"{account_id}: failed: {e}")
+            continue
+        print(f"{account_id}: {stats['months_mismatched']}/{stats['months_checked']} months, "
+              f"{stats['days_mismatched']} days drifted, {stats['updated']} updated, "
+              f"{stats['inserted']} inserted, {stats['deleted']} deleted")
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
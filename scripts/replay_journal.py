@@ -0,0 +1,30 @@
+import argparse
+from app.db import SessionLocal
+from app.journal import PageJournal, journal_accounts
+from app.sync import replay_journal, load_sync_state
+
+# Rebuild (or catch up) a database from the page journal without the provider:
+#   DATABASE_URL=sqlite:///./fresh.db python scripts/replay_journal.py
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply journaled provider pages to the database")
+    parser.add_argument("--account-id", action="append", help="Account to replay (repeatable; default every journaled account)")
+    parser.add_argument("--prune-applied", action="store_true", help="Afterwards delete segments this database has fully applied")
+    args = parser.parse_args()
+
+    for account_id in args.account_id or journal_accounts():
+        stats = replay_journal(account_id)
+        print(f"{account_id}: {stats['apply_batches']} batches, {stats['items_fetched']} items, "
+              f"{stats['inserted']} inserted, {stats['updated']} updated")
+        if args.prune_applied:
+            db = SessionLocal()
+            try:
+                _, offset = load_sync_state(db, account_id)
+            finally:
+                db.close()
+            journal = PageJournal(account_id)
+            print(f"{account_id}: pruned {journal.prune(offset)} segment(s)")
+            journal.close()
+
+if __name__ == "__main__":
+    main()
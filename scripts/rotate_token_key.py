@@ -0,0 +1,24 @@
+import argparse
+import json
+from app.key_rotation import reencrypt_connections
+
+# Usage:
+#   1. Set TOKEN_KEY to the new key and add the old key to TOKEN_KEYS_PREVIOUS
+#      (deploy this first so the app encrypts with the new key and can still read old rows)
+#   2. python scripts/rotate_token_key.py
+#   3. Once it reports completion, remove the old key from TOKEN_KEYS_PREVIOUS.
+#      Rows listed in failed_ids (and counted in failed) couldn't be decrypted with
+#      any configured key; those accounts have to reconnect.
+# The job is resumable: re-running it continues after the last written chunk.
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-encrypt stored OAuth tokens under the newest TOKEN_KEY")
+    parser.add_argument("--chunk-size", type=int, default=None, help="Connections per chunk (default KEY_ROTATION_CHUNK_SIZE)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, 0 to run inline (default KEY_ROTATION_WORKERS)")
+    args = parser.parse_args()
+
+    result = reencrypt_connections(chunk_size=args.chunk_size, workers=args.workers)
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
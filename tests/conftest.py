@@ -1,14 +1,23 @@
 import pytest
+import httpx
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 from app.main import app as fastapi_app
-from app.db import Base, get_db
+from app.db import Base, get_db, get_read_db
 import app.db
 import app.models # Ensure models are loaded
 import app.sync # Ensure sync module loaded for patching
+import app.key_rotation
+import app.backfill
+import app.archive
+import app.reconcile
+import app.single_flight
 from app.provider_client import ProviderClient
+from app.provider_mock import configure_mock_account
+from app.models import Connection
+from app.crypto import encrypt_str
 
 # Use in-memory SQLite with StaticPool so all connections share the same memory DB
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -23,12 +32,22 @@ TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engin
 # Monkeypatch the app's SessionLocal to use our test engine/session factory
 app.db.SessionLocal = TestingSessionLocal
 app.sync.SessionLocal = TestingSessionLocal # Patch imported reference in sync.py
+app.key_rotation.SessionLocal = TestingSessionLocal
+app.backfill.SessionLocal = TestingSessionLocal
+app.archive.SessionLocal = TestingSessionLocal
+app.reconcile.SessionLocal = TestingSessionLocal
+app.single_flight.SessionLocal = TestingSessionLocal
 
 @pytest.fixture(scope="function")
 def db():
     # Reset provider rate limits just in case
-    from app.provider_mock import reset_ratelimits
+    from app.provider_mock import reset_ratelimits, reset_mock_accounts
     reset_ratelimits()
+    reset_mock_accounts()
+    from app.resilience import reset_breakers
+    reset_breakers()
+    from app.webhooks import debouncer
+    debouncer.reset()
     
     # Create tables
     Base.metadata.create_all(bind=engine)
@@ -39,6 +58,25 @@ def db():
         session.close()
         Base.metadata.drop_all(bind=engine)
 
+@pytest.fixture
+def connected_account(db):
+    """
+    Factory: store a Connection with test tokens for an account and return
+    its id. Keyword arguments set the account's mock provider profile
+    (configure_mock_account); without them the default profile is used.
+    """
+    def connect(account_id: str, **profile) -> str:
+        if profile:
+            configure_mock_account(account_id, **profile)
+        db.add(Connection(
+            account_id=account_id,
+            access_token_enc=encrypt_str("at_test"),
+            refresh_token_enc=encrypt_str("rt_test")
+        ))
+        db.commit()
+        return account_id
+    return connect
+
 @pytest.fixture
 def client(db):
     def override_get_db():
@@ -48,6 +86,7 @@ def client(db):
             pass
             
     fastapi_app.dependency_overrides[get_db] = override_get_db
+    fastapi_app.dependency_overrides[get_read_db] = override_get_db
     
     # Create a TestClient. This client will be used for making requests to the app.
     # Importantly, we also want the ProviderClient (used internally by sync)
@@ -58,6 +97,7 @@ def client(db):
     test_client = TestClient(fastapi_app, base_url="http://127.0.0.1:8000")
     
     original_get_client = ProviderClient._get_client
+    original_get_async_client = ProviderClient._get_async_client
     
     def mock_get_client(self):
         # Return a new TestClient instance to ensure thread safety/isolation if needed,
@@ -66,9 +106,17 @@ def client(db):
         return TestClient(fastapi_app, base_url="http://127.0.0.1:8000")
     
     ProviderClient._get_client = mock_get_client
+
+    # The async token exchange goes straight to the in-process app over ASGI
+    async_client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=fastapi_app),
+        base_url="http://127.0.0.1:8000"
+    )
+    ProviderClient._get_async_client = lambda self: async_client
     
     yield test_client
     
     # Teardown
     ProviderClient._get_client = original_get_client
+    ProviderClient._get_async_client = original_get_async_client
     fastapi_app.dependency_overrides.clear()
@@ -0,0 +1,138 @@
+import json
+import zlib
+import threading
+import pytest
+from sqlalchemy.orm import sessionmaker
+from app.db import Base, make_engine
+from app.models import Transaction, TransactionArchive, TransactionChange
+from app.provider_mock import configure_mock_account
+from app.archive import archive_old_transactions, hot_cutoff, _load_segment, _rewrite_segment, _iter_payload, ArchiveConflictError
+from app.settings import settings
+from app.sync import run_sync
+
+PROFILE = {"pages": 4, "page_size": 10, "history_days": 400}
+
+def _key(row):
+    return (row["provider_txn_id"], row["amount"], row["posted_at"])
+
+def test_archive_moves_old_rows_and_reads_merge_tiers(client, db, monkeypatch, connected_account):
+    account_id = "user_archive"
+    connected_account(account_id, **PROFILE)
+    # Load everything hot, as if tiering had just been switched on
+    monkeypatch.setattr(settings, "HOT_RETENTION_DAYS", 3650)
+    run_sync(account_id)
+    monkeypatch.setattr(settings, "HOT_RETENTION_DAYS", 90)
+    before = client.get("/v2/transactions", params={"account_id": account_id, "limit": 100}).json()
+    assert len(before) == 40
+
+    result = archive_old_transactions(chunk_size=7)
+    hot = db.query(Transaction).filter_by(account_id=account_id).all()
+    assert 0 < result["archived"] == 40 - len(hot)
+    assert all(t.posted_at >= hot_cutoff() for t in hot)
+    segments = db.query(TransactionArchive).filter_by(account_id=account_id).all()
+    assert sum(s.row_count for s in segments) == result["archived"]
+
+    # Same rows in the same order, whichever tier they live in
+    after = client.get("/v2/transactions", params={"account_id": account_id, "limit": 100}).json()
+    assert [_key(r) for r in after] == [_key(r) for r in before]
+    assert any(r["archived"] for r in after) and not all(r["archived"] for r in after)
+    # Archived rows keep the identity and fields they had in the hot table
+    strip = lambda r: {k: v for k, v in r.items() if k != "archived"}
+    assert [strip(r) for r in after] == [strip(r) for r in before]
+
+    # v1 keeps its original contract: hot rows, every column
+    v1 = client.get("/transactions", params={"account_id": account_id, "limit": 100}).json()
+    assert len(v1) == len(hot)
+    assert set(v1[0]) == {
+        "id", "account_id", "provider_txn_id", "amount", "currency", "description",
+        "posted_at", "raw_json", "content_hash", "created_at"
+    }
+    assert [r["id"] for r in v1] == [r["id"] for r in after if not r["archived"]]
+    top = client.get("/v2/transactions", params={"account_id": account_id, "limit": 5}).json()
+    assert [_key(r) for r in top] == [_key(r) for r in before[:5]]
+
+    # Nothing left to move
+    assert archive_old_transactions()["archived"] == 0
+
+def test_sync_routes_old_items_to_cold_tier(client, db, connected_account):
+    account_id = "user_archive_sync"
+    connected_account(account_id, **PROFILE)
+
+    stats = run_sync(account_id)
+    hot = db.query(Transaction).filter_by(account_id=account_id).count()
+    assert stats["inserted"] == 40
+    assert 0 < stats["routed_cold"] == 40 - hot
+    assert db.query(TransactionChange).filter_by(account_id=account_id).count() == 40
+
+    # Provider revises every item: old ones update their segment, new ones the hot table
+    configure_mock_account(account_id, revision=1, **PROFILE)
+    stats = run_sync(account_id)
+    assert stats["updated"] == 40
+    assert stats["inserted"] == 0
+    assert db.query(Transaction).filter_by(account_id=account_id).count() == hot
+    rows = client.get("/v2/transactions", params={"account_id": account_id, "limit": 100}).json()
+    assert len(rows) == 40
+    assert len({r["provider_txn_id"] for r in rows}) == 40
+
+def test_concurrent_segment_writers_do_not_lose_rows(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'segments.db'}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    row = lambda pid: {"provider_txn_id": pid, "posted_at": "2020-01-05T00:00:00", "content_hash": None}
+
+    def add(db, pid, segment=None):
+        segment = segment or _load_segment(db, "acct", "2020-01")
+        _rewrite_segment(db, segment, "acct", "2020-01", lambda p, r: p == pid, lambda current: ({pid: row(pid)}, True))
+
+    def stored(db):
+        return {pid for pid, _ in _iter_payload(_load_segment(db, "acct", "2020-01").payload)}
+
+    setup = Session()
+    add(setup, "a")
+    setup.commit()
+    setup.close()
+
+    # Writer A has read the segment and is mid-write
+    a = Session()
+    add(a, "x")
+
+    def writer_b():
+        b = Session()
+        add(b, "y")
+        b.commit()
+        b.close()
+
+    b_thread = threading.Thread(target=writer_b)
+    b_thread.start()
+    b_thread.join(0.3)
+    # B can't read the segment until A's write is committed
+    assert b_thread.is_alive()
+    a.commit()
+    b_thread.join(5)
+
+    check = Session()
+    assert stored(check) == {"a", "x", "y"}
+    segment = _load_segment(check, "acct", "2020-01")
+    # A write that didn't start from the current version is refused
+    check.query(TransactionArchive).update({"version": TransactionArchive.version + 1}, synchronize_session=False)
+    with pytest.raises(ArchiveConflictError):
+        add(check, "z", segment)
+    check.rollback()
+    check.close()
+    engine.dispose()
+
+def test_old_single_object_segments_are_still_read(db):
+    row = {"provider_txn_id": "old", "amount": 1.0, "currency": "USD", "description": "d", "posted_at": "2020-01-05T00:00:00"}
+    db.add(TransactionArchive(account_id="acct", month="2020-01", payload=zlib.compress(json.dumps({"old": row}).encode()), row_count=1, version=0))
+    db.commit()
+
+    assert list(_iter_payload(db.query(TransactionArchive).one().payload)) == [("old", row)]
+
+    # The next write keeps the row and moves the segment to the line format
+    segment = _load_segment(db, "acct", "2020-01")
+    _rewrite_segment(db, segment, "acct", "2020-01", lambda p, r: p == "new", lambda current: ({"new": dict(row, provider_txn_id="new")}, True))
+    db.commit()
+    segment = db.query(TransactionArchive).one()
+    assert [pid for pid, _ in _iter_payload(segment.payload)] == ["old", "new"]
+    assert zlib.decompress(segment.payload).startswith(b"[")
+    assert segment.row_count == 2
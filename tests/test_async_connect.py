@@ -0,0 +1,56 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import app.concurrency
+from app.main import app as fastapi_app, connect_limiter
+from app.db import get_db
+from app.models import Connection
+from app.provider_client import ProviderClient
+from conftest import TestingSessionLocal
+
+def test_connect_sheds_load_over_cap(client, db, monkeypatch):
+    monkeypatch.setattr(connect_limiter, "in_flight", connect_limiter.limit)
+    resp = client.post("/connect/start", json={"account_id": "busy_user"})
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "1"
+
+def test_slow_token_exchange_does_not_hold_threads(client, db, monkeypatch):
+    # Each request gets its own session, as in production
+    def fresh_db():
+        session = TestingSessionLocal()
+        try:
+            yield session
+        finally:
+            session.close()
+    fastapi_app.dependency_overrides[get_db] = fresh_db
+    # The test DB is a single shared in-memory connection, so keep DB work on one thread
+    monkeypatch.setattr(app.concurrency, "db_executor", ThreadPoolExecutor(max_workers=1))
+
+    delay = 2.0
+    async def slow_exchange(self, code):
+        await asyncio.sleep(delay)
+        return {"access_token": f"at_{code}", "refresh_token": f"rt_{code}"}
+    monkeypatch.setattr(ProviderClient, "aexchange_code_for_token", slow_exchange)
+
+    # 2.5x the default 40-thread pool: blocking exchanges would need 3 waves (>= 6s)
+    users = 100
+
+    async def flow(transport_client, n):
+        resp = await transport_client.post("/connect/start", json={"account_id": f"burst_{n}"})
+        state = resp.json()["state"]
+        resp = await transport_client.get("/connect/callback", params={"code": f"c{n}", "state": state})
+        return resp.status_code
+
+    async def burst():
+        transport = httpx.ASGITransport(app=fastapi_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://127.0.0.1:8000") as ac:
+            start = time.perf_counter()
+            statuses = await asyncio.gather(*(flow(ac, n) for n in range(users)))
+            return statuses, time.perf_counter() - start
+
+    statuses, elapsed = asyncio.run(burst())
+    assert statuses == [200] * users
+    # All exchanges wait on the provider concurrently instead of in thread-sized waves
+    assert elapsed < delay * 2
+    assert db.query(Connection).filter(Connection.account_id.like("burst_%")).count() == users
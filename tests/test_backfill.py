@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta
+import pytest
+from app.models import Transaction, TransactionArchive, BackfillWindow, SyncLease, SyncState
+from app.db import utcnow
+from app.provider_mock import configure_mock_account, generate_mock_txns
+from app.backfill import run_backfill, plan_windows
+from app.archive import archive_old_transactions, iter_cold_rows, hot_cutoff
+from app.settings import settings
+from app.single_flight import _now
+
+PROFILE = {"pages": 20, "page_size": 10, "history_days": 300}
+
+def _cold_ids(db, account_id):
+    return [row["provider_txn_id"] for row in iter_cold_rows(db, account_id, datetime.min, datetime.max)]
+
+def test_mock_date_range_filters_and_paginates():
+    configure_mock_account("range_acct", **PROFILE)
+    now = utcnow().replace(tzinfo=None)
+    start, end = now - timedelta(days=200), now - timedelta(days=50)
+
+    page, seen = 0, []
+    while True:
+        items, has_more = generate_mock_txns("range_acct", page, start, end)
+        seen.extend(items)
+        if not has_more:
+            break
+        page += 1
+    assert seen
+    assert all(start <= datetime.fromisoformat(i["posted_at"]) < end for i in seen)
+    # Everything in range, nothing skipped
+    all_items = []
+    for p in range(20):
+        all_items.extend(generate_mock_txns("range_acct", p)[0])
+    expected = [i for i in all_items if start <= datetime.fromisoformat(i["posted_at"]) < end]
+    assert [i["id"] for i in seen] == [i["id"] for i in expected]
+
+def test_backfill_loads_history_in_parallel_windows(client, db, connected_account):
+    account_id = "user_backfill"
+    connected_account(account_id, **PROFILE)
+
+    resp = client.post("/sync/backfill", json={
+        "account_id": account_id, "window_days": 30, "history_days": 365, "concurrency": 4
+    })
+    assert resp.status_code == 200
+    stats = resp.json()["stats"]
+
+    assert stats["windows_total"] == 13
+    assert stats["inserted"] == 200
+    # History older than the hot window went straight to the archive
+    hot = db.query(Transaction).filter_by(account_id=account_id).all()
+    cold = _cold_ids(db, account_id)
+    assert hot and cold
+    assert len(hot) + len(cold) == 200
+    assert all(t.posted_at >= hot_cutoff() for t in hot)
+    assert all(w.status == "done" for w in db.query(BackfillWindow).filter_by(account_id=account_id))
+
+    # The handoff only asks for what was posted after the newest window
+    assert stats["handoff"]["pages_fetched"] == 1
+    assert stats["handoff"]["items_fetched"] == 0
+    sync_state = db.query(SyncState).filter_by(account_id=account_id).one()
+    assert sync_state.cursor is None and sync_state.last_synced_at is not None
+
+def test_backfill_resumes_per_window(client, db, connected_account):
+    account_id = "user_backfill_resume"
+    connected_account(account_id, **PROFILE)
+
+    # Pretend a previous run finished the two newest windows before crashing
+    windows = plan_windows(db, account_id, history_days=365, window_days=30)
+    newest = sorted(windows, key=lambda w: w.window_start, reverse=True)[:2]
+    for w in newest:
+        w.status = "done"
+    db.commit()
+
+    stats = run_backfill(account_id, handoff=False)
+    assert stats["windows_run"] == 11
+    # Only the unfinished windows were fetched
+    newest_start = min(w.window_start for w in newest)
+    db.expire_all()
+    posted = [t.posted_at for t in db.query(Transaction).filter_by(account_id=account_id)]
+    posted += [datetime.fromisoformat(row["posted_at"]) for row in iter_cold_rows(db, account_id, datetime.min, datetime.max)]
+    assert posted
+    assert all(p < newest_start for p in posted)
+
+    # Nothing left to do
+    assert run_backfill(account_id, handoff=False)["windows_run"] == 0
+
+def test_backfill_after_archiving_does_not_duplicate_rows(client, db, monkeypatch, connected_account):
+    account_id = "user_backfill_archived"
+    connected_account(account_id, **PROFILE)
+
+    # Loaded while everything was still hot, then the archiver ran
+    monkeypatch.setattr(settings, "HOT_RETENTION_DAYS", 3650)
+    run_backfill(account_id, history_days=365, handoff=False)
+    monkeypatch.setattr(settings, "HOT_RETENTION_DAYS", 90)
+    archived = archive_old_transactions()["archived"]
+    assert archived > 0
+
+    # A second backfill (windows reset) re-fetches archived history
+    db.query(BackfillWindow).filter_by(account_id=account_id).update({"status": "pending", "cursor": None})
+    db.commit()
+    stats = run_backfill(account_id, history_days=365)
+
+    assert stats["inserted"] == 0
+    assert stats["updated"] == 0
+    assert stats["unchanged"] == 200
+    assert stats["handoff"]["inserted"] == 0
+    db.expire_all()
+    # Archived rows stay archived, once each
+    cold = _cold_ids(db, account_id)
+    assert len(cold) == len(set(cold)) == archived
+    assert db.query(Transaction).filter_by(account_id=account_id).count() == 200 - archived
+    assert sum(s.row_count for s in db.query(TransactionArchive).filter_by(account_id=account_id)) == archived
+
+def test_backfill_waits_for_a_running_sync(client, db, monkeypatch, connected_account):
+    account_id = "user_backfill_leased"
+    connected_account(account_id, **PROFILE)
+    # A sync of this account holds the lease in another worker
+    db.add(SyncLease(account_id=account_id, owner="other-worker", generation=1, expires_at=_now() + timedelta(minutes=5)))
+    db.commit()
+
+    monkeypatch.setattr(settings, "SYNC_LEASE_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(settings, "SYNC_LEASE_WAIT_SECONDS", 0.05)
+
+    resp = client.post("/sync/backfill", json={"account_id": account_id, "history_days": 365})
+    assert resp.status_code == 409
+    assert db.query(BackfillWindow).filter_by(account_id=account_id).count() == 0
+
+def test_backfill_rejects_non_positive_parameters(client, db, connected_account):
+    account_id = connected_account("user_backfill_bad")
+    for field, value in [("window_days", 0), ("window_days", -1), ("concurrency", -2), ("history_days", -5)]:
+        resp = client.post("/sync/backfill", json={"account_id": account_id, field: value})
+        assert resp.status_code == 422, (field, value)
+    assert db.query(BackfillWindow).count() == 0
+
+    with pytest.raises(ValueError):
+        plan_windows(db, account_id, 10, -1)
+    with pytest.raises(ValueError):
+        run_backfill(account_id, concurrency=0)
+
+def test_backfill_without_history_plans_nothing(client, db, connected_account):
+    account_id = connected_account("user_backfill_empty")
+    assert plan_windows(db, account_id, -5, 30) == []
+
+    stats = run_backfill(account_id, history_days=0)
+    assert stats["windows_total"] == stats["windows_run"] == 0
+    assert "handoff" not in stats
+    assert db.query(Transaction).filter_by(account_id=account_id).count() == 0
@@ -0,0 +1,65 @@
+from app.models import TransactionChange
+from app.provider_mock import configure_mock_account
+from app.change_feed import compact_changes
+
+def _drain(client, since_seq, account_id, limit):
+    seen = []
+    while True:
+        page = client.get("/transactions/changes", params={
+            "since_seq": since_seq, "account_id": account_id, "limit": limit
+        }).json()
+        seen.extend(page["changes"])
+        since_seq = page["next_since_seq"]
+        if not page["has_more"]:
+            return seen, since_seq
+
+def test_change_feed_keyset_paging(client, db, connected_account):
+    account_id = "user_feed"
+    connected_account(account_id)
+    client.post("/sync/run", json={"account_id": account_id})
+
+    changes, position = _drain(client, 0, account_id, limit=4)
+    assert len(changes) == 15
+    assert all(c["op"] == "insert" for c in changes)
+    seqs = [c["seq"] for c in changes]
+    assert seqs == sorted(seqs) and len(set(seqs)) == 15
+    assert changes[0]["transaction"]["provider_txn_id"] == changes[0]["provider_txn_id"]
+
+    # Nothing new since our position
+    assert _drain(client, position, account_id, limit=4)[0] == []
+
+    # The provider edits every item; only those deltas show up
+    configure_mock_account(account_id, revision=1)
+    client.post("/sync/run", json={"account_id": account_id})
+    changes, _ = _drain(client, position, account_id, limit=100)
+    assert len(changes) == 15
+    assert all(c["op"] == "update" and c["seq"] > position for c in changes)
+
+def test_change_feed_filters_by_account(client, db, connected_account):
+    connected_account("feed_a")
+    connected_account("feed_b")
+    client.post("/sync/run", json={"account_id": "feed_a"})
+    client.post("/sync/run", json={"account_id": "feed_b"})
+
+    changes, _ = _drain(client, 0, "feed_b", limit=100)
+    assert {c["account_id"] for c in changes} == {"feed_b"}
+    all_changes = client.get("/transactions/changes", params={"limit": 100}).json()["changes"]
+    assert len(all_changes) == 30
+
+def test_compaction_keeps_latest_change_per_transaction(client, db, connected_account):
+    account_id = "user_compact"
+    connected_account(account_id)
+    for revision in range(3):
+        configure_mock_account(account_id, revision=revision)
+        client.post("/sync/run", json={"account_id": account_id})
+    assert db.query(TransactionChange).count() == 45
+
+    removed = compact_changes(db, keep_last=0)
+    assert removed == 30
+    remaining = db.query(TransactionChange).all()
+    assert len(remaining) == 15
+    assert all(c.op == "update" for c in remaining)
+
+    # A consumer starting from zero still sees every transaction once
+    changes, _ = _drain(client, 0, account_id, limit=100)
+    assert len({c["provider_txn_id"] for c in changes}) == 15
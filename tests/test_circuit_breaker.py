@@ -0,0 +1,114 @@
+import time
+import threading
+import pytest
+import app.resilience
+from app.settings import settings
+from app.resilience import CircuitBreaker, CircuitOpenError, HedgeStats, hedged_call, get_breaker
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_breaker_opens_half_opens_and_closes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(
+        "test", failure_rate_threshold=0.5, window_size=4, min_calls=4,
+        open_seconds=10, half_open_max_calls=2, clock=clock
+    )
+
+    for ok in (True, False, True, False):
+        breaker.before_call()
+        breaker.record(ok, 0.01)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # Fails fast while open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now = 11
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()
+    breaker.before_call()
+    # Probe budget exhausted
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(True, 0.01)
+    breaker.record(True, 0.01)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_slow_calls_count_as_failures():
+    breaker = CircuitBreaker("slow", slow_call_seconds=1.0, window_size=3, min_calls=3, clock=FakeClock())
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record(True, 2.5)
+    assert breaker.state == CircuitBreaker.OPEN
+
+def test_hedged_call_takes_faster_attempt():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        # First attempt stalls, the hedge returns immediately
+        if len(calls) == 1:
+            time.sleep(0.5)
+            return "primary"
+        return "hedge"
+
+    stats = HedgeStats()
+    assert hedged_call(fn, 0.05, stats) == "hedge"
+    snap = stats.snapshot()
+    assert snap["hedged"] == 1
+    assert snap["hedge_wins"] == 1
+
+def test_hedges_never_queue_and_first_attempts_never_wait(monkeypatch):
+    monkeypatch.setattr(app.resilience, "_hedge_slots", threading.BoundedSemaphore(1))
+    stats = HedgeStats()
+    release = threading.Event()
+    stuck_calls = []
+
+    def stuck():
+        stuck_calls.append(1)
+        release.wait(5)
+        return "stuck"
+
+    # A stalled call whose hedge stalls too holds the only hedge slot
+    blocker = threading.Thread(target=hedged_call, args=(stuck, 0.01, stats))
+    blocker.start()
+    deadline = time.monotonic() + 2
+    while len(stuck_calls) < 2 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert len(stuck_calls) == 2
+
+    attempts = []
+    def slow():
+        attempts.append(time.monotonic())
+        time.sleep(0.1)
+        return "primary"
+
+    try:
+        started = time.monotonic()
+        # No slot: no hedge is queued, and the first attempt started at once
+        assert hedged_call(slow, 0.01, stats) == "primary"
+        assert len(attempts) == 1 and attempts[0] - started < 0.05
+        assert stats.snapshot()["hedges_skipped"] == 1
+    finally:
+        release.set()
+        blocker.join()
+
+def test_open_circuit_fails_sync_fast(client, db, connected_account):
+    account_id = connected_account("user_breaker")
+
+    breaker = get_breaker(settings.PROVIDER_BASE_URL)
+    for _ in range(settings.BREAKER_MIN_CALLS):
+        breaker.before_call()
+        breaker.record(False, 0.01)
+
+    resp = client.post("/sync/run", json={"account_id": account_id})
+    assert resp.status_code == 503
+    assert "Retry-After" in resp.headers
+
+    health = client.get("/health/provider").json()
+    assert health[settings.PROVIDER_BASE_URL]["breaker"]["state"] == "open"
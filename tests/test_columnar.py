@@ -0,0 +1,154 @@
+import os
+import pytest
+from collections import defaultdict
+from app.models import Transaction
+from app.provider_mock import configure_mock_account
+from app.settings import settings
+from app.sync import run_sync
+
+np = pytest.importorskip("numpy")
+from app import columnar
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "COLUMNAR_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "COLUMNAR_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+def test_aggregates_match_database_across_tiers(client, db, cache_dir, connected_account):
+    account_id = "user_columnar"
+    connected_account(account_id, pages=8, page_size=10, history_days=200)
+    run_sync(account_id)
+
+    rows = [(t.posted_at, t.amount) for t in db.query(Transaction).filter_by(account_id=account_id)]
+    rows += [
+        (r["posted_at"], r["amount"])
+        for r in client.get("/v2/transactions", params={"account_id": account_id, "limit": 1000}).json() if r["archived"]
+    ]
+    assert len(rows) == 80
+    expected = defaultdict(int)
+    for posted_at, amount in rows:
+        expected[str(posted_at)[:10]] += amount
+
+    daily = client.get("/analytics/daily", params={"account_id": account_id}).json()
+    assert dict(zip(daily["days"], daily["totals"])) == dict(expected)
+    assert sum(daily["counts"]) == 80
+
+    pct = client.get("/analytics/percentiles", params={"account_id": account_id, "q": [50, 90]}).json()
+    assert pct["count"] == 80
+    assert pct["percentiles"]["50"] == float(np.percentile([a for _, a in rows], 50))
+
+    ma = client.get("/analytics/moving-average", params={"account_id": account_id, "window_days": 7}).json()
+    assert len(ma["days"]) == len(ma["moving_average"]) == 1 + (max(map(np.datetime64, expected)) - min(map(np.datetime64, expected))).astype(int)
+    assert ma["moving_average"][0] == expected[ma["days"][0]]
+
+    assert client.get("/analytics/daily", params={"account_id": account_id, "currency": "EUR"}).json()["days"] == []
+
+def test_sync_patches_cache_and_stale_cache_is_rebuilt(client, db, cache_dir, connected_account):
+    account_id = "user_columnar_patch"
+    connected_account(account_id, pages=3, page_size=10, history_days=30)
+    run_sync(account_id)
+    client.get("/analytics/daily", params={"account_id": account_id})
+    cache = columnar.ColumnarCache(account_id)
+    built = cache.meta()
+    assert built["count"] == 30
+
+    # Provider edits: sync patches the existing rows in place
+    configure_mock_account(account_id, pages=3, page_size=10, history_days=30, revision=1)
+    run_sync(account_id)
+    patched = cache.meta()
+    assert patched["seq"] == columnar.change_seq(db, account_id) > built["seq"]
+    assert patched["count"] == 30
+
+    # A write the cache didn't see (here: straight to the table) is caught by the seq check
+    txn = db.query(Transaction).filter_by(account_id=account_id).first()
+    txn.amount += 500
+    db.add(Transaction(account_id=account_id, provider_txn_id="manual", amount=1, posted_at=txn.posted_at))
+    db.commit()
+    from app.change_feed import record_changes
+    record_changes(db, [(txn, "update")])
+    db.commit()
+    daily = client.get("/analytics/daily", params={"account_id": account_id}).json()
+    assert sum(daily["counts"]) == 31
+    assert sum(daily["totals"]) == sum(t.amount for t in db.query(Transaction).filter_by(account_id=account_id))
+
+def test_patch_lookup_spans_index_and_tail(cache_dir, db, monkeypatch):
+    monkeypatch.setattr(columnar, "TAIL_REINDEX_ROWS", 4)
+    cache = columnar.ColumnarCache("user_columnar_tail")
+    cache.rebuild(db)
+
+    def item(n, amount, currency="USD"):
+        return {"id": f"t{n}", "amount": amount, "currency": currency, "posted_at": f"2024-01-{n % 28 + 1:02d}T12:00:00"}
+
+    assert cache.apply_items([item(n, 100) for n in range(10)], 0, 1)  # reindexed
+    assert cache.apply_items([item(n, 100) for n in range(10, 13)], 1, 2)  # unindexed tail
+    assert cache.apply_items([item(2, 250), item(11, 300), item(13, 7, "EUR"), item(13, 9, "EUR")], 2, 3)
+    # A stale cache is never patched
+    assert not cache.apply_items([item(99, 1)], 0, 4)
+
+    cols = cache.columns()
+    assert len(cols["amount"]) == 14
+    assert int(cols["amount"].sum()) == 100 * 11 + 250 + 300 + 9
+    assert columnar.percentiles(cols, [100], currency="EUR")["percentiles"]["100"] == 9.0
+
+def test_analytics_unavailable_when_disabled(client, db):
+    resp = client.get("/analytics/daily", params={"account_id": "anyone"})
+    assert resp.status_code == 501
+
+def test_rebuild_does_not_disturb_open_readers(client, db, cache_dir, connected_account):
+    account_id = "user_columnar_swap"
+    connected_account(account_id, pages=3, page_size=10, history_days=30)
+    run_sync(account_id)
+    cache = columnar.ColumnarCache(account_id)
+    root = cache_dir / os.path.basename(cache.path)
+    first = cache.rebuild(db)
+    cols = cache.columns(first)
+    total = int(cols["amount"].sum())
+
+    # Two rebuilds: the generation the reader mapped is replaced, then removed
+    second = cache.rebuild(db)
+    assert second["data"] != first["data"] and second["previous"] == first["data"]
+    assert (root / first["data"]).exists()
+    third = cache.rebuild(db)
+    assert not (root / first["data"]).exists()
+    assert sorted(p.name for p in root.iterdir()) == sorted(["meta.json", second["data"], third["data"]])
+    # Still mapped, still readable
+    assert int(cols["amount"].sum()) == total
+
+    # A rebuild that waited for the lock behind one that got there first is skipped
+    assert cache.rebuild(db, only_if_stale=True)["data"] == third["data"]
+
+def test_patch_skipped_when_other_writers_changes_are_in_range(cache_dir, db):
+    cache = columnar.ColumnarCache("user_columnar_race")
+    cache.rebuild(db)
+    item = {"id": "t1", "amount": 5, "currency": "USD", "posted_at": "2024-01-01T12:00:00"}
+
+    # The page wrote one change, but the log moved by two
+    columnar.patch_cache("user_columnar_race", [item], 0, 2, 1, 2)
+    assert cache.meta()["seq"] == 0 and cache.meta()["count"] == 0
+    columnar.patch_cache("user_columnar_race", [item], 0, 1, 1, 1)
+    assert cache.meta()["seq"] == 1 and cache.meta()["count"] == 1
+
+def test_other_accounts_syncs_do_not_block_patching(client, db, cache_dir, connected_account):
+    profile = {"pages": 2, "page_size": 10, "history_days": 30}
+    connected_account("user_columnar_a", **profile)
+    connected_account("user_columnar_b", **profile)
+    run_sync("user_columnar_a")
+    run_sync("user_columnar_b")
+    client.get("/analytics/daily", params={"account_id": "user_columnar_a"})
+    cache = columnar.ColumnarCache("user_columnar_a")
+    built = cache.meta()
+
+    # The shared change log moves on for B between A's pages and syncs
+    for revision in (1, 2):
+        configure_mock_account("user_columnar_b", revision=revision, **profile)
+        run_sync("user_columnar_b")
+        configure_mock_account("user_columnar_a", revision=revision, **profile)
+        run_sync("user_columnar_a")
+
+    # Patched in place each time, never left behind for a rebuild
+    patched = cache.meta()
+    assert patched["data"] == built["data"]
+    assert patched["seq"] == columnar.change_seq(db, "user_columnar_a") > built["seq"]
+    cols = cache.columns(patched)
+    assert int(cols["amount"].sum()) == sum(t.amount for t in db.query(Transaction).filter_by(account_id="user_columnar_a"))
@@ -0,0 +1,33 @@
+from app.models import Transaction, TransactionChange
+from app.hashing import content_hash
+from app.page_validators import DbPageValidatorStore
+from app.provider_mock import configure_mock_account
+
+def test_content_hash_is_canonical():
+    a = {"id": "t1", "amount": 100, "description": "Coffee"}
+    b = {"description": "Coffee", "amount": 100, "id": "t1"}
+    assert content_hash(a) == content_hash(b)
+    assert content_hash(a) != content_hash({**a, "amount": 101})
+
+def test_unchanged_items_are_not_rewritten(client, db, connected_account):
+    account_id = connected_account("user_hash")
+    client.post("/sync/run", json={"account_id": account_id})
+    changes_before = db.query(TransactionChange).count()
+
+    # Force full page bodies so every item goes through the upsert path
+    DbPageValidatorStore(db).clear(account_id)
+    db.commit()
+    stats = client.post("/sync/run", json={"account_id": account_id}).json()["stats"]
+    assert stats["items_fetched"] == 15
+    assert stats["unchanged"] == 15
+    assert stats["updated"] == 0
+    assert db.query(TransactionChange).count() == changes_before
+
+    # Real edits are still applied
+    configure_mock_account(account_id, revision=2)
+    stats = client.post("/sync/run", json={"account_id": account_id}).json()["stats"]
+    assert stats["updated"] == 15
+    assert stats["unchanged"] == 0
+    db.expire_all()
+    txn = db.query(Transaction).filter_by(account_id=account_id).first()
+    assert txn.description.endswith("(rev 2)")
@@ -0,0 +1,106 @@
+import time
+import threading
+from datetime import datetime
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from app.db import Base, make_engine, get_read_db
+from app.main import app as fastapi_app
+from app.models import Transaction, TransactionChange
+from app.settings import settings
+
+def test_sqlite_profile_applied_on_connect(tmp_path):
+    url = f"sqlite:///{tmp_path / 'profile.db'}"
+    writer = make_engine(url)
+    reader = make_engine(url, read_only=True)
+    try:
+        with writer.begin() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == settings.SQLITE_BUSY_TIMEOUT_MS
+            conn.execute(text("CREATE TABLE t (x INTEGER)"))
+            conn.execute(text("INSERT INTO t VALUES (1)"))
+
+        with reader.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM t")).scalar() == 1
+            with pytest.raises(OperationalError):
+                conn.execute(text("INSERT INTO t VALUES (2)"))
+    finally:
+        writer.dispose()
+        reader.dispose()
+
+def test_concurrent_writers_wait_instead_of_failing(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'writers.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE t (writer INTEGER, n INTEGER)"))
+    Session = sessionmaker(bind=engine)
+    inside, overlaps, errors = [0], [], []
+    guard = threading.Lock()
+
+    def writer(w):
+        try:
+            for n in range(20):
+                session = Session()
+                session.execute(text("INSERT INTO t VALUES (:w, :n)"), {"w": w, "n": n})
+                with guard:
+                    inside[0] += 1
+                    overlaps.append(inside[0])
+                time.sleep(0.002)
+                with guard:
+                    inside[0] -= 1
+                session.commit()
+                session.close()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(w,)) for w in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    try:
+        assert errors == []
+        # busy_timeout queues the second writer: one write transaction at a time, none "database is locked"
+        assert max(overlaps) == 1
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM t")).scalar() == 40
+    finally:
+        engine.dispose()
+
+def test_read_endpoints_on_query_only_engine(client, tmp_path):
+    url = f"sqlite:///{tmp_path / 'read.db'}"
+    writer = make_engine(url)
+    reader = make_engine(url, read_only=True)
+    Base.metadata.create_all(bind=writer)
+    with sessionmaker(bind=writer)() as session:
+        txn = Transaction(account_id="acct", provider_txn_id="t1", amount=1200, currency="USD", description="Coffee beans", posted_at=datetime.now())
+        session.add(txn)
+        session.flush()
+        session.add(TransactionChange(account_id="acct", transaction_id=txn.id, provider_txn_id="t1", op="insert"))
+        session.commit()
+
+    ReadSession = sessionmaker(autocommit=False, autoflush=False, bind=reader)
+    def read_db():
+        session = ReadSession()
+        try:
+            yield session
+        finally:
+            session.close()
+    # The conftest points reads at the shared in-memory session; use the real read engine
+    fastapi_app.dependency_overrides[get_read_db] = read_db
+
+    try:
+        assert [t["provider_txn_id"] for t in client.get("/transactions", params={"account_id": "acct"}).json()] == ["t1"]
+        assert [t["provider_txn_id"] for t in client.get("/v2/transactions", params={"account_id": "acct"}).json()] == ["t1"]
+        found = client.get("/transactions/search", params={"account_id": "acct", "q": "coff"})
+        assert found.status_code == 200 and len(found.json()["results"]) == 1
+        changes = client.get("/transactions/changes", params={"account_id": "acct"})
+        assert changes.status_code == 200 and len(changes.json()["changes"]) == 1
+
+        with ReadSession() as session:
+            with pytest.raises(OperationalError):
+                session.execute(text("DELETE FROM transactions"))
+    finally:
+        writer.dispose()
+        reader.dispose()
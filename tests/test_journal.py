@@ -0,0 +1,216 @@
+import os
+import threading
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import app.sync
+from app.db import Base
+from app.models import Transaction, SyncState
+from app.journal import PageJournal, journal_accounts
+from app.provider_client import ProviderClient
+from app.settings import settings
+from app.provider_mock import configure_mock_account
+from app.sync import run_sync, replay_journal, JournalMismatchError
+
+@pytest.fixture
+def journal_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SYNC_JOURNAL_ENABLED", True)
+    monkeypatch.setattr(settings, "JOURNAL_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "JOURNAL_APPLY_BATCH_PAGES", 2)
+    return tmp_path
+
+def _state(db, account_id):
+    db.expire_all()
+    return db.query(SyncState).filter_by(account_id=account_id).one()
+
+def test_journaled_sync_applies_pages_and_checkpoints_offset(client, db, journal_dir, connected_account):
+    account_id = "user_journal"
+    connected_account(account_id)
+
+    stats = run_sync(account_id)
+    assert stats["journal_pages"] == 3
+    assert stats["inserted"] == 15
+    assert stats["apply_batches"] >= 2
+    journal = PageJournal(account_id)
+    assert _state(db, account_id).journal_offset == journal.end_offset()
+    assert [r["cursor"] for r, _ in journal.read_from(0)] == [None, "p1", "p2"]
+
+    # Conditional requests still work: validators were stored when pages were applied
+    stats = run_sync(account_id)
+    assert stats["pages_not_modified"] == 3
+    assert stats["inserted"] == stats["updated"] == 0
+
+def test_failed_apply_is_retried_from_journal_not_provider(client, db, journal_dir, monkeypatch, connected_account):
+    account_id = "user_journal_retry"
+    connected_account(account_id)
+    real_apply_page = app.sync.apply_page
+
+    def broken_apply_page(*args, **kwargs):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(app.sync, "apply_page", broken_apply_page)
+    with pytest.raises(RuntimeError):
+        run_sync(account_id)
+    assert db.query(Transaction).filter_by(account_id=account_id).count() == 0
+    assert _state(db, account_id).journal_offset == 0
+    # The applier failing stops the fetcher, but what it got is on disk
+    journaled = [record for record, _ in PageJournal(account_id).read_from(0)]
+    assert journaled
+
+    # Provider unreachable: replaying must not need it
+    real_fetch = ProviderClient.fetch_transactions_page
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("provider contacted")
+
+    monkeypatch.setattr(app.sync, "apply_page", real_apply_page)
+    monkeypatch.setattr(ProviderClient, "fetch_transactions_page", no_network)
+    stats = replay_journal(account_id)
+    assert stats["items_fetched"] == 5 * len(journaled)
+    assert db.query(Transaction).filter_by(account_id=account_id).count() == 5 * len(journaled)
+    # Already applied: replaying again is a no-op
+    assert replay_journal(account_id)["apply_batches"] == 0
+
+    # Back online, the next sync picks up after the last journaled page
+    # (or starts a new pass if the whole account had been journaled)
+    monkeypatch.setattr(ProviderClient, "fetch_transactions_page", real_fetch)
+    stats = run_sync(account_id)
+    assert stats["pages_fetched"] == (3 - len(journaled) or 3)
+    assert db.query(Transaction).filter_by(account_id=account_id).count() == 15
+
+def test_checkpoint_from_another_journal_falls_back_to_cursor(client, db, journal_dir, monkeypatch, connected_account):
+    account_id = "user_journal_lost"
+    connected_account(account_id)
+    run_sync(account_id)
+    assert _state(db, account_id).journal_offset > 0
+
+    # Journal directory lost (or JOURNAL_DIR changed): the checkpoint points nowhere
+    empty_dir = journal_dir / "elsewhere"
+    monkeypatch.setattr(settings, "JOURNAL_DIR", str(empty_dir))
+    with pytest.raises(JournalMismatchError):
+        replay_journal(account_id)
+
+    configure_mock_account(account_id, revision=1)
+    result = {}
+    sync = threading.Thread(target=lambda: result.update(run_sync(account_id)), daemon=True)
+    sync.start()
+    sync.join(10)
+    assert not sync.is_alive(), "journaled sync never finished"
+    assert result["updated"] == 15
+    assert _state(db, account_id).journal_offset == PageJournal(account_id).end_offset()
+
+def test_applied_segments_are_pruned_after_sync(client, db, journal_dir, monkeypatch, connected_account):
+    account_id = "user_journal_prune"
+    connected_account(account_id)
+    # Small segments: every page record starts a new one
+    monkeypatch.setattr(settings, "JOURNAL_SEGMENT_BYTES", 256)
+    monkeypatch.setattr(settings, "JOURNAL_PRUNE_APPLIED", True)
+    monkeypatch.setattr(settings, "JOURNAL_RETAIN_APPLIED_BYTES", 0)
+
+    def segments():
+        journal = PageJournal(account_id)
+        return sorted(n for n in os.listdir(journal.path) if n.endswith(".seg"))
+
+    stats = run_sync(account_id)
+    assert stats["journal_segments_pruned"] == 2
+    assert len(segments()) == 1
+    # A no-op pass appends and prunes too: disk use doesn't grow run over run
+    for _ in range(3):
+        stats = run_sync(account_id)
+        assert stats["pages_not_modified"] == 3
+        assert len(segments()) == 1
+    assert _state(db, account_id).journal_offset == PageJournal(account_id).end_offset()
+
+    # Pruning off: applied segments stay for replay
+    monkeypatch.setattr(settings, "JOURNAL_PRUNE_APPLIED", False)
+    run_sync(account_id)
+    assert len(segments()) == 4
+
+def _fresh_database(monkeypatch):
+    fresh_engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=fresh_engine)
+    FreshSession = sessionmaker(autocommit=False, autoflush=False, bind=fresh_engine)
+    monkeypatch.setattr(app.sync, "SessionLocal", FreshSession)
+    return FreshSession
+
+def test_replay_into_fresh_database(client, db, journal_dir, monkeypatch, connected_account):
+    for account_id in ("user_journal_a", "user_journal_b"):
+        connected_account(account_id)
+        run_sync(account_id)
+    original = sorted((t.account_id, t.provider_txn_id, t.amount, t.content_hash) for t in db.query(Transaction))
+
+    FreshSession = _fresh_database(monkeypatch)
+
+    assert sorted(journal_accounts()) == ["user_journal_a", "user_journal_b"]
+    for account_id in journal_accounts():
+        replay_journal(account_id)
+    fresh = FreshSession()
+    try:
+        replayed = sorted((t.account_id, t.provider_txn_id, t.amount, t.content_hash) for t in fresh.query(Transaction))
+    finally:
+        fresh.close()
+    assert replayed == original
+
+def test_replay_after_pruning(client, db, journal_dir, monkeypatch, connected_account):
+    account_id = connected_account("user_journal_replay_prune")
+    monkeypatch.setattr(settings, "JOURNAL_SEGMENT_BYTES", 256)
+    # Defaults keep every applied segment, so a fresh database can still be rebuilt
+    for revision in range(3):
+        configure_mock_account(account_id, revision=revision)
+        run_sync(account_id)
+    original = sorted((t.provider_txn_id, t.amount) for t in db.query(Transaction))
+    test_session = app.sync.SessionLocal
+
+    FreshSession = _fresh_database(monkeypatch)
+    replay_journal(account_id)
+    fresh = FreshSession()
+    try:
+        assert sorted((t.provider_txn_id, t.amount) for t in fresh.query(Transaction)) == original
+    finally:
+        fresh.close()
+
+    # With pruning on the first segment goes, and a replay from scratch says so instead of half-applying
+    monkeypatch.setattr(app.sync, "SessionLocal", test_session)
+    monkeypatch.setattr(settings, "JOURNAL_PRUNE_APPLIED", True)
+    monkeypatch.setattr(settings, "JOURNAL_RETAIN_APPLIED_BYTES", 0)
+    assert run_sync(account_id)["journal_segments_pruned"] > 0
+    _fresh_database(monkeypatch)
+    with pytest.raises(JournalMismatchError):
+        replay_journal(account_id)
+
+def test_segments_rotate_and_torn_tail_is_dropped(tmp_path):
+    journal = PageJournal("acct", root=str(tmp_path), segment_bytes=200, fsync=False)
+    offsets = [journal.append({"n": n, "pad": "x" * 60}) for n in range(6)]
+    journal.close()
+    segments = sorted(n for n in os.listdir(journal.path) if n.endswith(".seg"))
+    assert len(segments) == 3
+
+    assert [r["n"] for r, _ in journal.read_from(0)] == list(range(6))
+    assert all(journal.is_boundary(offset) for offset in [0] + offsets)
+    assert not journal.is_boundary(offsets[2] + 3)
+    assert not journal.is_boundary(offsets[-1] + 1)
+    # Resume mid-stream, across a segment boundary
+    assert [r["n"] for r, _ in journal.read_from(offsets[2])] == [3, 4, 5]
+
+    # Crash mid-write: half a record at the tail
+    with open(os.path.join(journal.path, segments[-1]), "ab") as f:
+        f.write(b"\x50\x00\x00\x00garbage")
+    assert [r["n"] for r, _ in journal.read_from(0)] == list(range(6))
+    journal = PageJournal("acct", root=str(tmp_path), segment_bytes=200, fsync=False)
+    assert journal.end_offset() == offsets[-1]
+    journal.append({"n": 6})
+    assert [r["n"] for r, _ in journal.read_from(offsets[-1])] == [6]
+
+    # A whole record's worth of bytes whose CRC doesn't match is dropped too
+    end = journal.end_offset()
+    journal.close()
+    with open(os.path.join(journal.path, segments[-1]), "ab") as f:
+        f.write(b"\x04\x00\x00\x00\x00\x00\x00\x00oops")
+    journal = PageJournal("acct", root=str(tmp_path), segment_bytes=200, fsync=False)
+    assert journal.end_offset() == end
+
+    # Two records per segment: the first two segments end at or before offsets[3]
+    assert journal.prune(offsets[3]) == 2
+    assert [r["n"] for r, _ in journal.read_from(offsets[3])] == [4, 5, 6]
+    journal.close()
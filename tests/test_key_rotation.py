@@ -0,0 +1,109 @@
+import pytest
+import app.key_rotation
+from app.models import Connection, KeyRotationJob
+from app.crypto import encrypt_str, decrypt_str
+from app.key_rotation import reencrypt_connections, job_name_for_key
+from app.settings import settings
+
+OLD_KEY = "old-key"
+NEW_KEY = "new-key"
+
+@pytest.fixture
+def rotated_keys(monkeypatch):
+    monkeypatch.setattr(settings, "TOKEN_KEY", NEW_KEY)
+    monkeypatch.setattr(settings, "TOKEN_KEYS_PREVIOUS", OLD_KEY)
+
+def _seed(db, n):
+    for i in range(n):
+        db.add(Connection(
+            account_id=f"rot_{i}",
+            access_token_enc=encrypt_str(f"at_{i}", token_key=OLD_KEY),
+            refresh_token_enc=encrypt_str(f"rt_{i}", token_key=OLD_KEY) if i % 2 else None
+        ))
+    db.commit()
+
+def test_decrypt_accepts_previous_keys(rotated_keys):
+    old = encrypt_str("secret", token_key=OLD_KEY)
+    assert decrypt_str(old) == "secret"
+    # New ciphertext is readable with the newest key alone
+    assert decrypt_str(encrypt_str("secret"), token_key=NEW_KEY) == "secret"
+    with pytest.raises(ValueError):
+        decrypt_str(encrypt_str("secret", token_key="unknown"))
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_reencrypt_all_connections(db, rotated_keys, workers):
+    _seed(db, 25)
+
+    result = reencrypt_connections(chunk_size=4, workers=workers)
+    assert result["rotated"] == 25
+
+    db.expire_all()
+    for conn in db.query(Connection).all():
+        i = conn.account_id.split("_")[1]
+        assert decrypt_str(conn.access_token_enc, token_key=NEW_KEY) == f"at_{i}"
+        if conn.refresh_token_enc:
+            assert decrypt_str(conn.refresh_token_enc, token_key=NEW_KEY) == f"rt_{i}"
+
+def test_reencrypt_resumes_from_watermark(db, rotated_keys):
+    _seed(db, 10)
+    ids = [c.id for c in db.query(Connection).order_by(Connection.id)]
+
+    # Pretend an earlier run got through the first 6 rows before dying
+    db.add(KeyRotationJob(name=job_name_for_key(NEW_KEY), last_id=ids[5], rotated=6, skipped=0))
+    db.commit()
+
+    result = reencrypt_connections(chunk_size=3, workers=0)
+    assert result["resumed"] is True
+    assert result["rotated"] == 10
+
+    db.expire_all()
+    rows = db.query(Connection).order_by(Connection.id).all()
+    # Rows before the watermark were not touched by this run
+    assert decrypt_str(rows[0].access_token_enc, token_key=OLD_KEY) == "at_0"
+    assert decrypt_str(rows[9].access_token_enc, token_key=NEW_KEY) == "at_9"
+
+    # A finished job is a no-op
+    assert reencrypt_connections(workers=0)["rotated"] == 10
+
+def test_undecryptable_rows_are_reported_and_skipped(db, rotated_keys):
+    _seed(db, 6)
+    ids = [c.id for c in db.query(Connection).order_by(Connection.id)]
+    # One row from a key that is no longer configured, one corrupt
+    db.query(Connection).filter(Connection.id == ids[1]).update({"access_token_enc": encrypt_str("at_1", token_key="gone-key")})
+    db.query(Connection).filter(Connection.id == ids[4]).update({"refresh_token_enc": "not-a-token"})
+    db.commit()
+
+    result = reencrypt_connections(chunk_size=4, workers=0)
+    assert result["rotated"] == 4
+    assert result["failed"] == 2
+    assert result["failed_ids"] == [ids[1], ids[4]]
+    job = db.query(KeyRotationJob).one()
+    assert job.completed_at is not None and job.failed == 2
+
+    db.expire_all()
+    rows = {c.id: c for c in db.query(Connection)}
+    assert decrypt_str(rows[ids[5]].access_token_enc, token_key=NEW_KEY) == "at_5"
+    # Left exactly as they were
+    assert rows[ids[4]].refresh_token_enc == "not-a-token"
+    assert decrypt_str(rows[ids[4]].access_token_enc, token_key=OLD_KEY) == "at_4"
+
+def test_refresh_token_rewritten_meanwhile_is_not_overwritten(db, rotated_keys, monkeypatch):
+    _seed(db, 2)
+    conn = db.query(Connection).filter_by(account_id="rot_1").one()
+    access_enc = conn.access_token_enc
+
+    rotate_chunk = app.key_rotation._rotate_chunk
+    def rotate_then_refresh(rows, token_keys):
+        out = rotate_chunk(rows, token_keys)
+        # A token refresh lands while the chunk is rotating, keeping the access token
+        db.query(Connection).filter_by(account_id="rot_1").update({"refresh_token_enc": encrypt_str("rt_new")})
+        db.commit()
+        return out
+    monkeypatch.setattr(app.key_rotation, "_rotate_chunk", rotate_then_refresh)
+
+    result = reencrypt_connections(chunk_size=10, workers=0)
+    assert result["rotated"] == 1 and result["skipped"] == 1
+    db.expire_all()
+    conn = db.query(Connection).filter_by(account_id="rot_1").one()
+    assert conn.access_token_enc == access_enc
+    assert decrypt_str(conn.refresh_token_enc) == "rt_new"
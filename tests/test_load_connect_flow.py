@@ -0,0 +1,78 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import app.concurrency
+from app.main import app as fastapi_app
+from app.db import get_db
+from app.models import Connection
+from scripts.load_connect_flow import Recorder, percentile, run_load
+from conftest import TestingSessionLocal
+
+def test_percentile_is_nearest_rank():
+    values = [0.01 * n for n in range(1, 101)]
+    assert percentile(values, 50) == values[49]
+    assert percentile(values, 99) == values[98]
+    assert percentile([0.5], 95) == 0.5
+    assert percentile([], 50) is None
+
+def test_recorder_counts_malformed_responses_as_errors():
+    def handler(request):
+        if request.url.path == "/connect/start":
+            return httpx.Response(200, text="<html>not json</html>")
+        return httpx.Response(200, json={})
+
+    async def go():
+        recorder = Recorder()
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://test") as client:
+            for parse in (lambda r: r.json()["authorize_url"], lambda r: r.json()):
+                try:
+                    await recorder.timed("connect_start", client.post("/connect/start"), parse=parse)
+                except ValueError:
+                    pass
+            try:
+                await recorder.timed("provider_authorize", client.get("/provider/authorize"),
+                                     parse=lambda r: r.json()["redirect_to"])
+            except KeyError:
+                pass
+        return recorder.report(1.0)
+
+    report = asyncio.run(go())
+    assert report["endpoints"]["connect_start"]["ok"] == 0
+    assert report["endpoints"]["connect_start"]["errors"] == {"JSONDecodeError": 2}
+    assert report["endpoints"]["provider_authorize"]["errors"] == {"KeyError": 1}
+    assert report["requests_total"] == 3
+
+def test_run_load_against_mock_provider(client, db, monkeypatch):
+    # Each request gets its own session, as in production
+    def fresh_db():
+        session = TestingSessionLocal()
+        try:
+            yield session
+        finally:
+            session.close()
+    fastapi_app.dependency_overrides[get_db] = fresh_db
+    # The test DB is a single shared in-memory connection, so keep DB work on one thread
+    monkeypatch.setattr(app.concurrency, "db_executor", ThreadPoolExecutor(max_workers=1))
+
+    def load(users, do_sync):
+        return asyncio.run(run_load(
+            "http://127.0.0.1:8000", users=users, rate=0, timeout=30, max_connections=10, do_sync=do_sync, seed=0,
+            transport=httpx.ASGITransport(app=fastapi_app),
+        ))
+
+    report = load(users=3, do_sync=False)
+    assert report["flows_ok"] == 3
+    assert report["flows_failed"] == 0
+    assert report["requests_total"] == 9
+    for name, endpoint in report["endpoints"].items():
+        assert endpoint["ok"] == (0 if name == "sync_run" else 3)
+        assert endpoint["errors"] == {}
+    start = report["endpoints"]["connect_start"]
+    assert start["p50_ms"] <= start["p99_ms"] <= start["max_ms"]
+    assert db.query(Connection).filter(Connection.account_id.like("load_%")).count() == 3
+
+    # Syncs on the shared in-memory test connection can't overlap, so one user covers the last step
+    report = load(users=1, do_sync=True)
+    assert report["flows_ok"] == 1
+    assert report["endpoints"]["sync_run"]["ok"] == 1
+    assert report["endpoints"]["sync_run"]["errors"] == {}
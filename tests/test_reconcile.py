@@ -0,0 +1,101 @@
+from datetime import timedelta
+import pytest
+import app.reconcile
+from app.models import Transaction, DayBucket, SyncLease
+from app.provider_mock import configure_mock_account, mock_digests
+from app.buckets import local_digests
+from app.reconcile import reconcile_account
+from app.settings import settings
+from app.single_flight import LeaseLostError, sync_flight, _now
+from app.sync import run_sync
+
+PROFILE = {"pages": 6, "page_size": 10, "history_days": 150}
+
+def test_sync_maintains_day_buckets_incrementally(client, db, connected_account):
+    account_id = "user_buckets"
+    connected_account(account_id, **PROFILE)
+
+    stats = run_sync(account_id)
+    # History spans both tiers
+    assert 0 < stats["routed_cold"] < 60
+    assert local_digests(db, account_id, "day") == mock_digests(account_id, "day")
+
+    # Updates move a row's hash out of its bucket and the new one in
+    configure_mock_account(account_id, revision=1, **PROFILE)
+    run_sync(account_id)
+    assert local_digests(db, account_id, "day") == mock_digests(account_id, "day")
+    assert local_digests(db, account_id, "month") == mock_digests(account_id, "month")
+
+def test_reconcile_refetches_only_drifted_days(client, db, connected_account):
+    account_id = "user_reconcile"
+    connected_account(account_id, **PROFILE)
+    run_sync(account_id)
+
+    clean = client.post("/sync/reconcile", json={"account_id": account_id}).json()["stats"]
+    assert clean["months_checked"] > 0
+    assert clean["months_mismatched"] == 0
+    assert clean["pages_fetched"] == 0
+
+    # Provider edits an old (cold) and a recent (hot) item and drops another
+    configure_mock_account(account_id, edited={2, 55}, deleted={40}, **PROFILE)
+
+    stats = client.post("/sync/reconcile", json={"account_id": account_id}).json()["stats"]
+    assert stats["days_mismatched"] == 3
+    assert stats["items_fetched"] < 10
+    assert (stats["updated"], stats["inserted"], stats["deleted"]) == (2, 0, 1)
+    assert db.query(Transaction).filter_by(provider_txn_id=f"txn_{account_id}_40").count() == 0
+    assert local_digests(db, account_id, "day") == mock_digests(account_id, "day")
+
+    again = reconcile_account(account_id)
+    assert again["months_mismatched"] == 0
+
+def test_reconcile_builds_missing_buckets_without_refetching(client, db, connected_account):
+    account_id = "user_reconcile_legacy"
+    connected_account(account_id, **PROFILE)
+    run_sync(account_id)
+    # As if synced before buckets existed
+    db.query(DayBucket).delete()
+    db.commit()
+
+    stats = reconcile_account(account_id)
+    assert stats["buckets_rebuilt"] is True
+    assert stats["months_mismatched"] == 0
+    assert stats["pages_fetched"] == 0
+
+def test_reconcile_waits_for_a_running_sync(client, db, monkeypatch, connected_account):
+    account_id = "user_reconcile_leased"
+    connected_account(account_id, **PROFILE)
+    run_sync(account_id)
+    db.query(DayBucket).delete()
+    # Another sync of this account now holds the lease in another worker
+    db.query(SyncLease).filter_by(account_id=account_id).update({"owner": "other-worker", "expires_at": _now() + timedelta(minutes=5)})
+    db.commit()
+
+    monkeypatch.setattr(settings, "SYNC_LEASE_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(settings, "SYNC_LEASE_WAIT_SECONDS", 0.05)
+
+    resp = client.post("/sync/reconcile", json={"account_id": account_id})
+    assert resp.status_code == 409
+    # Didn't start: the buckets weren't rebuilt behind the running sync
+    assert db.query(DayBucket).filter_by(account_id=account_id).count() == 0
+
+def test_reconcile_stops_writing_once_its_lease_is_taken_over(client, db, monkeypatch, connected_account):
+    account_id = "user_reconcile_lost"
+    connected_account(account_id, **PROFILE)
+    run_sync(account_id)
+    configure_mock_account(account_id, edited={2, 55}, deleted={40}, **PROFILE)
+    before = local_digests(db, account_id, "day")
+
+    apply_page = app.reconcile.apply_page
+    def stalled_apply_page(session, account_id, items, stats):
+        # The holder stalled past its TTL and another worker took the lease over
+        session.query(SyncLease).update({"owner": "other-worker", "generation": SyncLease.generation + 1})
+        apply_page(session, account_id, items, stats)
+    monkeypatch.setattr(app.reconcile, "apply_page", stalled_apply_page)
+
+    with pytest.raises(LeaseLostError):
+        reconcile_account(account_id)
+    db.expire_all()
+    assert local_digests(db, account_id, "day") == before
+    assert db.query(Transaction).filter_by(provider_txn_id=f"txn_{account_id}_40").count() == 1
+    assert sync_flight.snapshot()["in_flight"] == []
@@ -22,9 +22,9 @@ def test_idempotency(client, db):
     assert resp2.status_code == 200
     stats2 = resp2.json()["stats"]
     assert stats2["inserted"] == 0
-    # Might be 'updated' if logic detects change or blindly updates.
-    # Our logic: checks existing. If exists, updates.
-    assert stats2["updated"] == 15
+    # Pages are unchanged, so the provider answers 304 and nothing is rewritten.
+    assert stats2["pages_not_modified"] == 3
+    assert stats2["updated"] == 0
     
     # Verify DB count stable
     count = db.query(Transaction).filter_by(account_id=account_id).count()
@@ -0,0 +1,59 @@
+from sqlalchemy import create_engine, inspect, text
+from app.schema import upgrade_schema
+
+# Tables as the first release created them
+OLD_SCHEMA = [
+    """CREATE TABLE transactions (
+        id INTEGER PRIMARY KEY, account_id VARCHAR NOT NULL, provider_txn_id VARCHAR NOT NULL,
+        amount INTEGER NOT NULL, currency VARCHAR, description VARCHAR, posted_at DATETIME NOT NULL,
+        raw_json TEXT, created_at DATETIME
+    )""",
+    """CREATE TABLE sync_state (
+        id INTEGER PRIMARY KEY, account_id VARCHAR NOT NULL UNIQUE, cursor TEXT,
+        last_synced_at DATETIME, updated_at DATETIME
+    )""",
+    """CREATE TABLE transaction_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, account_id VARCHAR NOT NULL,
+        transaction_id INTEGER NOT NULL, provider_txn_id VARCHAR NOT NULL,
+        op VARCHAR NOT NULL, created_at DATETIME
+    )""",
+    """CREATE TABLE key_rotation_jobs (
+        id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE, last_id INTEGER NOT NULL,
+        rotated INTEGER NOT NULL, skipped INTEGER NOT NULL, completed_at DATETIME, updated_at DATETIME
+    )""",
+    "CREATE INDEX ix_transaction_changes_transaction_id ON transaction_changes (transaction_id)",
+    "CREATE INDEX ix_transaction_changes_account_seq ON transaction_changes (account_id, seq)",
+]
+
+def test_upgrade_old_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        for statement in OLD_SCHEMA:
+            conn.exec_driver_sql(statement)
+        conn.exec_driver_sql("INSERT INTO sync_state (account_id, cursor) VALUES ('a', 'p2')")
+        for seq in (1, 2, 3):
+            conn.exec_driver_sql(f"INSERT INTO transaction_changes (seq, account_id, transaction_id, provider_txn_id, op) VALUES ({seq}, 'a', {seq}, 't{seq}', 'insert')")
+        # Compacted away: seq 3 must never be handed out again
+        conn.exec_driver_sql("DELETE FROM transaction_changes WHERE seq = 3")
+
+    applied = upgrade_schema(engine)
+    assert applied == [
+        "add transactions.content_hash",
+        "add sync_state.journal_offset",
+        "add key_rotation_jobs.failed",
+        "drop not null transaction_changes.transaction_id",
+    ]
+    inspector = inspect(engine)
+    assert "content_hash" in {c["name"] for c in inspector.get_columns("transactions")}
+    assert {i["name"] for i in inspector.get_indexes("transaction_changes")} == {
+        "ix_transaction_changes_transaction_id", "ix_transaction_changes_account_seq"
+    }
+    with engine.begin() as conn:
+        assert conn.execute(text("SELECT journal_offset FROM sync_state")).scalar() == 0
+        assert conn.execute(text("SELECT count(*) FROM transaction_changes")).scalar() == 2
+        # A cold-tier change, which the old NOT NULL rejected
+        conn.exec_driver_sql("INSERT INTO transaction_changes (account_id, transaction_id, provider_txn_id, op) VALUES ('a', NULL, 't9', 'insert')")
+        assert conn.execute(text("SELECT max(seq) FROM transaction_changes")).scalar() == 4
+
+    assert upgrade_schema(engine) == []
+    engine.dispose()
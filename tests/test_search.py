@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app.models import Transaction
+from app.search import FTS_TABLE, ensure_search_index, search_transactions, _account_token, _search_like
+from app.provider_mock import configure_mock_account
+from app.sync import run_sync
+from app.archive import archive_old_transactions
+
+def _add(db, account_id, descriptions):
+    base = datetime(2024, 1, 1)
+    for n, description in enumerate(descriptions):
+        db.add(Transaction(
+            account_id=account_id,
+            provider_txn_id=f"{account_id}_{n}",
+            amount=100 + n,
+            posted_at=base + timedelta(days=n),
+            description=description
+        ))
+    db.commit()
+
+def _search(client, account_id, q, **params):
+    resp = client.get("/transactions/search", params={"account_id": account_id, "q": q, **params})
+    assert resp.status_code == 200
+    return resp.json()
+
+def test_search_is_ranked_scoped_and_prefix_matched(client, db):
+    _add(db, "acct_a", ["Blue Bottle Coffee", "Coffee coffee coffee refill", "Grocery store", "Starbucks"])
+    _add(db, "acct_b", ["Coffee elsewhere"])
+
+    results = _search(client, "acct_a", "coffee")["results"]
+    assert [r["description"] for r in results] == ["Coffee coffee coffee refill", "Blue Bottle Coffee"]
+    assert results[0]["score"] >= results[1]["score"]
+    assert [r["description"] for r in _search(client, "acct_a", "star")["results"]] == ["Starbucks"]
+    assert [r["description"] for r in _search(client, "acct_a", "bottle cof")["results"]] == ["Blue Bottle Coffee"]
+    # FTS syntax in the input is treated as text
+    assert _search(client, "acct_a", 'coffee" OR "grocery')["results"] == []
+
+def test_search_keyset_pagination_covers_every_match_once(client, db):
+    _add(db, "acct_page", [f"Coffee shop {n}" + " coffee" * (n % 3) for n in range(23)])
+
+    seen, cursor = [], None
+    while True:
+        page = _search(client, "acct_page", "coffee", limit=5, **({"cursor": cursor} if cursor else {}))
+        seen.extend(r["id"] for r in page["results"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert len(seen) == len(set(seen)) == 23
+    assert client.get("/transactions/search", params={"account_id": "acct_page", "q": "x", "cursor": "bogus"}).status_code == 400
+
+def test_sync_keeps_index_current(client, db, connected_account):
+    account_id = connected_account("user_search", pages=2, page_size=5, history_days=10)
+
+    run_sync(account_id)
+    assert len(_search(client, account_id, "mock txn")["results"]) == 10
+    assert _search(client, account_id, "rev")["results"] == []
+
+    # Edited descriptions are re-indexed
+    configure_mock_account(account_id, pages=2, page_size=5, history_days=10, revision=1)
+    run_sync(account_id)
+    assert len(_search(client, account_id, "rev 1")["results"]) == 10
+
+    # Deleted (e.g. archived) rows leave the index
+    db.query(Transaction).filter_by(account_id=account_id).delete()
+    db.commit()
+    assert _search(client, account_id, "mock")["results"] == []
+
+def test_search_says_archived_rows_are_not_covered(client, db):
+    _add(db, "acct_scope", ["Coffee beans"])
+    assert len(_search(client, "acct_scope", "coffee")["results"]) == 1
+
+    # Posted in 2024, well past the hot window
+    assert archive_old_transactions()["archived"] == 1
+    page = _search(client, "acct_scope", "coffee")
+    assert page["results"] == []
+    assert page["includes_archived"] is False
+    assert datetime.fromisoformat(page["archive_cutoff"]) > datetime(2024, 1, 1)
+    # Still listed, just not searchable
+    assert [r["description"] for r in client.get("/v2/transactions", params={"account_id": "acct_scope"}).json()] == ["Coffee beans"]
+
+def test_search_is_scoped_to_the_exact_account(client, db):
+    _add(db, "acct_c", ["Coffee here"])
+    _add(db, "acct_c_2", ["Coffee there"])
+    _add(db, "acct c", ["Coffee with a space"])
+    # Another account's token in a description is just text
+    _add(db, "acct_d", [f"{_account_token('acct_c')} coffee"])
+
+    for account_id, description in [("acct_c", "Coffee here"), ("acct_c_2", "Coffee there"), ("acct c", "Coffee with a space")]:
+        assert [r["description"] for r in _search(client, account_id, "coffee")["results"]] == [description]
+    assert _search(client, "acct_c", _account_token("acct_c"))["results"] == []
+
+def test_unscoped_index_is_upgraded(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    Base.metadata.create_all(bind=engine)
+    # As built by the first version: external content, description only
+    with engine.begin() as conn:
+        for statement in ["transactions_fts_ai", "transactions_fts_ad", "transactions_fts_au"]:
+            conn.exec_driver_sql(f"DROP TRIGGER {statement}")
+        conn.exec_driver_sql(f"DROP TABLE {FTS_TABLE}")
+        conn.exec_driver_sql(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(description, content='transactions', content_rowid='id')")
+    session = sessionmaker(bind=engine)()
+    try:
+        _add(session, "acct_old", ["Coffee beans", "Tea"])
+        ensure_search_index(engine)
+        ensure_search_index(engine)  # a no-op once upgraded
+        assert [r["description"] for r in search_transactions(session, "acct_old", "coff")["results"]] == ["Coffee beans"]
+        # Triggers are back: new rows are indexed
+        _add(session, "acct_new", ["Coffee again"])
+        assert len(search_transactions(session, "acct_new", "coffee")["results"]) == 1
+    finally:
+        session.close()
+        engine.dispose()
+
+def test_like_fallback_treats_wildcards_literally(db):
+    _add(db, "acct_like", ["50% off", "500 off", "a_b", "axb", "back\\slash"])
+
+    def found(q):
+        return [r["description"] for r in _search_like(db, "acct_like", q, 10, None)["results"]]
+    assert found("50%") == ["50% off"]
+    assert found("a_b") == ["a_b"]
+    assert found("k\\s") == ["back\\slash"]
@@ -0,0 +1,193 @@
+import json
+import threading
+from datetime import timedelta
+import pytest
+import app.single_flight
+import app.sync
+from app.models import SyncLease, Transaction
+from app.settings import settings
+from app.single_flight import SyncSingleFlight, SyncInProgressError, SharedSyncError, LeaseLostError, sync_flight, _now
+
+@pytest.fixture
+def fast_lease(monkeypatch):
+    monkeypatch.setattr(settings, "SYNC_LEASE_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(settings, "SYNC_LEASE_WAIT_SECONDS", 5.0)
+
+def _run_concurrently(flight, account_id, fn, n):
+    results = [None] * n
+    def call(i):
+        results[i] = flight.run(account_id, fn)
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    return threads, results
+
+def test_concurrent_calls_share_one_run(db):
+    flight = SyncSingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow_sync():
+        calls.append(1)
+        release.wait(5)
+        return {"pages_fetched": 3}
+
+    threads, results = _run_concurrently(flight, "user_sf", slow_sync, 4)
+    while flight.snapshot()["coalesced"] < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert all(r["pages_fetched"] == 3 for r in results)
+    assert sorted(bool(r.get("coalesced")) for r in results) == [False, True, True, True]
+    # The lease is released with the result stored for other workers
+    lease = db.query(SyncLease).filter(SyncLease.account_id == "user_sf").one()
+    assert lease.owner is None and lease.generation == 1
+    assert json.loads(lease.last_result) == {"pages_fetched": 3}
+
+    # Once finished, the next call runs again
+    flight.run("user_sf", slow_sync)
+    assert len(calls) == 2
+
+def test_exclusive_call_waits_and_runs_its_own(db):
+    flight = SyncSingleFlight()
+    release = threading.Event()
+    started = threading.Event()
+    calls = []
+
+    def slow_sync():
+        calls.append("sync")
+        started.set()
+        release.wait(5)
+        return {"pages_fetched": 3}
+
+    syncer = threading.Thread(target=flight.run, args=("user_sf", slow_sync))
+    syncer.start()
+    started.wait(5)
+    results = []
+    backfill = threading.Thread(target=lambda: results.append(flight.run("user_sf", lambda: calls.append("backfill") or {"inserted": 9}, share=False)))
+    backfill.start()
+    backfill.join(0.1)
+    # Not coalesced onto the sync, and not running beside it
+    assert backfill.is_alive() and calls == ["sync"]
+    release.set()
+    syncer.join()
+    backfill.join(5)
+
+    assert calls == ["sync", "backfill"]
+    assert results == [{"inserted": 9}]
+    assert flight.snapshot()["coalesced"] == 0
+
+def _other_worker_finishes(monkeypatch, db, after_polls, **values):
+    # Single-threaded: the in-memory test database is one shared connection
+    polls = []
+    def fake_sleep(seconds):
+        polls.append(seconds)
+        if len(polls) == after_polls:
+            db.query(SyncLease).update(dict(values, owner=None, expires_at=None))
+            db.commit()
+    monkeypatch.setattr(app.single_flight.time, "sleep", fake_sleep)
+    return polls
+
+def test_waits_for_lease_held_by_another_worker(db, monkeypatch, fast_lease):
+    db.add(SyncLease(account_id="user_sf", owner="other-worker", generation=4, expires_at=_now() + timedelta(minutes=5)))
+    db.commit()
+    polls = _other_worker_finishes(monkeypatch, db, 3, last_result=json.dumps({"inserted": 7}))
+    calls = []
+
+    result = SyncSingleFlight().run("user_sf", lambda: calls.append(1) or {})
+    assert len(polls) == 3
+    assert calls == []
+    assert result == {"inserted": 7, "coalesced": True}
+
+def test_failed_run_in_another_worker_is_shared(db, monkeypatch, fast_lease):
+    db.add(SyncLease(account_id="user_sf", owner=None, generation=2, last_error="provider down"))
+    db.commit()
+    flight = SyncSingleFlight()
+    # Free lease: this worker runs itself, the old error doesn't leak in
+    assert flight.run("user_sf", lambda: {"inserted": 1}) == {"inserted": 1}
+
+    db.query(SyncLease).update({"owner": "other-worker", "expires_at": _now() + timedelta(minutes=5)})
+    db.commit()
+    _other_worker_finishes(monkeypatch, db, 1, last_result=None, last_error="token revoked")
+    with pytest.raises(SharedSyncError, match="token revoked"):
+        flight.run("user_sf", lambda: {})
+
+def test_exclusive_call_takes_the_lease_once_released(db, monkeypatch, fast_lease):
+    db.add(SyncLease(account_id="user_sf", owner="other-worker", generation=4, expires_at=_now() + timedelta(minutes=5)))
+    db.commit()
+    _other_worker_finishes(monkeypatch, db, 2, last_result=json.dumps({"inserted": 7}))
+
+    result = SyncSingleFlight().run("user_sf", lambda: {"inserted": 9}, share=False)
+    assert result == {"inserted": 9}
+    db.expire_all()
+    assert db.query(SyncLease.generation).filter(SyncLease.account_id == "user_sf").scalar() == 5
+
+def test_expired_lease_is_taken_over(db, fast_lease):
+    db.add(SyncLease(account_id="user_sf", owner="crashed-worker", generation=1, expires_at=_now() - timedelta(seconds=1)))
+    db.commit()
+    assert SyncSingleFlight().run("user_sf", lambda: {"inserted": 2}) == {"inserted": 2}
+    db.expire_all()
+    assert db.query(SyncLease.generation).filter(SyncLease.account_id == "user_sf").scalar() == 2
+
+def test_sync_run_returns_409_when_other_worker_does_not_finish(client, db, monkeypatch, fast_lease, connected_account):
+    monkeypatch.setattr(settings, "SYNC_LEASE_WAIT_SECONDS", 0.05)
+    connected_account("user_sf")
+    db.add(SyncLease(account_id="user_sf", owner="other-worker", generation=1, expires_at=_now() + timedelta(minutes=5)))
+    db.commit()
+
+    resp = client.post("/sync/run", json={"account_id": "user_sf"})
+    assert resp.status_code == 409
+    # When the holder's lease runs out, not a fixed second
+    assert 295 <= int(resp.headers["Retry-After"]) <= 301
+    assert db.query(Transaction).count() == 0
+
+    db.query(SyncLease).update({"owner": None})
+    db.commit()
+    stats = client.post("/sync/run", json={"account_id": "user_sf"}).json()["stats"]
+    assert stats["inserted"] == 15
+
+def test_in_process_waiter_gives_up_after_wait_cap(db, monkeypatch):
+    monkeypatch.setattr(settings, "SYNC_LEASE_WAIT_SECONDS", 0.05)
+    flight = SyncSingleFlight()
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow_sync():
+        started.set()
+        release.wait(5)
+        return {}
+
+    leader = threading.Thread(target=flight.run, args=("user_sf", slow_sync))
+    leader.start()
+    started.wait(5)
+    try:
+        with pytest.raises(SyncInProgressError) as excinfo:
+            flight.run("user_sf", lambda: {})
+        # Retry once the leader's lease would have run out
+        assert 55 <= excinfo.value.retry_after <= 60
+    finally:
+        release.set()
+        leader.join()
+
+def test_sync_stops_writing_once_its_lease_is_taken_over(client, db, monkeypatch, connected_account):
+    connected_account("user_sf")
+
+    apply_page = app.sync.apply_page
+    pages = []
+    def stalled_apply_page(session, account_id, items, stats):
+        pages.append(1)
+        if len(pages) == 2:
+            # The holder stalled past its TTL and another worker took the lease over
+            session.query(SyncLease).update({"owner": "other-worker", "generation": SyncLease.generation + 1})
+        apply_page(session, account_id, items, stats)
+    monkeypatch.setattr(app.sync, "apply_page", stalled_apply_page)
+
+    with pytest.raises(LeaseLostError):
+        app.sync.run_sync("user_sf")
+    db.expire_all()
+    # The first page committed; the second, and everything after, didn't
+    assert db.query(Transaction).count() == 5
+    assert sync_flight.snapshot()["in_flight"] == []
@@ -0,0 +1,39 @@
+import logging
+import tracemalloc
+from app.models import Transaction, TransactionArchive
+from app.sync import run_sync
+
+PAGE_SIZE = 50
+
+def _peak_sync_memory(connected_account, account_id, pages):
+    connected_account(account_id, pages=pages, page_size=PAGE_SIZE, history_days=365)
+
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    stats = run_sync(account_id)
+    _, peak = tracemalloc.get_traced_memory()
+
+    assert stats["inserted"] == pages * PAGE_SIZE
+    return peak - baseline
+
+def test_sync_peak_memory_flat_in_page_count(client, db, connected_account):
+    # pytest keeps every captured log record, which would grow with page count
+    logging.disable(logging.CRITICAL)
+    tracemalloc.start()
+    try:
+        # Warm-up so one-off allocations (statement caches, imports) don't skew the first run
+        _peak_sync_memory(connected_account, "mem_warmup", 2)
+        small = _peak_sync_memory(connected_account, "mem_small", 10)
+        large = _peak_sync_memory(connected_account, "mem_large", 80)
+    finally:
+        tracemalloc.stop()
+        logging.disable(logging.NOTSET)
+
+    hot = db.query(Transaction).filter_by(account_id="mem_large").count()
+    cold = sum(s.row_count for s in db.query(TransactionArchive).filter_by(account_id="mem_large"))
+    # A year of history: most of it goes through the cold tier
+    assert cold > hot > 0
+    assert hot + cold == 80 * PAGE_SIZE
+    # 8x the pages must not mean 8x the memory: peak is bounded by page size.
+    # The slack absorbs GC timing noise, a per-page leak would blow well past it.
+    assert large < small * 2, f"peak grew from {small} to {large} bytes"
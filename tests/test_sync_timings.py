@@ -0,0 +1,54 @@
+import os
+import time
+import pstats
+from app.settings import settings
+
+def test_stats_include_phase_timings(client, db, connected_account):
+    account_id = "user_timings"
+    connected_account(account_id)
+
+    resp = client.post("/sync/run", json={"account_id": account_id, "rl": True})
+    assert resp.status_code == 200
+    timings = resp.json()["stats"]["timings"]
+
+    for phase in ("network", "db_upsert", "db_commit", "backoff_sleep", "other", "total"):
+        assert phase in timings
+    # rl=True forces one 429 with Retry-After: 1
+    assert timings["backoff_sleep"] >= 1.0
+    assert timings["total"] >= sum(v for k, v in timings.items() if k != "total") - 1e-3
+
+def test_profile_flag_writes_profile(client, db, tmp_path, monkeypatch, connected_account):
+    monkeypatch.setattr(settings, "SYNC_PROFILE_DIR", str(tmp_path))
+    account_id = "user_profile"
+    connected_account(account_id)
+
+    # Refused unless per-request profiling is switched on
+    resp = client.post("/sync/run", json={"account_id": account_id, "profile": True})
+    assert resp.status_code == 403
+    assert os.listdir(tmp_path) == []
+    monkeypatch.setattr(settings, "SYNC_PROFILE_REQUESTS_ENABLED", True)
+
+    stats = client.post("/sync/run", json={"account_id": account_id, "profile": True}).json()["stats"]
+    path = stats["profile_path"]
+    assert os.path.dirname(path) == str(tmp_path)
+    # Loadable by the standard tooling (pstats / snakeviz)
+    assert pstats.Stats(path).total_calls > 0
+
+    # Off by default
+    stats = client.post("/sync/run", json={"account_id": account_id}).json()["stats"]
+    assert "profile_path" not in stats
+
+def test_profile_dumps_are_capped(client, db, tmp_path, monkeypatch, connected_account):
+    monkeypatch.setattr(settings, "SYNC_PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "SYNC_PROFILE_REQUESTS_ENABLED", True)
+    monkeypatch.setattr(settings, "SYNC_PROFILE_MAX_FILES", 2)
+    account_id = "user_profile_cap"
+    connected_account(account_id)
+    # Not a dump: left alone
+    (tmp_path / "notes.txt").write_text("keep me")
+
+    paths = []
+    for _ in range(4):
+        paths.append(client.post("/sync/run", json={"account_id": account_id, "profile": True}).json()["stats"]["profile_path"])
+        time.sleep(0.01)
+    assert sorted(os.listdir(tmp_path)) == sorted(["notes.txt"] + [os.path.basename(p) for p in paths[-2:]])
@@ -0,0 +1,96 @@
+import json
+from datetime import datetime
+from app.models import Transaction, WebhookEvent
+from app.provider_mock import emit_webhooks, build_webhook_event
+from app.webhooks import SyncDebouncer, debouncer, sign_payload
+
+def test_debouncer_coalesces_bursts():
+    synced = []
+    d = SyncDebouncer(quiet_seconds=5, max_wait_seconds=60, batch_size=10, sync_fn=lambda a: synced.append(a) or {})
+
+    for t in range(4):
+        d.mark_dirty("acct_a", now=t)
+    d.mark_dirty("acct_b", now=1)
+
+    # acct_a is still receiving notifications
+    assert d.flush_due(now=7) == {"acct_b": {}}
+    assert d.flush_due(now=7.5) == {}
+    assert synced == ["acct_b"]
+
+    d.flush_due(now=8)
+    assert synced == ["acct_b", "acct_a"]
+    assert d.snapshot() == {"dirty_accounts": 0, "notifications": 5, "syncs_run": 2, "syncs_failed": 0, "retrying": 0}
+
+def test_debouncer_max_wait_and_batches():
+    synced = []
+    d = SyncDebouncer(quiet_seconds=5, max_wait_seconds=10, batch_size=2, sync_fn=lambda a: synced.append(a) or {})
+
+    # A steady trickle never goes quiet, but max_wait still forces a sync
+    for t in range(0, 12, 2):
+        d.mark_dirty("chatty", now=t)
+    assert list(d.flush_due(now=10)) == ["chatty"]
+
+    for i in range(5):
+        d.mark_dirty(f"acct_{i}", now=20)
+    assert len(d.flush_due(now=30)) == 2
+    assert len(d.flush_due(now=30)) == 2
+    assert len(d.flush_due(now=30)) == 1
+
+def test_failed_sync_is_retried_with_backoff():
+    attempts = []
+    def flaky_sync(account_id):
+        attempts.append(account_id)
+        if len(attempts) <= 2:
+            raise RuntimeError("provider down")
+        return {"inserted": 1}
+    d = SyncDebouncer(quiet_seconds=5, max_wait_seconds=60, retry_base_seconds=10, retry_max_seconds=15, sync_fn=flaky_sync)
+
+    d.mark_dirty("acct", now=0)
+    assert d.flush_due(now=5) == {"acct": {"error": "provider down"}}
+    # Still dirty, waiting out the backoff; a new notification doesn't cut it short
+    assert d.snapshot()["retrying"] == 1
+    d.mark_dirty("acct", now=6)
+    assert d.flush_due(now=14) == {}
+    assert "error" in d.flush_due(now=15)["acct"]
+    # Second failure: doubled, but capped
+    assert d.flush_due(now=29) == {}
+    assert d.flush_due(now=30) == {"acct": {"inserted": 1}}
+    assert attempts == ["acct"] * 3
+    assert d.snapshot() == {"dirty_accounts": 0, "notifications": 2, "syncs_run": 3, "syncs_failed": 2, "retrying": 0}
+
+def test_webhook_burst_triggers_single_sync(client, db, connected_account):
+    account_id = connected_account("user_webhook")
+
+    # Mock provider emits a burst of signed notifications
+    assert emit_webhooks(account_id, count=5, post=client.post) == [202] * 5
+    assert debouncer.snapshot()["dirty_accounts"] == 1
+
+    results = debouncer.flush_due(now=float("inf"))
+    assert list(results) == [account_id]
+    assert results[account_id]["inserted"] == 15
+    assert db.query(Transaction).filter_by(account_id=account_id).count() == 15
+
+def test_webhook_rejects_bad_signature(client, db):
+    body = json.dumps({"event": "transactions.updated", "account_id": "x"})
+    resp = client.post("/webhooks/provider", content=body, headers={"X-Provider-Signature": "bogus"})
+    assert resp.status_code == 401
+
+def test_webhook_for_unknown_account_is_ignored(client, db):
+    assert emit_webhooks("nobody", post=client.post) == [202]
+    assert debouncer.snapshot()["dirty_accounts"] == 0
+
+def test_replayed_event_is_not_queued_twice(client, db, connected_account):
+    account_id = connected_account("user_webhook_replay")
+    # Remembered long enough ago to be pruned
+    db.add(WebhookEvent(event_id="evt-old", account_id=account_id, received_at=datetime(2000, 1, 1)))
+    db.commit()
+
+    body = json.dumps(dict(build_webhook_event(account_id), event_id="evt-1")).encode("utf-8")
+    headers = {"X-Provider-Signature": sign_payload(body)}
+    assert client.post("/webhooks/provider", content=body, headers=headers).json() == {"status": "queued"}
+    debouncer.reset()
+
+    # The provider retries the same delivery
+    assert client.post("/webhooks/provider", content=body, headers=headers).json() == {"status": "duplicate"}
+    assert debouncer.snapshot()["notifications"] == 0
+    assert [e.event_id for e in db.query(WebhookEvent)] == ["evt-1"]